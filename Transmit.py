@@ -1,10 +1,18 @@
 import os
+import re
+import html
+import shutil
+import sqlite3
+import struct
+import threading
+import time
 from abc import ABC, abstractmethod
 
-import requests
 from bs4 import BeautifulSoup
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
+from compression import Codec, PLAIN
 
 
 
@@ -55,35 +63,275 @@ class LocalReadWrite:
         """彻底删除用户数据"""
         os.remove(self.get_path(address))
 
+    def append_many(self, address, contents: list):
+        """一次追加多条，只打开一次文件"""
+        self.append(address, "".join(contents))
 
-class WebnoteReadWrite:
-    """读取和提交到 webnote"""
-    def read(self, url):
-        """提取原本的数据"""
-        old = ""
-        response = requests.get(url, verify=False)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        textarea = soup.find('textarea', {'id': 'content'})
+    def append_chunks(self, address, chunks):
+        """流式追加，一次打开文件，逐块写入"""
+        with open(self.get_path(address), 'a', encoding='utf-8') as f:
+            for chunk in chunks:
+                f.write(chunk)
+
+    def list_addresses(self) -> list:
+        """所有有数据的用户"""
+        if not os.path.isdir(self.rootpath):
+            return []
+        names = [name[:-len(self.suffix)] if self.suffix else name for name in os.listdir(self.rootpath) if name.endswith(self.suffix)]
+        return [name for name in names if is_user_address(name)]
+
+    def bulk_load(self, items: list):
+        """迁移用，items 是 [(用户, 记录列表)]，覆盖这些用户的数据"""
+        for address, records in items:
+            self._write(address, "".join(records))
+
+
+class SegmentReadWrite:
+    """
+    以追加式分段文件保存到本地，每个用户一个目录，每次追加是一条记录
+    目录里有若干段文件 000001.log ，和一个索引文件 index，索引每项定长，记录 (段号, 偏移, 长度, 时间戳)
+    因此统计数量、取最早一条、删除最后一条，只需读写索引的一项，不必读取全部内容
+    """
+    record_based = True
+    ENTRY = struct.Struct("<IQQd")   # 段号，偏移，字节长度，保存时间
+
+    def __init__(self, rootpath_of_store: str, suffix: str=".seg", segment_size: int=4*1024*1024, codec: Codec=None):
+        self.rootpath = rootpath_of_store
+        self.suffix = suffix
+        self.segment_size = segment_size   # 段文件超过这个字节数，就新开一段
+        self.codec = codec if codec else PLAIN   # 每条记录单独压缩成一帧，索引记录的是压缩后的长度
+        self._active = {}   # 缓存每个用户正在追加的段号
+
+    def get_path(self, address, bak: str="") -> str:
+        return os.path.join(self.rootpath, f"{address}{bak}{self.suffix}")
+
+    def _index_path(self, address) -> str:
+        return os.path.join(self.get_path(address), "index")
+
+    def _segment_path(self, address, seg_no: int) -> str:
+        return os.path.join(self.get_path(address), f"{seg_no:06d}.log")
+
+    def _active_segment(self, address) -> int:
+        """得到正在追加的段号，写满了就开新的一段"""
+        seg_no = self._active.get(address)
+        if seg_no is None:
+            seg_nos = [int(name[:-4]) for name in os.listdir(self.get_path(address)) if name.endswith(".log")]
+            seg_no = max(seg_nos, default=1)
+        seg_path = self._segment_path(address, seg_no)
+        if os.path.exists(seg_path) and os.path.getsize(seg_path) >= self.segment_size:
+            seg_no += 1
+        self._active[address] = seg_no
+        return seg_no
+
+    def _write_record(self, address, seg_no: int, data: bytes) -> bytes:
+        """把数据写入段文件，返回对应的索引项。先写数据再写索引，中途崩溃也不会有指向空处的索引"""
+        with open(self._segment_path(address, seg_no), 'ab') as f:
+            offset = f.tell()
+            f.write(data)
+        return self.ENTRY.pack(seg_no, offset, len(data), time.time())
+
+    def _read_entry(self, address, i: int):
+        """读取第 i 项索引，负数则倒着数，不存在返回 None"""
+        amount = self.count(address)
+        if amount == 0:
+            return None
+        i = i if i >= 0 else amount + i
+        with open(self._index_path(address), 'rb') as f:
+            f.seek(i * self.ENTRY.size)
+            return self.ENTRY.unpack(f.read(self.ENTRY.size))
+
+    def _read_record(self, address, seg_no: int, offset: int, length: int) -> str:
+        with open(self._segment_path(address, seg_no), 'rb') as f:
+            f.seek(offset)
+            return self.codec.decompress(f.read(length))
+
+    def count(self, address) -> int:
+        """保存的记录数量，即索引项数"""
+        try:
+            return os.path.getsize(self._index_path(address)) // self.ENTRY.size
+        except FileNotFoundError:
+            return 0
+
+    def earliest(self, address):
+        """返回最早的一条记录 (保存时间戳, 内容)，没有则返回 None"""
+        if entry := self._read_entry(address, 0):
+            seg_no, offset, length, timestamp = entry
+            return timestamp, self._read_record(address, seg_no, offset, length)
+        return None
+
+    def iter_read(self, address):
+        """按顺序逐条读出记录，用于流式推送"""
+        try:
+            with open(self._index_path(address), 'rb') as f:
+                index = f.read()
+        except FileNotFoundError:
+            return
+        index = index[:len(index) - len(index) % self.ENTRY.size]   # 写索引时崩溃留下的半项不算
+        segments = {}   # 段文件句柄，同一段只打开一次
+        try:
+            for seg_no, offset, length, _ in self.ENTRY.iter_unpack(index):
+                if seg_no not in segments:
+                    segments[seg_no] = open(self._segment_path(address, seg_no), 'rb')
+                seg_f = segments[seg_no]
+                seg_f.seek(offset)
+                yield self.codec.decompress(seg_f.read(length))
+        finally:
+            for seg_f in segments.values():
+                seg_f.close()
+
+    def read(self, address):
+        """读取原本的数据"""
+        return "".join(self.iter_read(address))
+
+    def _write(self, address, content, bak: str=""):
+        """把数据覆盖存储，存为一条记录"""
+        self.clear(address)
+        if content:
+            self.append(address, content)
+
+    def append(self, address, content):
+        """追加一条记录"""
+        os.makedirs(self.get_path(address), exist_ok=True)
+        entry = self._write_record(address, self._active_segment(address), self.codec.compress_bytes(content))
+        with open(self._index_path(address), 'ab') as f:
+            f.write(entry)
+
+    def append_many(self, address, contents: list):
+        """一次追加多条记录，段文件和索引各只写一次"""
+        os.makedirs(self.get_path(address), exist_ok=True)
+        seg_no = self._active_segment(address)
+        now = time.time()
+        entries = []
+        with open(self._segment_path(address, seg_no), 'ab') as f:
+            offset = f.tell()
+            for content in contents:
+                data = self.codec.compress_bytes(content)
+                f.write(data)
+                entries.append(self.ENTRY.pack(seg_no, offset, len(data), now))
+                offset += len(data)
+        with open(self._index_path(address), 'ab') as f:
+            f.write(b"".join(entries))
+
+    def write_in_front(self, address, content):
+        """数据和追加一样写到正在追加的段里，只重写索引，把这一项放到最前面"""
+        os.makedirs(self.get_path(address), exist_ok=True)
+        entry = self._write_record(address, self._active_segment(address), self.codec.compress_bytes(content))
+        index_path = self._index_path(address)
+        try:
+            with open(index_path, 'rb') as f:
+                index = f.read()
+        except FileNotFoundError:
+            index = b""
+        with open(index_path + ".tmp", 'wb') as f:
+            f.write(entry + index)
+        os.replace(index_path + ".tmp", index_path)
+
+    def pop_last(self, address) -> str:
+        """删除最后一条记录并返回其内容，截断索引，若该记录在段文件末尾，也截断段文件"""
+        if not (entry := self._read_entry(address, -1)):
+            return ""
+        seg_no, offset, length, _ = entry
+        content = self._read_record(address, seg_no, offset, length)
+        with open(self._index_path(address), 'r+b') as f:
+            f.truncate((self.count(address) - 1) * self.ENTRY.size)   # 按整项截断，末尾的半项一起去掉
+        seg_path = self._segment_path(address, seg_no)
+        if os.path.getsize(seg_path) == offset + length:
+            with open(seg_path, 'r+b') as f:
+                f.truncate(offset)
+        return content
+
+    def clear(self, address):
+        shutil.rmtree(self.get_path(address), ignore_errors=True)
+        self._active.pop(address, None)
+
+    def backup(self, address: str):
+        """备份内容，整个目录复制一份"""
+        bak_path = self.get_path(address, bak="_bak")
+        shutil.rmtree(bak_path, ignore_errors=True)
+        if os.path.exists(self.get_path(address)):
+            shutil.copytree(self.get_path(address), bak_path)
+
+    def del_data(self, address: str):
+        """彻底删除用户数据"""
+        self.clear(address)
+        shutil.rmtree(self.get_path(address, bak="_bak"), ignore_errors=True)
+
+    def list_addresses(self) -> list:
+        """所有有数据的用户"""
+        if not os.path.isdir(self.rootpath):
+            return []
+        names = [name[:-len(self.suffix)] for name in os.listdir(self.rootpath) if name.endswith(self.suffix)]
+        return [name for name in names if is_user_address(name)]
+
+    def bulk_load(self, items: list):
+        """迁移用，items 是 [(用户, 记录列表)]，覆盖这些用户的数据"""
+        for address, records in items:
+            self.clear(address)
+            if records:
+                self.append_many(address, records)
+
+
+def is_user_address(name: str) -> bool:
+    """用户 id 是数字，群组是负数，用来排除 _url、_bak 这些文件"""
+    return name.lstrip('-').isdigit()
+
+
+MSG_SEPARATOR = '-' * 27   # 每条消息开头的分割线
+
+
+def split_records(text: str, is_url: bool) -> list:
+    """把整体存储的内容，拆成一条条记录。消息按开头的分割线拆，网址按行拆"""
+    lines = text.splitlines(keepends=True)
+    if is_url:
+        return lines
+    records = []
+    for line in lines:
+        if line.startswith(MSG_SEPARATOR) or not records:
+            records.append(line)
+        else:
+            records[-1] += line
+    return records
+
+
+async def split_pages(records, page_size: int):
+    """把逐条的内容攒成一页页，每页不超过 page_size 字节，尽量在记录之间分页，单条太长的才拆开"""
+    page, size = [], 0
+    async for record in records:
+        data = record.encode('utf-8')
+        while size + len(data) > page_size:
+            if page:   # 先把攒着的作为一页
+                yield "".join(page)
+                page, size = [], 0
+                continue
+            # 单条就超过一页，按字节拆开，避开 utf-8 多字节字符的中间；一页放不下一个字符的，这个字符单独一页
+            cut = page_size
+            while cut > 0 and (data[cut] & 0xC0) == 0x80:
+                cut -= 1
+            if cut == 0:
+                cut = page_size
+                while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+                    cut += 1
+            yield data[:cut].decode('utf-8')
+            data = data[cut:]
+        if data:
+            page.append(data.decode('utf-8'))
+            size += len(data)
+    if page:
+        yield "".join(page)
+
+
+TEXTAREA_PATTERN = re.compile(r'<textarea[^>]*\bid=["\']content["\'][^>]*>(.*?)</textarea>', re.DOTALL | re.IGNORECASE)
+
+
+def extract_webnote_content(page: str) -> str:
+    """从网络记事本的网页中取出 <textarea id="content"> 的文本，用正则直接定位，不必构建整棵 soup 树"""
+    if match := TEXTAREA_PATTERN.search(page):
+        return html.unescape(match.group(1))
+    if '<textarea' in page:   # 格式不寻常的，交给 BeautifulSoup
+        textarea = BeautifulSoup(page, 'html.parser').find('textarea', {'id': 'content'})
         if textarea:
-            old = textarea.text
-        return old
-
-    def _write(self, url, content):
-        """把数据提交上去"""
-        data = {"text": content}
-        requests.post(url, data=data, verify=False)
-
-    def append(self, url, content):
-        """把数据提交上去"""
-        old = self.read(url)
-        old += content
-        self._write(url, old)
-
-    def write_in_front(self, url, content):
-        """把文本添加到 webnote 里，添加在开头，先读取，再提交"""
-        old = self.read(url)
-        content += old
-        self._write(url, content)
+            return textarea.text
+    return ""
 
 
 class AbstractReadWrite(ABC):
@@ -132,44 +380,75 @@ class AbstractReadWrite(ABC):
         """彻底删除用户数据"""
         raise NotImplementedError
 
+_mongo_clients = {}   # 同一 uri 共用一个 MongoClient，也就是共用一个连接池
+_ensured_indexes = set()
+
+
+def get_mongo_client(uri: str) -> MongoClient:
+    """取得共用的 MongoClient，第一次创建时 ping 一下"""
+    if uri not in _mongo_clients:
+        client = MongoClient(uri)
+        try:
+            client.admin.command('ping')
+            print("Pinged your deployment. You successfully connected to MongoDB!")
+        except Exception as e:
+            print(e)
+        _mongo_clients[uri] = client
+    return _mongo_clients[uri]
+
+
+def ensure_index(collection, keys, **kwargs):
+    """启动时创建索引，同一 collection 的同一索引只创建一次"""
+    key = (collection.full_name, str(keys))
+    if key in _ensured_indexes:
+        return
+    try:
+        collection.create_index(keys, **kwargs)
+    except Exception as e:   # 如已有重复的 user_id，唯一索引建不起来，不影响使用
+        print(f"fail to create index {keys} on {collection.full_name}: {e}")
+    _ensured_indexes.add(key)
+
+
 class MongoDBReadWrite(AbstractReadWrite):
     """读取和保存到 MongoDB，传入地址，针对的是一个 collection 的读写，其他 collection 则再实例"""
-    def __init__(self, uri: str, db_name: str, collection_name: str, field: str="forward"):
-        client = MongoClient(uri)
+    def __init__(self, uri: str, db_name: str, collection_name: str, field: str="forward", codec: Codec=None):
+        client = get_mongo_client(uri)
         db = client[db_name]
         self.collection = db[collection_name]
         # 针对一行中的某个字段编辑
         self.field = field
-        try:
-            client.admin.command('ping')
-            print(f"Pinged your deployment. You successfully connected to MongoDB for field {field}!")
-        except Exception as e:
-            print(e)
+        self.codec = codec if codec else PLAIN   # 压缩的字段保存为二进制
+        ensure_index(self.collection, "user_id", unique=True)
+
+    def read_fields(self, address: str, fields: list) -> dict:
+        """一次查询读出多个字段，只取需要的字段，返回 {字段: 内容}"""
+        projection = {field: 1 for field in fields} | {"_id": 0}
+        row = self.collection.find_one({"user_id": address}, projection) or {}
+        return {field: self.codec.decompress(row.get(field, "")) for field in fields}
 
     def read(self, address: str) -> str:
         """接收 user_id ，然后返回 field 中的数据"""
         user_id = address
-        if row := self.collection.find_one({"user_id": user_id}):
+        if row := self.collection.find_one({"user_id": user_id}, {self.field: 1}):
             # 如果有该用户的数据
             content = row.get(self.field, "")
-            return content
+            return self.codec.decompress(content)
         else:
             print(f"mongo_rw return: 不存在 {user_id}")
             return ""
 
+    def iter_read(self, address: str):
+        """流式解压，逐块读出，用于推送"""
+        if row := self.collection.find_one({"user_id": address}, {self.field: 1}):
+            yield from self.codec.iter_decompress(row.get(self.field, ""))
+
     def _write(self, address: str, content: str, field: str=None):
         """接收 user_id ，把数据覆盖存储"""
         user_id = address
         field = field if field else self.field
-        if self.collection.find_one({"user_id": user_id}):
-            # 更新这条数据
-            data = {field: content}
-            self.collection.update_one({"user_id": user_id}, {'$set': data})
-        else:
-            # 尚未有此用户
-            row = {"user_id": user_id, field: content}
-            self.collection.insert_one(row)
-            print(f"mongo_rw return: 已新建 {user_id}")
+        # 有则更新，尚未有此用户则新建，一次往返
+        data = {field: self.codec.compress(content)}
+        self.collection.update_one({"user_id": user_id}, {'$set': data}, upsert=True)
 
     def insert(self, address: str, insert_content: str, insertion_point: int):
         """把数据插入到指定位置，按字符计，负数则是倒着数"""
@@ -190,6 +469,10 @@ class MongoDBReadWrite(AbstractReadWrite):
         """先读取原本的数据，然后缝合，再覆盖写入"""
         self.insert(address, content, -1)
 
+    def append_many(self, address: str, contents: list):
+        """一次追加多条，只读写一次"""
+        self.insert(address, "".join(contents), -1)
+
     def write_in_front(self, address: str, content: str):
         """把文本添加添加在开头"""
         self.insert(address, content, 0)
@@ -208,6 +491,371 @@ class MongoDBReadWrite(AbstractReadWrite):
         """彻底删除用户数据"""
         self.collection.delete_one({"user_id": address})
 
+    def list_addresses(self) -> list:
+        """所有有数据的用户"""
+        return self.collection.distinct("user_id", {self.field: {"$exists": True}})
+
+    def bulk_load(self, items: list):
+        """迁移用，items 是 [(用户, 记录列表)]，一次 bulk_write 批量 upsert"""
+        operations = [UpdateOne({"user_id": address}, {"$set": {self.field: self.codec.compress("".join(records))}}, upsert=True)
+                      for address, records in items]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+
+class MongoDBRecordReadWrite(AbstractReadWrite):
+    """
+    读取和保存到 MongoDB，每条转存的消息是单独的一个文档 {user_id, field, seq, content, time}
+    追加只需一次 insert_one，不读取原本的数据，也不会有两个更新同时到达时的覆盖问题，更不会碰到单个文档 16 MB 的上限
+    seq 由每个用户每个 field 的计数文档分配，追加取 tail 加一，添加在开头取 head 减一，因此按 seq 排序就是内容的顺序
+    计数文档在 collection 名加 _seq 的另一个 collection 中，$inc 是原子的，多个写入者同时追加也不会重复
+    """
+    record_based = True
+
+    def __init__(self, uri: str, db_name: str, collection_name: str, field: str="forward", codec: Codec=None):
+        client = get_mongo_client(uri)
+        db = client[db_name]
+        self.collection = db[collection_name]
+        self.counters = db[collection_name + "_seq"]
+        self.field = field
+        self.codec = codec if codec else PLAIN   # 每条记录的 content 单独压缩
+        ensure_index(self.collection, [("user_id", 1), ("field", 1), ("seq", 1)], unique=True)
+
+    def _filter(self, address: str, field: str=None) -> dict:
+        return {"user_id": address, "field": field if field else self.field}
+
+    def _counter_id(self, address: str, field: str=None) -> str:
+        return f"{address}:{field if field else self.field}"
+
+    def _reserve(self, address: str, amount: int, front: bool=False, field: str=None) -> int:
+        """
+        原子地预留 amount 个 seq，返回第一个。追加的从小到大，添加在开头的从大到小
+        没有计数文档的，先按已有记录的最大、最小 seq 创建，兼容以前用时间戳作 seq 的数据
+        """
+        counter_id = self._counter_id(address, field)
+        if self.counters.find_one({"_id": counter_id}, {"_id": 1}) is None:
+            first = self.collection.find_one(self._filter(address, field), {"seq": 1}, sort=[("seq", 1)])
+            last = self.collection.find_one(self._filter(address, field), {"seq": 1}, sort=[("seq", -1)])
+            try:
+                self.counters.update_one({"_id": counter_id},
+                                         {"$setOnInsert": {"head": first["seq"] if first else 1, "tail": last["seq"] if last else 0}},
+                                         upsert=True)
+            except DuplicateKeyError:   # 另一个写入者同时创建了
+                pass
+        key = "head" if front else "tail"
+        row = self.counters.find_one_and_update({"_id": counter_id}, {"$inc": {key: -amount if front else amount}},
+                                                return_document=ReturnDocument.AFTER)
+        return row[key] + amount - 1 if front else row[key] - amount + 1
+
+    def _insert_record(self, address: str, content: str, seq: int, field: str=None):
+        row = self._filter(address, field) | {"seq": seq, "content": self.codec.compress(content), "time": time.time()}
+        self.collection.insert_one(row)
+
+    def iter_read(self, address: str):
+        """按顺序逐条读出记录"""
+        cursor = self.collection.find(self._filter(address), {"content": 1, "_id": 0}).sort("seq", 1)
+        for row in cursor:
+            yield self.codec.decompress(row["content"])
+
+    def read(self, address: str) -> str:
+        """接收 user_id ，然后按顺序返回全部记录拼接的数据"""
+        return "".join(self.iter_read(address))
+
+    def _write(self, address: str, content: str, field: str=None):
+        """接收 user_id ，把数据覆盖存储为一条记录"""
+        self.collection.delete_many(self._filter(address, field))
+        if content:
+            self._insert_record(address, content, self._reserve(address, 1, field=field), field)
+
+    def insert(self, address: str, insert_content: str, insertion_point: int):
+        """只支持插入到开头和结尾，开头用 head 之前的 seq，结尾用 tail 之后的"""
+        if insertion_point == -1:
+            self._insert_record(address, insert_content, self._reserve(address, 1))
+        elif insertion_point == 0:
+            self._insert_record(address, insert_content, self._reserve(address, 1, front=True))
+        else:
+            raise IndexError("temporarily not support this insertion_point")
+
+    def append(self, address: str, content: str):
+        """追加一条记录，一次 insert_one"""
+        self.insert(address, content, -1)
+
+    def append_many(self, address: str, contents: list):
+        """一次追加多条记录，一次预留一段 seq，一次 insert_many"""
+        if not contents:
+            return
+        seq = self._reserve(address, len(contents))
+        now = time.time()
+        rows = [self._filter(address) | {"seq": seq + i, "content": self.codec.compress(content), "time": now}
+                for i, content in enumerate(contents)]
+        self.collection.insert_many(rows)
+
+    def write_in_front(self, address: str, content: str):
+        """把文本添加添加在开头"""
+        self.insert(address, content, 0)
+
+    def count(self, address: str) -> int:
+        """保存的记录数量，走索引"""
+        return self.collection.count_documents(self._filter(address))
+
+    def earliest(self, address: str):
+        """返回最早的一条记录 (保存时间戳, 内容)，没有则返回 None"""
+        if row := self.collection.find_one(self._filter(address), sort=[("seq", 1)]):
+            return row["time"], self.codec.decompress(row["content"])
+        return None
+
+    def pop_last(self, address: str) -> str:
+        """原子地删除最后一条记录并返回其内容"""
+        if row := self.collection.find_one_and_delete(self._filter(address), sort=[("seq", -1)]):
+            return self.codec.decompress(row["content"])
+        return ""
+
+    def clear(self, address: str):
+        self.collection.delete_many(self._filter(address))
+
+    def backup(self, address: str):
+        """备份内容，把记录复制到 field_bak 下"""
+        bak_field = self.field + "_bak"
+        self.collection.delete_many(self._filter(address, bak_field))
+        rows = [row | {"field": bak_field} for row in self.collection.find(self._filter(address), {"_id": 0})]
+        if rows:
+            self.collection.insert_many(rows)
+
+    def del_data(self, address: str):
+        """彻底删除用户数据"""
+        self.collection.delete_many({"user_id": address, "field": {"$in": [self.field, self.field + "_bak"]}})
+        self.counters.delete_many({"_id": {"$in": [self._counter_id(address), self._counter_id(address, self.field + "_bak")]}})
+
+    def list_addresses(self) -> list:
+        """所有有数据的用户"""
+        return self.collection.distinct("user_id", {"field": self.field})
+
+    def bulk_load(self, items: list):
+        """迁移用，items 是 [(用户, 记录列表)]，先删除这些用户的，再一次 insert_many"""
+        self.collection.delete_many({"user_id": {"$in": [address for address, _ in items]}, "field": self.field})
+        now = time.time()
+        rows = [self._filter(address) | {"seq": seq, "content": self.codec.compress(content), "time": now}
+                for address, records in items for seq, content in enumerate(records, start=1)]
+        if rows:
+            self.collection.insert_many(rows, ordered=False)
+        for address, records in items:   # 每个用户一次，不是每条记录一次
+            self.counters.update_one({"_id": self._counter_id(address)}, {"$set": {"head": 1, "tail": len(records)}}, upsert=True)
+
+
+class SQLiteReadWrite(AbstractReadWrite):
+    """
+    读取和保存到 SQLite 单文件数据库，WAL 模式，读写可同时进行，不需要 MongoDB 服务
+    每条转存的消息是一行 (user_id, field, seq, content, time)，(user_id, field, seq) 上有索引，
+    统计数量、取最早和最新一条都走索引。多个实例可用同一个数据库文件，按 field 区分
+    """
+    record_based = True
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS records (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            field TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            time REAL NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS records_user_field_seq ON records (user_id, field, seq);
+    """
+    # 以下 SQL 文本固定，sqlite3 会缓存编译好的语句，相当于预编译
+    SQL_APPEND = ("INSERT INTO records (user_id, field, seq, content, time) VALUES "
+                  "(?1, ?2, COALESCE((SELECT MAX(seq) FROM records WHERE user_id = ?1 AND field = ?2), 0) + 1, ?3, ?4)")
+    SQL_FRONT = ("INSERT INTO records (user_id, field, seq, content, time) VALUES "
+                 "(?1, ?2, COALESCE((SELECT MIN(seq) FROM records WHERE user_id = ?1 AND field = ?2), 1) - 1, ?3, ?4)")
+    SQL_READ = "SELECT content FROM records WHERE user_id = ? AND field = ? ORDER BY seq"
+    SQL_READ_AFTER = "SELECT seq, content FROM records WHERE user_id = ? AND field = ? AND seq > ? ORDER BY seq LIMIT ?"
+    READ_BATCH = 256   # iter_read 每次查询的行数
+    SQL_COUNT = "SELECT COUNT(*) FROM records WHERE user_id = ? AND field = ?"
+    SQL_EARLIEST = "SELECT time, content FROM records WHERE user_id = ? AND field = ? ORDER BY seq LIMIT 1"
+    SQL_LATEST = "SELECT id, time, content FROM records WHERE user_id = ? AND field = ? ORDER BY seq DESC LIMIT 1"
+    SQL_CLEAR = "DELETE FROM records WHERE user_id = ? AND field = ?"
+
+    def __init__(self, db_path: str, field: str="forward", codec: Codec=None):
+        self.rootpath = db_path
+        self.field = field
+        self.codec = codec if codec else PLAIN   # 压缩的 content 保存为 BLOB
+        self._local = threading.local()   # 每个线程一个连接，异步包装会在线程池中调用
+        with self._conn() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.rootpath, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        """写事务，BEGIN IMMEDIATE 先拿到写锁，避免读后再写时的死锁"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        return _SQLiteTransaction(conn)
+
+    def iter_read(self, address: str):
+        """
+        按顺序逐条读出记录。按 seq 分批查询，每批在一次调用里取完，
+        AsyncReadWrite.aiter_read 每次 next 可能在线程池的不同线程，不能跨线程使用同一个游标
+        """
+        last_seq = -2 ** 63
+        while True:
+            rows = self._conn().execute(self.SQL_READ_AFTER, (address, self.field, last_seq, self.READ_BATCH)).fetchall()
+            for last_seq, content in rows:
+                yield self.codec.decompress(content)
+            if len(rows) < self.READ_BATCH:
+                return
+
+    def read(self, address: str) -> str:
+        return "".join(self.codec.decompress(content) for (content,) in self._conn().execute(self.SQL_READ, (address, self.field)))
+
+    def _write(self, address: str, content: str, field: str=None):
+        """覆盖存储为一条记录"""
+        field = field if field else self.field
+        with self._transaction() as conn:
+            conn.execute(self.SQL_CLEAR, (address, field))
+            if content:
+                conn.execute(self.SQL_APPEND, (address, field, self.codec.compress(content), time.time()))
+
+    def insert(self, address: str, insert_content: str, insertion_point: int):
+        """只支持插入到开头和结尾"""
+        if insertion_point == -1:
+            sql = self.SQL_APPEND
+        elif insertion_point == 0:
+            sql = self.SQL_FRONT
+        else:
+            raise IndexError("temporarily not support this insertion_point")
+        with self._transaction() as conn:
+            conn.execute(sql, (address, self.field, self.codec.compress(insert_content), time.time()))
+
+    def append(self, address: str, content: str):
+        self.insert(address, content, -1)
+
+    def append_many(self, address: str, contents: list):
+        """多条追加放在一个事务里"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(self.SQL_APPEND, ((address, self.field, self.codec.compress(content), now) for content in contents))
+
+    def write_in_front(self, address: str, content: str):
+        self.insert(address, content, 0)
+
+    def count(self, address: str) -> int:
+        return self._conn().execute(self.SQL_COUNT, (address, self.field)).fetchone()[0]
+
+    def earliest(self, address: str):
+        """返回最早的一条记录 (保存时间戳, 内容)，没有则返回 None"""
+        if row := self._conn().execute(self.SQL_EARLIEST, (address, self.field)).fetchone():
+            return row[0], self.codec.decompress(row[1])
+        return None
+
+    def latest(self, address: str):
+        """返回最新的一条记录 (保存时间戳, 内容)，没有则返回 None"""
+        if row := self._conn().execute(self.SQL_LATEST, (address, self.field)).fetchone():
+            return row[1], self.codec.decompress(row[2])
+        return None
+
+    def pop_last(self, address: str) -> str:
+        """删除最后一条记录并返回其内容"""
+        with self._transaction() as conn:
+            row = conn.execute(self.SQL_LATEST, (address, self.field)).fetchone()
+            if not row:
+                return ""
+            conn.execute("DELETE FROM records WHERE id = ?", (row[0],))
+        return self.codec.decompress(row[2])
+
+    def clear(self, address: str):
+        with self._transaction() as conn:
+            conn.execute(self.SQL_CLEAR, (address, self.field))
+
+    def backup(self, address: str):
+        """备份内容，把记录复制到 field_bak 下"""
+        bak_field = self.field + "_bak"
+        with self._transaction() as conn:
+            conn.execute(self.SQL_CLEAR, (address, bak_field))
+            conn.execute("INSERT INTO records (user_id, field, seq, content, time) "
+                         "SELECT user_id, ?, seq, content, time FROM records WHERE user_id = ? AND field = ?",
+                         (bak_field, address, self.field))
+
+    def del_data(self, address: str):
+        """彻底删除用户数据"""
+        with self._transaction() as conn:
+            conn.execute(self.SQL_CLEAR, (address, self.field))
+            conn.execute(self.SQL_CLEAR, (address, self.field + "_bak"))
+
+    def list_addresses(self) -> list:
+        """所有有数据的用户"""
+        return [user_id for (user_id,) in self._conn().execute("SELECT DISTINCT user_id FROM records WHERE field = ?", (self.field,))]
+
+    def bulk_load(self, items: list):
+        """迁移用，items 是 [(用户, 记录列表)]，整批在一个事务里"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(self.SQL_CLEAR, ((address, self.field) for address, _ in items))
+            conn.executemany("INSERT INTO records (user_id, field, seq, content, time) VALUES (?, ?, ?, ?, ?)",
+                             ((address, self.field, seq, self.codec.compress(content), now)
+                              for address, records in items for seq, content in enumerate(records, start=1)))
+
+
+def read_together(io4message, io4urlmsg, address: str) -> tuple:
+    """读取消息和网址，两者是同一 MongoDB 文档的不同字段时，一次查询读出，返回 (消息, 网址)"""
+    if (isinstance(io4message, MongoDBReadWrite) and isinstance(io4urlmsg, MongoDBReadWrite)
+            and io4message.collection.full_name == io4urlmsg.collection.full_name):
+        row = io4message.read_fields(address, [io4message.field, io4urlmsg.field])
+        return row[io4message.field], row[io4urlmsg.field]
+    return io4message.read(address), io4urlmsg.read(address)
+
+
+STORE_BACKENDS = ("file", "segment", "sqlite", "mongo", "mongo_record")
+
+
+def configured_backend(config) -> str:
+    """配置文件选择的存储方式，有 mongo_uri 则用 MongoDB"""
+    if config.mongo_uri:
+        return "mongo_record" if config.mongo_mode == "record" else "mongo"
+    return config.store_backend
+
+
+def build_stores(config, backend: str=None) -> tuple:
+    """按存储方式创建保存消息和网址的两个存储，返回 (io4message, io4urlmsg)，不传则按配置文件"""
+    backend = backend if backend else configured_backend(config)
+    codec = Codec(config.compression, config.compression_level)   # 两个存储共用，统计合在一起
+    if backend == "mongo_record":
+        # 每条消息一个文档的，放在单独的 collection，和每个用户一个文档的互不干扰，也便于两者之间迁移
+        collection_name = config.mongo_collection + "_records"
+        return (MongoDBRecordReadWrite(uri=config.mongo_uri, db_name=config.mongo_db, collection_name=collection_name, field="forward", codec=codec),
+                MongoDBRecordReadWrite(uri=config.mongo_uri, db_name=config.mongo_db, collection_name=collection_name, field="forward_url", codec=codec))
+    elif backend == "mongo":
+        return (MongoDBReadWrite(uri=config.mongo_uri, db_name=config.mongo_db, collection_name=config.mongo_collection, field="forward", codec=codec),
+                MongoDBReadWrite(uri=config.mongo_uri, db_name=config.mongo_db, collection_name=config.mongo_collection, field="forward_url", codec=codec))
+    elif backend == "sqlite":
+        return (SQLiteReadWrite(db_path=config.sqlite_path, field="forward", codec=codec),
+                SQLiteReadWrite(db_path=config.sqlite_path, field="forward_url", codec=codec))
+    elif backend == "segment":
+        segment_size = int(config.segment_size * 1024 * 1024)
+        return (SegmentReadWrite(rootpath_of_store=config.store_dir, suffix=".seg", segment_size=segment_size, codec=codec),
+                SegmentReadWrite(rootpath_of_store=config.store_dir, suffix="_url.seg", segment_size=segment_size, codec=codec))
+    elif backend == "file":
+        return (LocalReadWrite(rootpath_of_store=config.store_dir, suffix=".txt"),
+                LocalReadWrite(rootpath_of_store=config.store_dir, suffix="_url.txt"))
+    else:
+        raise ValueError(f"unknown store backend {backend}, choose from {STORE_BACKENDS}")
+
+
+class _SQLiteTransaction:
+    """with 结束时提交，出错则回滚"""
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
 
 
 if __name__ == "__main__":
@@ -0,0 +1,187 @@
+"""
+把多张图片做成动图。帧是用到时才生成的，一次只有一帧在内存里，写出一帧就丢掉
+
+GIF 是边生成边写出的：全部帧共用一个调色板，由全部图片的缩略图一次量化得到；
+和上一帧完全一样的帧不写，只把上一帧的时长加上；其余帧只写出变化的矩形，其中没变的像素用透明色
+
+另有动态 WebP（Pillow）和 H.264 MP4（需安装 ffmpeg，原始帧经管道送入），体积都比 GIF 小得多
+"""
+import io
+import os
+import struct
+import subprocess
+import tempfile
+import time
+
+from PIL import Image, ImageChops
+from PIL.GifImagePlugin import getdata
+
+TRANSPARENT_INDEX = 255   # 调色板只用 255 色，最后一个留作透明
+
+
+def canvas_size_of(image_list) -> tuple:
+    """能放下每一张图片的画布，宽高各取最大"""
+    return max(image.width for image in image_list), max(image.height for image in image_list)
+
+
+def iter_frames(image_list, canvas_size=None, background=(0, 0, 0)):
+    """逐帧生成，每张图片放在同样大小的画布中央"""
+    canvas_size = canvas_size if canvas_size else canvas_size_of(image_list)
+    for image in image_list:
+        frame = Image.new('RGB', canvas_size, background)
+        left = (canvas_size[0] - image.width) // 2
+        top = (canvas_size[1] - image.height) // 2
+        if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+            image = image.convert("RGBA")
+            frame.paste(image, (left, top), image)
+        else:
+            frame.paste(image.convert("RGB"), (left, top))
+        yield frame
+
+
+def build_palette(image_list, background=(0, 0, 0), thumb_size=128) -> Image.Image:
+    """全部图片的缩略图拼在一起，量化一次，得到共用的 255 色调色板"""
+    thumbs = []
+    for image in image_list:
+        thumb = image.convert("RGB")
+        thumb.thumbnail((thumb_size, thumb_size))
+        thumbs.append(thumb)
+    mosaic = Image.new("RGB", (thumb_size * (len(thumbs) + 1), thumb_size), background)   # 多留一格背景色
+    for i, thumb in enumerate(thumbs):
+        mosaic.paste(thumb, (thumb_size * i, 0))
+    return mosaic.quantize(colors=TRANSPARENT_INDEX, method=Image.Quantize.MEDIANCUT)
+
+
+def _indexes(frame: Image.Image) -> Image.Image:
+    """把 P 模式的索引当作灰度图，便于逐像素比较"""
+    return Image.frombytes("L", frame.size, frame.tobytes())
+
+
+class GifStreamWriter:
+    """按 GIF89a 格式边写边输出，全局调色板，帧的数据交给 Pillow 的 LZW 编码"""
+    def __init__(self, fp, size: tuple, palette: Image.Image, loop: int=0):
+        self.fp = fp
+        self.size = size
+        palette_bytes = bytes(palette.getpalette()[:768])
+        palette_bytes += b"\0" * (768 - len(palette_bytes))
+        fp.write(b"GIF89a" + struct.pack("<HHBBB", size[0], size[1], 0xF7, 0, 0) + palette_bytes)
+        # NETSCAPE2.0 扩展，循环播放的次数，0 是一直循环
+        fp.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\0")
+
+    def write_frame(self, frame: Image.Image, offset: tuple, duration: int):
+        """duration 单位是毫秒，GIF 里以 10 毫秒计"""
+        for chunk in getdata(frame, offset, duration=duration, disposal=1, transparency=TRANSPARENT_INDEX):
+            self.fp.write(chunk)
+
+    def close(self):
+        self.fp.write(b";")
+
+
+def encode_gif(image_list, duration_time: int=3000, max_bytes: int=0, time_budget: float=0, stats: dict=None) -> io.BytesIO:
+    """
+    生成 GIF，返回字节流。max_bytes 是体积上限，写到超出就不再加帧；time_budget 是秒数，
+    超出后剩下的帧不再抖动，量化快得多。两者为 0 则不限制。stats 传入字典的，会记下帧数等情况
+    """
+    stats = stats if stats is not None else {}
+    stats.update(frames=0, written=0, duplicates=0, delta_pixels=0, truncated=False)
+    start_time = time.perf_counter()
+    canvas_size = canvas_size_of(image_list)
+    palette = build_palette(image_list)
+    gif_io = io.BytesIO()
+    writer = GifStreamWriter(gif_io, canvas_size, palette)
+
+    previous = None   # 上一帧量化后的索引
+    pending = None   # (帧, 偏移, 时长)，等知道下一帧是否重复，才能确定时长
+    for frame in iter_frames(image_list, canvas_size):
+        stats["frames"] += 1
+        over_time = time_budget and time.perf_counter() - start_time > time_budget
+        dither = Image.Dither.NONE if over_time else Image.Dither.FLOYDSTEINBERG
+        current = frame.quantize(palette=palette, dither=dither)
+        if previous is None:
+            pending = [current, (0, 0), duration_time]
+            previous = current
+            continue
+        changed = ImageChops.difference(_indexes(previous), _indexes(current))
+        bbox = changed.getbbox()
+        if bbox is None:   # 和上一帧一样，合并
+            stats["duplicates"] += 1
+            pending[2] += duration_time
+            continue
+
+        writer.write_frame(*pending)
+        stats["written"] += 1
+        if max_bytes and gif_io.tell() > max_bytes:
+            stats["truncated"] = True
+            pending = None
+            break
+        # 只写变化的矩形，其中没变的像素设为透明，沿用上一帧
+        delta = current.crop(bbox)
+        unchanged = changed.crop(bbox).point(lambda value: 255 if value == 0 else 0)
+        delta.paste(TRANSPARENT_INDEX, (0, 0, *delta.size), unchanged)
+        stats["delta_pixels"] += delta.width * delta.height
+        pending = [delta, bbox[:2], duration_time]
+        previous = current
+
+    if pending:
+        writer.write_frame(*pending)
+        stats["written"] += 1
+    writer.close()
+    stats["bytes"] = gif_io.tell()
+    stats["seconds"] = round(time.perf_counter() - start_time, 3)
+    gif_io.seek(0)
+    return gif_io
+
+
+def encode_webp(image_list, duration_time: int=3000, quality: int=80, stats: dict=None) -> io.BytesIO:
+    """
+    生成动态 WebP。重复的帧和只变化一部分的帧由 libwebp 自己处理
+    Pillow 写 WebP 动图时会先把全部帧取出来，这里没法逐帧
+    """
+    stats = stats if stats is not None else {}
+    start_time = time.perf_counter()
+    frames = list(iter_frames(image_list))
+    webp_io = io.BytesIO()
+    frames[0].save(webp_io, 'WEBP', save_all=True, append_images=frames[1:], duration=duration_time, loop=0,
+                   quality=quality, method=4)
+    stats.update(frames=len(frames), bytes=webp_io.tell(), seconds=round(time.perf_counter() - start_time, 3))
+    webp_io.seek(0)
+    return webp_io
+
+
+def encode_mp4(image_list, duration_time: int=3000, crf: int=23, stats: dict=None) -> io.BytesIO:
+    """
+    生成 H.264 MP4，每一帧 RGB 原始数据经管道写给 ffmpeg，写一帧丢一帧
+    yuv420p 要求宽高是偶数，画布向上取偶数。没有安装 ffmpeg 会引发 FileNotFoundError，编码失败引发 RuntimeError
+    """
+    stats = stats if stats is not None else {}
+    duration_time = max(int(duration_time), 1)   # 帧率是 1000/duration_time
+    start_time = time.perf_counter()
+    width, height = canvas_size_of(image_list)
+    canvas_size = (width + width % 2, height + height % 2)
+    fd, mp4_path = tempfile.mkstemp(suffix=".mp4")   # moov 放在文件开头需要能回头改写，不能直接输出到管道
+    os.close(fd)
+    command = ['ffmpeg', '-loglevel', 'error', '-y',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{canvas_size[0]}x{canvas_size[1]}',
+               '-framerate', f'1000/{duration_time}', '-i', '-',
+               '-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(crf), '-pix_fmt', 'yuv420p',
+               '-movflags', '+faststart', mp4_path]
+    try:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        frames = 0
+        try:
+            for frame in iter_frames(image_list, canvas_size):
+                process.stdin.write(frame.tobytes())
+                frames += 1
+        except BrokenPipeError:   # ffmpeg 提前退出，错误信息在下面
+            pass
+        finally:
+            process.stdin.close()
+        error_output = process.stderr.read()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed: {error_output.decode(errors='replace')}")
+        with open(mp4_path, 'rb') as f:
+            mp4_io = io.BytesIO(f.read())
+    finally:
+        os.remove(mp4_path)
+    stats.update(frames=frames, bytes=len(mp4_io.getbuffer()), seconds=round(time.perf_counter() - start_time, 3))
+    return mp4_io
@@ -0,0 +1,277 @@
+"""
+存储的异步版本，机器人的处理函数都是协程，直接调用阻塞的文件读写、requests 和 pymongo 会卡住整个事件循环，
+一个用户的慢请求会拖慢所有人。这里的类都要 await 调用
+"""
+import asyncio
+import hashlib
+import html
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict, OrderedDict
+from functools import partial
+
+from http_pool import HttpPool, pool
+from Transmit import TEXTAREA_PATTERN, extract_webnote_content
+
+
+class AbstractAsyncReadWrite(ABC):
+    """AbstractReadWrite 的异步版本，方法和含义一致，只是都要 await"""
+
+    @abstractmethod
+    async def read(self, address: str) -> str:
+        """接收某个用户的位置，然后返回读取的数据"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _write(self, address: str, content: str):
+        """接收某个用户的位置，把数据覆盖存储"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def append(self, address: str, content: str):
+        """追加数据"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def write_in_front(self, address: str, content: str):
+        """把文本添加添加在开头"""
+        raise NotImplementedError
+
+
+class AsyncReadWrite(AbstractAsyncReadWrite):
+    """
+    把同步的存储（LocalReadWrite、SegmentReadWrite、MongoDBReadWrite 等）包装成异步的，
+    实际读写放到线程池里执行，事件循环不等待。同一用户的操作用锁排队，避免追加和覆盖写交错
+    同步存储的其他方法，如 count、earliest、pop_last，也能直接 await 调用
+    """
+    def __init__(self, store, executor=None):
+        self.store = store
+        self.executor = executor   # None 则使用事件循环默认的线程池
+        self._locks = defaultdict(asyncio.Lock)
+
+    @property
+    def record_based(self) -> bool:
+        return getattr(self.store, "record_based", False)
+
+    def lock(self, address: str) -> asyncio.Lock:
+        """这个用户的锁，持有期间其他经由本对象的读写都要等待。持有时不能再调用本对象的方法，直接用同步存储"""
+        return self._locks[address]
+
+    async def _run(self, func, address, *args):
+        """在线程池中执行同步存储的方法，同一 address 的调用依次进行"""
+        loop = asyncio.get_running_loop()
+        async with self._locks[address]:
+            return await loop.run_in_executor(self.executor, partial(func, address, *args))
+
+    def __getattr__(self, name):
+        # 同步存储的其余方法，第一个参数都是 address，也包装成协程
+        func = getattr(self.store, name)
+        async def wrapper(address, *args):
+            return await self._run(func, address, *args)
+        return wrapper
+
+    async def read(self, address: str) -> str:
+        return await self._run(self.store.read, address)
+
+    async def aiter_read(self, address: str):
+        """逐条读出记录，每次只在线程池中取一条，不必一次读入全部。不是按记录存储的，整体作为一条"""
+        if not hasattr(self.store, "iter_read"):
+            yield await self.read(address)
+            return
+        loop = asyncio.get_running_loop()
+        records = self.store.iter_read(address)
+        while (record := await loop.run_in_executor(self.executor, next, records, None)) is not None:
+            yield record
+
+    async def _write(self, address: str, content: str):
+        return await self._run(self.store._write, address, content)
+
+    async def append(self, address: str, content: str):
+        return await self._run(self.store.append, address, content)
+
+    async def write_in_front(self, address: str, content: str):
+        return await self._run(self.store.write_in_front, address, content)
+
+    async def clear(self, address: str):
+        return await self._run(self.store.clear, address)
+
+    async def backup(self, address: str):
+        return await self._run(self.store.backup, address)
+
+    async def del_data(self, address: str):
+        return await self._run(self.store.del_data, address)
+
+
+class AsyncWebnoteReadWrite(AbstractAsyncReadWrite):
+    """
+    读取和提交到网络记事本，使用共用的 HTTP 连接池
+    本地保留每个网址读到的内容作为影子副本，每次读取都先验证：用 ETag/Last-Modified 条件请求，
+    服务器不支持的，比较网页的哈希，没变就直接用影子，不必解析。网页上手动修改过的，不会被覆盖
+    解析时记下 textarea 前后的网页作为模板，自己提交后，用模板算出网页应有的哈希，
+    下次读取时网页和它一样，说明没有别人改过，同样不必解析
+    """
+    def __init__(self, http: HttpPool=None, shadow_max_entries: int=100):
+        self.http = http if http else pool
+        self.shadow_max_entries = shadow_max_entries
+        # 网址: {"content": 内容, "page_hash": 网页的哈希, "etag", "last_modified",
+        #        "template": (textarea 之前, 之后, 是否转义引号) 或 None, "time": 上次确认的时间}
+        self._shadow = OrderedDict()
+        self.counter = defaultdict(int)
+
+    @staticmethod
+    def _page_hash(page: str) -> str:
+        return hashlib.sha256(page.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _template_of(page: str, content: str):
+        """网页是 之前 + 转义后的内容 + 之后 的，返回模板，转义方式对不上的返回 None"""
+        if not (match := TEXTAREA_PATTERN.search(page)):
+            return None
+        for quote in (False, True):
+            if html.escape(content, quote=quote) == match.group(1):
+                return page[:match.start(1)], page[match.end(1):], quote
+        return None
+
+    def _remember(self, url, **shadow):
+        shadow = {**self._shadow.pop(url, {}), **shadow, "time": time.monotonic()}
+        self._shadow[url] = shadow
+        while len(self._shadow) > self.shadow_max_entries:
+            self._shadow.popitem(last=False)
+
+    async def read(self, url):
+        """提取原本的数据，网页没变的使用影子副本"""
+        shadow = self._shadow.get(url)
+        headers = {}
+        if shadow and shadow["etag"]:
+            headers["If-None-Match"] = shadow["etag"]
+        if shadow and shadow["last_modified"]:
+            headers["If-Modified-Since"] = shadow["last_modified"]
+        response = await self.http.get(url, headers=headers)
+        if shadow and response.status_code == 304:
+            self.counter["shadow_validated"] += 1
+            shadow["time"] = time.monotonic()
+            return shadow["content"]
+        page = response.text
+        page_hash = self._page_hash(page)
+        validators = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+        if shadow and shadow["page_hash"] == page_hash:
+            self.counter["shadow_validated"] += 1
+            self._remember(url, page_hash=page_hash, **validators)
+            return shadow["content"]
+        self.counter["page_parsed"] += 1
+        content = extract_webnote_content(page)
+        self._remember(url, content=content, page_hash=page_hash, template=self._template_of(page, content), **validators)
+        return content
+
+    async def _write(self, url, content):
+        """把数据提交上去，网页已变，条件请求的验证信息作废，按模板算出网页应有的哈希"""
+        data = {"text": content}
+        await self.http.post(url, data=data)
+        template = self._shadow.get(url, {}).get("template")
+        page_hash = None
+        if template:
+            before, after, quote = template
+            page_hash = self._page_hash(before + html.escape(content, quote=quote) + after)
+        self._remember(url, content=content, page_hash=page_hash, etag=None, last_modified=None, template=template)
+
+    async def append(self, url, content):
+        """把数据提交上去"""
+        old = await self.read(url)
+        old += content
+        await self._write(url, old)
+
+    async def write_in_front(self, url, content):
+        """把文本添加到 webnote 里，添加在开头，先读取，再提交"""
+        old = await self.read(url)
+        content += old
+        await self._write(url, content)
+
+
+class WriteBehindBuffer(AbstractAsyncReadWrite):
+    """
+    追加的写缓冲，包装 AsyncReadWrite。连续转发很多条时，追加先放入每个用户的队列，
+    等到 max_lag 秒后或攒够 max_records 条，合成一次 append_many 写入
+    读取、覆盖写、清空等其他操作，会先把这个用户队列里的写入，保证读到的是最新的
+    """
+    def __init__(self, store: AsyncReadWrite, max_lag: float=1, max_records: int=50):
+        self.store = store
+        self.max_lag = max_lag   # 最多延迟多少秒写入，也就是意外退出时最多丢失的时间窗口
+        self.max_records = max_records
+        self._pending = defaultdict(list)
+        self._timers = {}
+
+    @property
+    def record_based(self) -> bool:
+        return self.store.record_based
+
+    async def append(self, address: str, content: str):
+        """放入队列，攒够了立即写入，否则定时写入"""
+        self._pending[address].append(content)
+        if len(self._pending[address]) >= self.max_records:
+            await self.flush(address)
+        elif address not in self._timers:
+            self._timers[address] = asyncio.create_task(self._delayed_flush(address))
+
+    async def _delayed_flush(self, address: str):
+        await asyncio.sleep(self.max_lag)
+        self._timers.pop(address, None)
+        try:
+            await self.flush(address)
+        except Exception as e:   # 已放回队列，过一会儿再试
+            print(f"write behind flush failed for {address}, will retry: {e}")
+            if address in self._pending and address not in self._timers:
+                self._timers[address] = asyncio.create_task(self._delayed_flush(address))
+
+    async def flush(self, address: str):
+        """把这个用户队列里的追加，一次写入。写入失败的放回队列开头，再抛出异常"""
+        if timer := self._timers.pop(address, None):
+            if timer is not asyncio.current_task():
+                timer.cancel()
+        if contents := self._pending.pop(address, None):
+            try:
+                await self.store.append_many(address, contents)
+            except BaseException:
+                self._pending[address][:0] = contents   # 写入期间新追加的，排在后面
+                raise
+
+    def lock(self, address: str) -> asyncio.Lock:
+        """被包装存储的锁。持有期间新来的追加照样放入队列，等释放后才写入"""
+        return self.store.lock(address)
+
+    async def flush_all(self):
+        """写入全部用户的队列，关闭机器人时调用。一个用户失败不影响其他用户，最后抛出第一个异常"""
+        first_error = None
+        for address in list(self._pending):
+            try:
+                await self.flush(address)
+            except Exception as e:
+                print(f"write behind flush failed for {address}: {e}")
+                first_error = first_error or e
+        if first_error:
+            raise first_error
+
+    def __getattr__(self, name):
+        # 其余方法先写入队列，再交给被包装的存储
+        func = getattr(self.store, name)
+        async def wrapper(address, *args):
+            await self.flush(address)
+            return await func(address, *args)
+        return wrapper
+
+    async def read(self, address: str) -> str:
+        await self.flush(address)
+        return await self.store.read(address)
+
+    async def aiter_read(self, address: str):
+        await self.flush(address)
+        async for record in self.store.aiter_read(address):
+            yield record
+
+    async def _write(self, address: str, content: str):
+        self._pending.pop(address, None)   # 要覆盖，队列里的不必写了
+        await self.flush(address)
+        return await self.store._write(address, content)
+
+    async def write_in_front(self, address: str, content: str):
+        await self.flush(address)
+        return await self.store.write_in_front(address, content)
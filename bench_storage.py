@@ -0,0 +1,267 @@
+"""
+存储方式的性能测试，对 append、read、write_in_front、snapshot、clear 计时，报告每秒操作数、p50/p99 延迟和读写的字节数
+每种存储先为每个用户预置 N 条消息，再逐个用户轮流操作，能看出数据量变大后各操作的变化，便于发现性能退化
+snapshot 是清空前的快照（SnapshotStore.take），字节数是新写入的；async_append、async_read 和机器人一样，
+经 AsyncReadWrite 在线程池中执行，追加再经 WriteBehindBuffer 合并写入，计时包括最后把缓冲全部写入
+
+本地存储（file、segment、sqlite）直接测；MongoDB 默认用 mongomock 代替（需 pip install mongomock），
+也可以用 --mongo-uri 指定真实的服务；网络记事本和机器人一样用 AsyncWebnoteReadWrite 经 HttpPool 访问内置的本地假服务器，
+不访问外网，另外报告每种操作解析网页和用影子副本的次数
+
+python bench_storage.py
+python bench_storage.py --backends segment sqlite --messages 1000 100000 1000000 --users 20 --ops 200
+python bench_storage.py --backends mongo mongo_record --mongo-uri mongodb://localhost:27017 --json result.json
+python bench_storage.py --backends sqlite --write-behind-lag 0
+"""
+import os
+import json
+import html
+import asyncio
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import Transmit
+from Transmit import MSG_SEPARATOR, build_stores
+from async_transmit import AsyncReadWrite, AsyncWebnoteReadWrite, WriteBehindBuffer
+from http_pool import HttpPool
+from snapshot import SnapshotStore
+
+BACKENDS = ("file", "segment", "sqlite", "mongo", "mongo_record", "webnote")
+OPERATIONS = ("append", "read", "write_in_front", "snapshot", "async_append", "async_read", "clear")
+ASYNC_OPERATIONS = ("async_append", "async_read")
+WEBNOTE_OPERATIONS = ("append", "read", "write_in_front")
+
+
+class FakeWebnoteHandler(BaseHTTPRequestHandler):
+    """模仿网络记事本，GET 返回带 textarea 的网页，POST 的 text 覆盖保存"""
+    notes = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = f'<html><body><textarea id="content">{html.escape(self.notes.get(self.path, ""))}</textarea></body></html>'.encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        data = parse_qs(self.rfile.read(length).decode('utf-8'), keep_blank_values=True)
+        self.notes[self.path] = data.get("text", [""])[0]
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def start_fake_webnote() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeWebnoteHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_message(i: int) -> str:
+    """大致和转存的一条消息一样：分割线、来源、正文和网址，约 300 字节"""
+    return (f"{MSG_SEPARATOR}\nfrom channel_{i % 37} 第 {i} 条\n"
+            f"转发的消息正文，包含一些中文和 English words, number {i * 7919 % 100000}. " * 2
+            + f"\nhttps://example.com/post/{i}\n")
+
+
+def percentile(latencies: list, p: float) -> float:
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+def build(backend: str, workdir: str, args):
+    """创建要测的本地或 MongoDB 存储"""
+    if backend in ("mongo", "mongo_record") and not args.mongo_uri:
+        import mongomock   # 没有指定真实的服务，用 mongomock 代替
+        Transmit.MongoClient = mongomock.MongoClient
+    config = SimpleNamespace(store_dir=workdir, segment_size=4, sqlite_path=os.path.join(workdir, "bench.db"),
+                             mongo_uri=args.mongo_uri or "mongodb://localhost:27017", mongo_db="bench",
+                             mongo_collection=f"bench_{int(time.time())}", mongo_mode="document",
+                             compression=args.compression, compression_level=None)
+    return build_stores(config, backend)[0]
+
+
+def populate(store, address: str, messages: list):
+    """预置数据，按记录存储的批量写入，整体存储的一次写入"""
+    if getattr(store, "record_based", False):
+        store.bulk_load([(address, messages)])
+    else:
+        store._write(address, "".join(messages))
+
+
+def iter_records(store, address: str):
+    """和机器人做快照时一样，按记录存储的逐条读出，整体存储的作为一条"""
+    if getattr(store, "record_based", False):
+        yield from store.iter_read(address)
+    else:
+        yield store.read(address)
+
+
+def supports(store, operation: str) -> bool:
+    return operation in ("snapshot", *ASYNC_OPERATIONS) or hasattr(store, operation)
+
+
+def make_result(backend: str, messages_per_user: int, operation: str, latencies: list, spend_time: float,
+                moved_bytes: int, **extra) -> dict:
+    spend_time = max(spend_time, 1e-9)
+    return {"backend": backend, "messages": messages_per_user, "operation": operation, "ops": len(latencies),
+            "ops_per_s": len(latencies) / spend_time, "p50_ms": percentile(latencies, 0.5) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000, "bytes": moved_bytes, **extra}
+
+
+def run_operation(store, operation: str, address: str, message: str, snapshots: SnapshotStore) -> int:
+    """执行一次操作，返回读写的字节数"""
+    if operation == "append":
+        store.append(address, message)
+        return len(message.encode('utf-8'))
+    if operation == "read":
+        return len(store.read(address).encode('utf-8'))
+    if operation == "write_in_front":
+        store.write_in_front(address, message)
+        return len(message.encode('utf-8'))
+    if operation == "snapshot":
+        return snapshots.take(address, {"forward": iter_records(store, address)})[1]
+    store.clear(address)
+    return 0
+
+
+async def run_async_operation(store, operation: str, users: list, messages: list, amount: int, args) -> tuple:
+    """经 AsyncReadWrite（和 WriteBehindBuffer）执行，返回 (每次的延迟, 读写的字节数)"""
+    aio = AsyncReadWrite(store)
+    if args.write_behind_lag > 0:
+        aio = WriteBehindBuffer(aio, max_lag=args.write_behind_lag, max_records=args.write_behind_records)
+    latencies = []
+    moved_bytes = 0
+    for i in range(amount):
+        address, message = users[i % len(users)], messages[i % len(messages)]
+        op_start = time.perf_counter()
+        if operation == "async_append":
+            await aio.append(address, message)
+            moved_bytes += len(message.encode('utf-8'))
+        else:
+            moved_bytes += len((await aio.read(address)).encode('utf-8'))
+        latencies.append(time.perf_counter() - op_start)
+    if isinstance(aio, WriteBehindBuffer):   # 缓冲里的也要写完，才是真正的吞吐量
+        await aio.flush_all()
+    return latencies, moved_bytes
+
+
+async def bench_webnote(messages_per_user: int, args) -> list:
+    """网络记事本，和机器人一样经 AsyncWebnoteReadWrite 和 HttpPool，全部在同一个事件循环里"""
+    server = start_fake_webnote()
+    http = HttpPool(retries=0)
+    store = AsyncWebnoteReadWrite(http)
+    base = f"http://127.0.0.1:{server.server_address[1]}/"
+    users = [f"{base}{1000000000 + i}" for i in range(args.users)]
+    messages = [make_message(i) for i in range(messages_per_user)]
+    try:
+        start_time = time.perf_counter()
+        for address in users:
+            await store._write(address, "".join(messages))
+        print(f"webnote: populated {args.users} users x {messages_per_user} messages "
+              f"in {time.perf_counter() - start_time:.2f}s")
+
+        results = []
+        for operation in WEBNOTE_OPERATIONS:
+            counter_before = dict(store.counter)
+            latencies = []
+            moved_bytes = 0
+            start_time = time.perf_counter()
+            for i in range(args.ops):
+                address, message = users[i % len(users)], messages[i % len(messages)]
+                op_start = time.perf_counter()
+                if operation == "read":
+                    moved_bytes += len((await store.read(address)).encode('utf-8'))
+                else:
+                    await getattr(store, operation)(address, message)
+                    moved_bytes += len(message.encode('utf-8'))
+                latencies.append(time.perf_counter() - op_start)
+            counts = {key: store.counter[key] - counter_before.get(key, 0) for key in ("page_parsed", "shadow_validated")}
+            results.append(make_result("webnote", messages_per_user, operation, latencies,
+                                       time.perf_counter() - start_time, moved_bytes, **counts))
+        return results
+    finally:
+        await http.aclose()
+        server.shutdown()
+
+
+def bench(backend: str, messages_per_user: int, args) -> list:
+    if backend == "webnote":
+        return asyncio.run(bench_webnote(messages_per_user, args))
+    workdir = tempfile.mkdtemp(prefix="bench_storage_")
+    try:
+        store = build(backend, workdir, args)
+        snapshots = SnapshotStore(os.path.join(workdir, "snapshots"))
+        users = [str(1000000000 + i) for i in range(args.users)]
+        messages = [make_message(i) for i in range(messages_per_user)]
+        start_time = time.perf_counter()
+        for address in users:
+            populate(store, address, messages)
+        print(f"{backend}: populated {args.users} users x {messages_per_user} messages "
+              f"in {time.perf_counter() - start_time:.2f}s")
+
+        results = []
+        for operation in OPERATIONS:
+            if not supports(store, operation):
+                continue
+            # clear 之后就没有数据了，每个用户只做一次
+            amount = len(users) if operation == "clear" else args.ops
+            latencies = []
+            moved_bytes = 0
+            start_time = time.perf_counter()
+            if operation in ASYNC_OPERATIONS:
+                latencies, moved_bytes = asyncio.run(run_async_operation(store, operation, users, messages, amount, args))
+            else:
+                for i in range(amount):
+                    op_start = time.perf_counter()
+                    moved_bytes += run_operation(store, operation, users[i % len(users)], messages[i % len(messages)], snapshots)
+                    latencies.append(time.perf_counter() - op_start)
+            results.append(make_result(backend, messages_per_user, operation, latencies,
+                                       time.perf_counter() - start_time, moved_bytes))
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_table(results: list):
+    """网络记事本另有解析网页和用影子副本的次数"""
+    print(f"{'backend':<14}{'messages':>10}  {'operation':<16}{'ops':>6}{'ops/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'MB':>10}"
+          f"{'parsed':>8}{'shadow':>8}")
+    for r in results:
+        print(f"{r['backend']:<14}{r['messages']:>10}  {r['operation']:<16}{r['ops']:>6}{r['ops_per_s']:>12.1f}"
+              f"{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['bytes'] / 1024 / 1024:>10.2f}"
+              f"{r.get('page_parsed', ''):>8}{r.get('shadow_validated', ''):>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark storage backends")
+    parser.add_argument('--backends', nargs='+', default=["file", "segment", "sqlite", "webnote"], choices=BACKENDS)
+    parser.add_argument('--messages', nargs='+', type=int, default=[1000, 10000], help='stored messages per user')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--ops', type=int, default=100, help='operations of each kind')
+    parser.add_argument('--mongo-uri', help='real MongoDB, default to mongomock')
+    parser.add_argument('--compression', default='none', help='none, zlib or zstd')
+    parser.add_argument('--write-behind-lag', type=float, default=1, help='async_append buffering seconds, 0 to disable')
+    parser.add_argument('--write-behind-records', type=int, default=50)
+    parser.add_argument('--json', help='also save results to this file, to compare between versions')
+    args = parser.parse_args()
+
+    results = []
+    for backend in args.backends:
+        for messages_per_user in args.messages:
+            results.extend(bench(backend, messages_per_user, args))
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
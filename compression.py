@@ -0,0 +1,110 @@
+"""
+存储内容的透明压缩。转存的文本和网址列表重复很多，压缩后通常只剩几分之一
+压缩后的内容是一个帧：1 字节标记 \\x00 + 1 字节算法 + 压缩数据。没有标记的按原文处理，
+因此开启压缩前保存的内容照常可读，开关压缩也不必迁移
+"""
+import codecs
+import io
+import threading
+import zlib
+from collections import defaultdict
+
+try:   # 安装了 zstandard 才能使用 zstd
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+MAGIC = b"\x00"
+CODEC_IDS = {"none": b"n", "zlib": b"z", "zstd": b"s"}
+CODECS = tuple(CODEC_IDS)
+
+
+class Codec:
+    """
+    压缩和解压存储的内容，并统计写入的原始字节数和实际保存的字节数
+    太短的内容压缩不划算，压缩后没有变小的也按原文保存
+    """
+    def __init__(self, name: str="none", level: int=None, min_size: int=128, chunk_size: int=64*1024):
+        if name not in CODEC_IDS:
+            raise ValueError(f"unknown compression {name}, choose from {CODECS}")
+        if name == "zstd" and not ZSTD_AVAILABLE:
+            print("zstandard is not installed, fall back to zlib")
+            name = "zlib"
+        self.name = name
+        self.level = level if level is not None else {"zlib": 6, "zstd": 3}.get(name)
+        self.min_size = min_size
+        self.chunk_size = chunk_size   # 流式解压时，每次解压出的字节数
+        self.counter = defaultdict(int)
+        self._lock = threading.Lock()   # 存储的方法会在线程池中调用
+
+    def _count(self, raw: int, stored: int, compressed: bool):
+        with self._lock:
+            self.counter["raw_bytes"] += raw
+            self.counter["stored_bytes"] += stored
+            self.counter["compressed" if compressed else "plain"] += 1
+
+    def compress(self, text: str):
+        """压缩得到帧 bytes；不压缩的返回原本的 str"""
+        data = text.encode('utf-8')
+        if self.name != "none" and len(data) >= self.min_size:
+            if self.name == "zstd":
+                payload = zstandard.ZstdCompressor(level=self.level).compress(data)
+            else:
+                payload = zlib.compress(data, self.level)
+            if len(payload) + 2 < len(data):
+                self._count(len(data), len(payload) + 2, True)
+                return MAGIC + CODEC_IDS[self.name] + payload
+        self._count(len(data), len(data), False)
+        if text.startswith("\x00"):   # 原文恰好以标记开头的，包成不压缩的帧，读取时才不会误认
+            return MAGIC + CODEC_IDS["none"] + data
+        return text
+
+    def compress_bytes(self, text: str) -> bytes:
+        """用于保存字节的地方，如分段文件，不压缩的也转成 bytes"""
+        value = self.compress(text)
+        return value if isinstance(value, bytes) else value.encode('utf-8')
+
+    def iter_decompress(self, value):
+        """流式解压，逐块返回文本，很大的内容不必一次全部解压到内存"""
+        if isinstance(value, str):
+            yield value
+            return
+        value = bytes(value)
+        decoder = codecs.getincrementaldecoder('utf-8')()   # 块的边界可能在多字节字符中间
+        if not value.startswith(MAGIC):
+            yield decoder.decode(value, final=True)
+            return
+        codec_id, payload = value[1:2], value[2:]
+        if codec_id == CODEC_IDS["zlib"]:
+            decompressor = zlib.decompressobj()
+            while payload:
+                yield decoder.decode(decompressor.decompress(payload, self.chunk_size))
+                payload = decompressor.unconsumed_tail
+            yield decoder.decode(decompressor.flush(), final=True)
+        elif codec_id == CODEC_IDS["zstd"]:
+            if not ZSTD_AVAILABLE:
+                raise RuntimeError("content is compressed by zstd, please install zstandard")
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(payload)) as reader:
+                while chunk := reader.read(self.chunk_size):
+                    yield decoder.decode(chunk)
+            yield decoder.decode(b"", final=True)
+        else:
+            yield decoder.decode(payload, final=True)
+
+    def decompress(self, value) -> str:
+        """str 原样返回，bytes 解压后返回文本"""
+        if isinstance(value, str):
+            return value
+        return "".join(self.iter_decompress(value))
+
+    def stats(self) -> dict:
+        """写入的原始字节数、保存的字节数、压缩率"""
+        stats = dict(self.counter)
+        stats["codec"] = self.name
+        if raw_bytes := stats.get("raw_bytes"):
+            stats["ratio"] = round(stats["stored_bytes"] / raw_bytes, 3)
+        return stats
+
+
+PLAIN = Codec("none")   # 不压缩，各存储的默认值
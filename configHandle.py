@@ -7,6 +7,20 @@ import json
 import ruamel.yaml
 from collections import OrderedDict
 
+from image_encode import PRESETS
+
+FORMAT_ALIASES = {"jpg": "jpeg"}
+
+
+def choose(value, choices, default: str, name: str) -> str:
+    """配置的选项不区分大小写，jpg 当作 jpeg；不在可选范围内的，提示后用默认值"""
+    normalized = str(value).strip().lower()
+    normalized = FORMAT_ALIASES.get(normalized, normalized)
+    if normalized in choices:
+        return normalized
+    print(f"{name}: {value} is not one of {', '.join(choices)}, use {default}")
+    return default
+
 
 class Config(object):
     def __init__(self, configs_path='./configs.yaml') -> None:
@@ -36,7 +50,6 @@ class Config(object):
         # 时间间隔，key 为 id_time，值是数字 秒
 
         self.urls_cache_dict = OrderedDict()
-        self.images_cache_dict = OrderedDict()
 
     def _load_config(self) -> dict:
         if not os.path.exists(self.configs_path):
@@ -54,6 +67,8 @@ class Config(object):
         self.push_dir = configs.get('push_dir')   # 转发目录
         self.domain = configs.get('domain')   # 查看转存内容的网址的域名
         self.netstr = configs.get('path')
+        self.push_page_size = configs.get('push_page_size', 0)   # 分页推送，每页的大小，单位是 KB，0 则不分页
+        self.push_concurrency = configs.get('push_concurrency', 4)   # 分页推送时，同时推送的页数
         self.command2exec = configs.get('exec')   # 在发送 \push 指令后，执行一个命令，设计用于自定义推送，比如 curl 到 webnote
         self.manage_id = [self.chat_id, 1111111111]  # 管理员 id，放的是数字
 
@@ -67,8 +82,54 @@ class Config(object):
         self.process_file = configs.get('process_file', {})
         self.gif_max_width = self.process_file.get('gif_max_width', 300)   # gif 最大的宽默认取 300 像素
         self.video_max_size = self.process_file.get('video_max_size', 25)   # 接收视频的体积不能超过，默认取 25 MB，防止被刷，发个几百兆的转 GIF
+        self.image_workers = self.process_file.get('image_workers', min(os.cpu_count() or 1, 4))   # 常驻的图片处理进程数
+        self.image_queue = self.process_file.get('image_queue', 8)   # 除了正在处理的，最多排队的图片任务数
+        # 图片缓存，按 file_unique_id 保存下载的图片，内存里的超出后写到磁盘，单位都是 MB
+        self.image_cache_size = self.process_file.get('image_cache_size', 64)
+        self.image_disk_cache_size = self.process_file.get('image_disk_cache_size', 512)   # 0 则不写磁盘
+        self.image_cache_dir = self.process_file.get('image_cache_dir', './image_cache/')
+        self.prefetch_concurrency = self.process_file.get('prefetch_concurrency', 4)   # 图片进入队列就在后台下载，同时下载的数量
+        # Telegram 的图片有多个尺寸，每种合成方式下载长边达到这么多像素的最小尺寸，0 则总是用最大的
+        # 合成图片的像素预算，单位是百万像素，解码时就缩小到预算内，0 则不限制
+        self.canvas_max_mp = self.process_file.get('canvas_max_mp', 6.5)   # 拼接的画布，Telegram 发送图片时长边会压缩到 2560
+        self.gif_frame_max_mp = self.process_file.get('gif_frame_max_mp', 0.6)   # 动图的每一帧
+        self.gif_max_mb = self.process_file.get('gif_max_mb', 20)   # 动图写到超出这个大小就不再加帧
+        self.gif_time_budget = self.process_file.get('gif_time_budget', 30)   # 秒，超出后剩下的帧不再抖动
+        # 5 张以上合成动图的默认格式，用户可用 /image format 修改
+        self.animation_format = choose(self.process_file.get('animation_format', 'gif'), ("gif", "webp", "mp4"), "gif", "animation_format")
+        # 合成图片的格式：jpeg、webp、png
+        self.image_format = choose(self.process_file.get('image_format', 'jpeg'), tuple(PRESETS), "jpeg", "image_format")
+        self.image_quality = self.process_file.get('image_quality', 85)   # jpeg、webp 的质量
+        # fast、balanced、small，越往后越慢、越小
+        self.image_preset = choose(self.process_file.get('image_preset', 'balanced'), tuple(PRESETS[self.image_format]), "balanced", "image_preset")
+        self.image_max_mb = self.process_file.get('image_max_mb', 9.5)   # 超出则降低质量或缩小，Telegram 发送图片最大 10 MB
+        self.photo_target = {"text": 1280, "merge": 1280, "array": 1280, "gif": 800} | self.process_file.get('photo_target', {})
+
+        # 共用的 HTTP 连接池，网络记事本、图片和视频下载都用它
+        self.http = configs.get('http', {})
+        self.http_max_connections = self.http.get('max_connections', 20)
+        self.http_per_host = self.http.get('per_host', 6)   # 同一域名最多同时请求数
+        self.http_timeout = self.http.get('timeout', 30)
+        self.http_retries = self.http.get('retries', 2)   # 网络错误或 5xx 的重试次数，间隔指数增加
+        self.http2 = self.http.get('http2', False)   # 需要安装 h2
 
         # MongoDB 的相关配置
         self.mongo_uri = configs.get('mongo_uri')
         self.mongo_db = configs.get('mongo_db')
         self.mongo_collection = configs.get('mongo_collection')
+        self.mongo_mode = configs.get('mongo_mode', 'document')   # document 是每个用户一个文档；record 是每条消息一个文档
+
+        # 本地存储方式，file 是每个用户一个 txt 文件，segment 是追加式分段文件加索引，sqlite 是单文件数据库
+        self.store_backend = configs.get('store_backend', 'file')
+        self.sqlite_path = configs.get('sqlite_path', './forward_message/forward.db')
+        self.segment_size = configs.get('segment_size', 4)   # 分段存储时，每段文件的大小，单位是 MB
+        # 保存时压缩，none 不压缩，zlib，zstd（需要安装 zstandard）。file 方式的 txt 不压缩
+        self.compression = configs.get('compression', 'none')
+        self.compression_level = configs.get('compression_level')   # 不设置则 zlib 用 6，zstd 用 3
+        # 写缓冲，连续转发时把追加合并写入。write_behind_lag 是最多延迟写入的秒数，0 则不缓冲
+        self.write_behind_lag = configs.get('write_behind_lag', 1)
+        self.write_behind_records = configs.get('write_behind_records', 50)   # 攒够这么多条立即写入
+        # 同步路径的后台同步，转发停下 sync_debounce 秒后才同步，连续转发时最多等 sync_max_wait 秒
+        self.sync_debounce = configs.get('sync_debounce', 10)
+        self.sync_max_wait = configs.get('sync_max_wait', 60)
+        self.snapshot_keep = configs.get('snapshot_keep', 5)   # 清空前保存快照，每个用户保留最近的份数
@@ -9,12 +9,12 @@ from telegram.ext import filters, MessageHandler, ApplicationBuilder, CommandHan
 
 import preprocess
 # 从 tgbotBehavior.py 导入定义机器人动作的函数
-from tgbotBehavior import start, transfer, clear_or_delete_all_my_data, push, unknown, earliest_msg, sure_clear, delete_last_msg, image_get, shutdown, reload_config, confirm_delete
+from tgbotBehavior import start, transfer, clear_or_delete_all_my_data, push, unknown, earliest_msg, sure_clear, delete_last_msg, image_get, shutdown, reload_config, confirm_delete, flush_on_shutdown, start_on_startup, show_stats, restore
 from multi import set_config
 
 
 if __name__ == '__main__':
-    application = ApplicationBuilder().token(preprocess.config.bot_token).build()
+    application = ApplicationBuilder().token(preprocess.config.bot_token).post_init(start_on_startup).post_shutdown(flush_on_shutdown).build()
 
     # 注册 start_handler ，以便调度
     application.add_handler(CommandHandler('start', start))
@@ -26,7 +26,9 @@ if __name__ == '__main__':
     application.add_handler(CommandHandler('emsg', earliest_msg))   # 显示最早的一条信息
     application.add_handler(CommandHandler('dmsg', delete_last_msg))   # 删除最新的一条信息
     application.add_handler(CommandHandler('set', set_config))   # 设置参数，如网址路径
+    application.add_handler(CommandHandler('restore', restore))   # 列出或恢复清空前的快照
     application.add_handler(CommandHandler('reload', reload_config))   # 重载配置文件
+    application.add_handler(CommandHandler('stats', show_stats))   # 查看运行状态
     application.add_handler(CommandHandler('shutdown', shutdown))   # 停止机器人
     application.add_handler(CommandHandler('delete_all_my_data', confirm_delete))   # 删除用户数据
 
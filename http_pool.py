@@ -0,0 +1,98 @@
+"""
+进程内共用的异步 HTTP 客户端，网络记事本的读写、图片和视频的下载都用它，复用连接，不必每次都重新握手
+"""
+import asyncio
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import httpx
+
+try:   # 安装了 h2 才能使用 HTTP/2
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class HttpPool:
+    """
+    带连接池的 httpx.AsyncClient，第一次请求时才创建
+    限制每个域名的并发数，超时，失败后按指数退避重试，并统计请求情况
+    """
+    def __init__(self, max_connections: int=20, max_keepalive: int=10, per_host: int=6,
+                 timeout: float=30, retries: int=2, backoff: float=0.5, http2: bool=False, verify: bool=False):
+        self.configure(max_connections, max_keepalive, per_host, timeout, retries, backoff, http2, verify)
+        self._client = None
+        self._host_semaphores = {}
+        self.counter = defaultdict(int)
+
+    def configure(self, max_connections: int=20, max_keepalive: int=10, per_host: int=6,
+                  timeout: float=30, retries: int=2, backoff: float=0.5, http2: bool=False, verify: bool=False):
+        """修改参数，需在第一次请求前调用"""
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.per_host = per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.verify = verify   # 网络记事本多是自签证书，沿用之前不验证的做法
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=self.http2,
+                                             verify=self.verify, follow_redirects=True)
+        return self._client
+
+    def _semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.per_host)
+        return self._host_semaphores[host]
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        发出请求，网络错误和 5xx 会重试，网络错误重试用完仍失败则抛出异常
+        4xx 和重试用完的 5xx 原样返回，网络记事本要用到 304 之类的状态码，由调用者检查
+        """
+        async with self._semaphore(url):
+            for attempt in range(self.retries + 1):
+                self.counter["requests"] += 1
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                    if response.status_code < 500 or attempt == self.retries:
+                        self.counter["bytes_received"] += len(response.content)
+                        return response
+                except httpx.TransportError:
+                    if attempt == self.retries:
+                        self.counter["failures"] += 1
+                        raise
+                self.counter["retries"] += 1
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        self.counter["bytes_sent"] += sum(len(str(value).encode('utf-8')) for value in kwargs.get("data", {}).values())
+        return await self.request("POST", url, **kwargs)
+
+    def stats(self) -> dict:
+        """请求次数、重试、失败、收发字节数，以及连接池里的连接数"""
+        stats = dict(self.counter)
+        stats["http2"] = self.http2
+        if self._client is not None and not self._client.is_closed:
+            # httpx 没有公开连接池的情况，取不到就不统计
+            connections = getattr(getattr(self._client._transport, "_pool", None), "connections", [])
+            stats["connections"] = len(connections)
+            stats["idle_connections"] = sum(connection.is_idle() for connection in connections)
+        return stats
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# 整个进程共用这一个
+pool = HttpPool()
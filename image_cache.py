@@ -0,0 +1,107 @@
+"""
+图片缓存，按 Telegram 的 file_unique_id 保存未解码的图片字节。两层：内存里按总字节数限制，
+挤出的写到磁盘，磁盘也按总字节数限制，都是最近最少使用的先淘汰
+"""
+import os
+import threading
+from collections import defaultdict, OrderedDict
+
+
+class ImageCache:
+    def __init__(self, disk_dir: str, max_bytes: int=64*1024*1024, max_disk_bytes: int=512*1024*1024):
+        self.disk_dir = disk_dir
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes   # 0 则不写磁盘
+        self._memory = OrderedDict()   # key: 字节
+        self._memory_bytes = 0
+        self._disk = OrderedDict()   # key: 字节数
+        self._disk_bytes = 0
+        self._lock = threading.Lock()   # 读写磁盘时会在线程池中调用
+        self.counter = defaultdict(int)
+        self._load_disk_index()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key)
+
+    def _load_disk_index(self):
+        """启动时按修改时间恢复磁盘层的顺序"""
+        if not self.max_disk_bytes:
+            return
+        os.makedirs(self.disk_dir, exist_ok=True)
+        entries = [entry for entry in os.scandir(self.disk_dir) if entry.is_file() and not entry.name.endswith(".tmp")]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            self._disk[entry.name] = entry.stat().st_size
+            self._disk_bytes += entry.stat().st_size
+        self._evict_disk()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._memory or key in self._disk
+
+    def get(self, key: str):
+        """取出图片字节，没有则返回 None。磁盘层命中的，放回内存层"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.counter["memory_hits"] += 1
+                return self._memory[key]
+            if key in self._disk:
+                try:
+                    with open(self._disk_path(key), 'rb') as f:
+                        data = f.read()
+                except FileNotFoundError:
+                    self._disk_bytes -= self._disk.pop(key)
+                else:
+                    self.counter["disk_hits"] += 1
+                    self._put_memory(key, data)
+                    return data
+            self.counter["misses"] += 1
+            return None
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            self._put_memory(key, data)
+
+    def _put_memory(self, key: str, data: bytes):
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+            old_key, old_data = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_data)
+            self.counter["memory_evictions"] += 1
+            self._spill(old_key, old_data)
+
+    def _spill(self, key: str, data: bytes):
+        """内存层挤出的写到磁盘层，已在磁盘上的只更新顺序"""
+        if not self.max_disk_bytes or len(data) > self.max_disk_bytes:
+            return
+        if key in self._disk:
+            self._disk.move_to_end(key)
+            return
+        path = self._disk_path(key)
+        with open(path + ".tmp", 'wb') as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        self._disk[key] = len(data)
+        self._disk_bytes += len(data)
+        self.counter["spilled"] += 1
+        self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            old_key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.counter["disk_evictions"] += 1
+            try:
+                os.remove(self._disk_path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        stats = dict(self.counter)
+        stats["memory_bytes"] = self._memory_bytes
+        stats["memory_entries"] = len(self._memory)
+        stats["disk_bytes"] = self._disk_bytes
+        stats["disk_entries"] = len(self._disk)
+        return stats
@@ -0,0 +1,86 @@
+"""
+合成图片的输出编码。可选 JPEG、WebP、PNG，各有 fast、balanced、small 三档预设，
+给了体积上限的，先二分查找能放下的最高质量，最低质量也放不下的再缩小图片
+"""
+import io
+import time
+
+from PIL import Image
+
+EXTENSIONS = {"jpeg": "jpg", "webp": "webp", "png": "png"}
+
+# 每种格式每档预设传给 Image.save 的参数，quality 另外指定
+PRESETS = {
+    "jpeg": {"fast": {"optimize": False},
+             "balanced": {"optimize": True},
+             "small": {"optimize": True, "progressive": True, "subsampling": "4:2:0"}},
+    "webp": {"fast": {"method": 0},
+             "balanced": {"method": 4},
+             "small": {"method": 6}},
+    "png": {"fast": {"compress_level": 1},
+            "balanced": {"compress_level": 6},
+            "small": {"compress_level": 9, "optimize": True}},
+}
+
+MIN_QUALITY = 40   # 放不下时质量最低降到这里，再低就缩小图片
+MAX_SHRINK_TIMES = 4
+
+
+def _save(image: Image.Image, image_format: str, quality: int, params: dict) -> io.BytesIO:
+    image_io = io.BytesIO()
+    if image_format == "png":
+        image.save(image_io, "PNG", **params)
+    else:
+        image.save(image_io, image_format.upper(), quality=quality, **params)
+    return image_io
+
+
+def _fit_quality(image, image_format, quality, params, max_bytes, stats):
+    """二分查找不超过 max_bytes 的最高质量，返回字节流，最低质量也超出的返回 None"""
+    low, high = MIN_QUALITY, quality
+    best = None
+    while low <= high:
+        middle = (low + high) // 2
+        image_io = _save(image, image_format, middle, params)
+        stats["attempts"] += 1
+        if image_io.tell() <= max_bytes:
+            best, stats["quality"] = image_io, middle
+            low = middle + 1
+        else:
+            high = middle - 1
+    return best
+
+
+def encode_image(image: Image.Image, image_format: str="jpeg", quality: int=85, preset: str="balanced",
+                 max_bytes: int=0, stats: dict=None) -> io.BytesIO:
+    """
+    编码一张图片，返回字节流。max_bytes 为 0 则不限制体积
+    stats 传入字典的，会记下格式、质量、尝试次数、缩小次数、字节数和耗时
+    """
+    stats = stats if stats is not None else {}
+    if preset not in PRESETS.get(image_format, {}):
+        raise ValueError(f"unknown image format {image_format} or preset {preset}, "
+                         f"formats: {', '.join(PRESETS)}, presets: {', '.join(PRESETS['jpeg'])}")
+    params = PRESETS[image_format][preset]
+    if image_format == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    stats.update(format=image_format, quality=None if image_format == "png" else quality, attempts=1, shrunk=0)
+    start_time = time.perf_counter()
+
+    image_io = _save(image, image_format, quality, params)
+    while max_bytes and image_io.tell() > max_bytes and stats["shrunk"] < MAX_SHRINK_TIMES:
+        if image_format != "png":
+            fitted = _fit_quality(image, image_format, quality, params, max_bytes, stats)
+            if fitted:
+                image_io = fitted
+                break
+        # 体积大致和像素数成正比，按比例缩小，多缩一点免得再来一次
+        scale = (max_bytes / image_io.tell()) ** 0.5 * 0.9
+        image = image.resize((max(int(image.width * scale), 1), max(int(image.height * scale), 1)), Image.LANCZOS)
+        stats["shrunk"] += 1
+        image_io = _save(image, image_format, quality, params)
+        stats["attempts"] += 1
+
+    stats.update(bytes=image_io.tell(), size=image.size, seconds=round(time.perf_counter() - start_time, 3))
+    image_io.seek(0)
+    return image_io
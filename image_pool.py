@@ -0,0 +1,185 @@
+"""
+常驻的图片处理进程池。机器人启动时创建，进程里预先导入 PIL 并加载字体，
+/image 时直接把合成交给它，不必每次新起一批进程、重新导入，关闭机器人时才结束
+
+图片通过共享内存交接：主进程把未解码的图片字节放进一块共享内存，处理进程在自己这边解码，
+结果也写入共享内存。pickle 传递的只有共享内存的名字和偏移，不再复制整张位图
+"""
+import asyncio
+import io
+import os
+import queue
+import time
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+
+def _init_worker(fonts: tuple, ready):
+    """每个进程启动时执行一次，导入 PIL 并注册全部图片格式，导入处理图片的模块，预先加载字体，然后报告自己的 pid"""
+    from PIL import Image
+    Image.init()   # 不然第一次打开图片时才去导入各格式的插件
+    from process_images import load_font
+    for font_type, font_size in fonts:
+        try:
+            load_font(font_type, font_size)
+        except OSError as e:   # 没有安装这个字体，用到时才会报错
+            print(f"fail to preload font {font_type}: {e}")
+    ready.put(os.getpid())
+
+
+def _noop():
+    return None
+
+
+def _compose_shared(func, input_name: str, spans: list, args: tuple, max_pixels: int, per_image: bool) -> tuple:
+    """
+    在处理进程中执行。从共享内存取出图片字节，按像素预算缩小着解码，调用 func(图片列表, *args)，
+    把返回的字节流写入新的一块共享内存，返回 (名字, 字节数)，由主进程读取后释放
+    """
+    from PIL import Image
+    from process_images import reduce_images
+    shm = SharedMemory(name=input_name)
+    try:   # 只读出文件头，还没解码
+        image_list = [Image.open(io.BytesIO(shm.buf[start:end])) for start, end in spans]
+    finally:
+        shm.close()
+    image_list = reduce_images(image_list, max_pixels, per_image)
+    result = func(image_list, *args).getbuffer()
+    output = SharedMemory(create=True, size=max(len(result), 1))
+    output.buf[:len(result)] = result
+    output.close()
+    return output.name, len(result)
+
+
+class ImagePool:
+    """
+    包装 ProcessPoolExecutor，进程数可配置。同时提交的任务数有上限，超过的等待，
+    不会因为很多人同时 /image 在内存里堆积大量图片。进程意外退出导致池损坏的，自动重建
+    """
+    def __init__(self, workers: int=2, queue_size: int=8, fonts: tuple=(("simsun.ttc", 26),)):
+        self.configure(workers, queue_size, fonts)
+        self._executor = None
+        self._ready = None
+        self.counter = defaultdict(int)
+        self.pending = 0   # 已提交还没完成的，包括等待中的
+
+    def configure(self, workers: int=2, queue_size: int=8, fonts: tuple=(("simsun.ttc", 26),)):
+        """修改参数，需在 start 前调用"""
+        self.workers = workers
+        self.queue_size = queue_size   # 除了正在处理的，最多还有这么多任务排队
+        self.fonts = fonts
+        self._slots = None
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+        return self._slots
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # 先在主进程启动 resource_tracker，处理进程继承同一个，共享内存由主进程统一释放
+        resource_tracker.ensure_running()
+        context = multiprocessing.get_context()
+        self._ready = context.Queue()   # 每个进程初始化完成后放入自己的 pid
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                   initializer=_init_worker, initargs=(self.fonts, self._ready))
+
+    def _wait_ready(self, timeout: float) -> list:
+        """等待每个进程都执行完初始化，返回它们的 pid"""
+        pids = []
+        deadline = time.monotonic() + timeout
+        while len(pids) < self.workers:
+            try:
+                pids.append(self._ready.get(timeout=max(deadline - time.monotonic(), 0.01)))
+            except queue.Empty:
+                break
+        return pids
+
+    async def start(self, timeout: float=60):
+        """
+        创建进程池，等每个进程都启动并完成初始化，第一个 /image 不必等待
+        提交一个空任务让进程池创建进程，以 fork 启动的会一次创建全部进程，每个都执行 _init_worker
+        """
+        if self._executor is None:
+            self._executor = self._new_executor()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, _noop)
+        pids = await loop.run_in_executor(None, self._wait_ready, timeout)
+        print(f"image pool started, {len(pids)} of {self.workers} workers ready: {sorted(pids)}")
+
+    async def run(self, func, *args):
+        """在进程池中执行 func(*args)，排队的任务满了就等待"""
+        loop = asyncio.get_running_loop()
+        queued_time = time.perf_counter()
+        self.pending += 1
+        try:
+            return await self._run(loop, queued_time, func, *args)
+        finally:
+            self.pending -= 1
+
+    async def _run(self, loop, queued_time, func, *args):
+        async with self.slots:
+            self.counter["wait_ms"] += int((time.perf_counter() - queued_time) * 1000)
+            if self._executor is None:
+                self._executor = self._new_executor()
+            self.counter["submitted"] += 1
+            try:
+                result = await loop.run_in_executor(self._executor, func, *args)
+            except BrokenProcessPool:
+                self.counter["broken"] += 1
+                self._executor = self._new_executor()
+                raise
+            except Exception:
+                self.counter["failed"] += 1
+                raise
+            self.counter["completed"] += 1
+            return result
+
+    async def compose(self, func, sources: list, *args, max_pixels: int=0, per_image: bool=False) -> io.BytesIO:
+        """
+        合成图片，sources 是未解码的图片字节列表，func 是 process_images 中接收 Image 列表、返回字节流的函数
+        max_pixels 是像素预算，per_image 为真则是每张图片的，否则是全部图片合计的，0 则不限制
+        输入输出都经由共享内存，返回字节流
+        """
+        spans = []
+        offset = 0
+        for source in sources:
+            spans.append((offset, offset + len(source)))
+            offset += len(source)
+        shm = SharedMemory(create=True, size=max(offset, 1))
+        try:
+            for source, (start, end) in zip(sources, spans):
+                shm.buf[start:end] = source
+            output_name, size = await self.run(_compose_shared, func, shm.name, spans, args, max_pixels, per_image)
+        finally:
+            shm.close()
+            shm.unlink()
+        output = SharedMemory(name=output_name)
+        try:
+            result = io.BytesIO(bytes(output.buf[:size]))
+        finally:
+            output.close()
+            output.unlink()
+        self.counter["bytes_in"] += offset
+        self.counter["bytes_out"] += size
+        return result
+
+    def stats(self) -> dict:
+        stats = dict(self.counter)
+        stats["workers"] = self.workers
+        stats["pending"] = self.pending
+        return stats
+
+    def shutdown(self):
+        """关闭进程池，正在处理的做完，排队的取消"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+# 整个进程共用这一个
+pool = ImagePool()
@@ -1,43 +1,129 @@
-"""用于将使用本地文件保存的数据，迁移到 MongoDB 上"""
-import os
+"""
+在不同的存储方式之间迁移数据，如本地文件迁移到 MongoDB，MongoDB 迁移到 SQLite
+按批读取用户，多线程批量写入，每完成一批就在进度文件末尾追加一行，中断后再次运行会跳过已完成的用户
+进度文件第一行是 {"source", "target"}，之后每行是一批已完成用户的 JSON 列表
 
-from pymongo import MongoClient
+python migrate.py --source file --target mongo
+python migrate.py --config ./config.yaml --source mongo --target sqlite --batch 200 --workers 8
+"""
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 from configHandle import Config
+from Transmit import STORE_BACKENDS, build_stores, split_records
 
 
-config = Config("./config.yaml")
+def read_records(store, address: str, is_url: bool) -> list:
+    """按记录存储的，逐条读出；整体存储的，读出再拆开"""
+    if getattr(store, "record_based", False):
+        return list(store.iter_read(address))
+    return split_records(store.read(address), is_url)
 
-store_dir = "./forward_message"
 
-uri = config.mongo_uri
-db_name = config.mongo_db
-collection_name = config.mongo_collection
+def migrate_batch(source_stores, target_stores, addresses: list) -> int:
+    """迁移一批用户，消息和网址各一次批量写入，返回迁移的字节数"""
+    moved_bytes = 0
+    for is_url, (source, target) in enumerate(zip(source_stores, target_stores)):
+        items = [(address, read_records(source, address, is_url)) for address in addresses]
+        moved_bytes += sum(len(record.encode('utf-8')) for _, records in items for record in records)
+        target.bulk_load(items)
+    return moved_bytes
 
-client = MongoClient(uri)
-db = client[db_name]
-collection = db[collection_name]
 
-# collection.delete_one({"user_id": "2082052804"})
+def load_checkpoint(path: str, source: str, target: str):
+    """读取已完成的用户，返回集合，来源或目标不同的返回 None。没写完整的行（中断时）跳过"""
+    if not os.path.exists(path):
+        return None
+    done = set()
+    with open(path, 'r') as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            return None
+        if header.get("source") != source or header.get("target") != target:
+            return None
+        for line in f:
+            try:
+                done.update(json.loads(line))
+            except ValueError:   # 中断时没写完的半行
+                continue
+    return done
 
-# 获取目录下所有文件名（不包括子目录中的文件）
-file_names = [f for f in os.listdir(store_dir) if os.path.isfile(os.path.join(store_dir, f))]
-names_without_ext = (os.path.splitext(name)[0] for name in file_names if name.endswith(".txt"))
 
-data = []
-for file_name, name_without_ext in zip(file_names, names_without_ext):
-    if not name_without_ext.endswith("_url"):
-        with open(os.path.join(store_dir, file_name), 'r', encoding='utf-8') as f:
-            stored = f.read()
-        try:
-            with open(os.path.join(store_dir, name_without_ext + "_url.txt"), 'r', encoding='utf-8') as f:
-                stored_url = f.read()
-        except FileNotFoundError:
-            stored_url = ""
-        
-        single_data = {"user_id": name_without_ext, "forward": stored, "forward_url": stored_url}
-        data.append(single_data)
-
-# print(data)
-result = collection.insert_many(data)
-# print(result.inserted_ids)
+def open_checkpoint(path: str, source: str, target: str, resume: bool):
+    """继续的，在末尾追加；否则重新开始，写入第一行"""
+    if resume:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            f.seek(max(size - 1, 0))
+            broken = size > 0 and f.read(1) != b"\n"
+        f = open(path, 'a')
+        if broken:   # 上次中断在一行中间，另起一行，半行读的时候会跳过
+            f.write("\n")
+        return f
+    f = open(path, 'w')
+    f.write(json.dumps({"source": source, "target": target}) + "\n")
+    f.flush()
+    return f
+
+
+def append_checkpoint(f, batch: list):
+    """一批完成后追加一行，只写这一批，不重写全部进度"""
+    f.write(json.dumps(batch) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def migrate(config, source: str, target: str, batch_size: int=100, workers: int=4, checkpoint: str="migrate_checkpoint.jsonl"):
+    source_stores = build_stores(config, source)
+    target_stores = build_stores(config, target)
+
+    addresses = sorted(set(source_stores[0].list_addresses()) | set(source_stores[1].list_addresses()))
+    done = load_checkpoint(checkpoint, source, target)
+    checkpoint_file = open_checkpoint(checkpoint, source, target, resume=done is not None)
+    done = done or set()
+    pending = [address for address in addresses if address not in done]
+    print(f"{len(addresses)} users in {source}, {len(done)} already migrated, {len(pending)} to go")
+
+    batches = (pending[i:i + batch_size] for i in range(0, len(pending), batch_size))
+    start_time = time.perf_counter()
+    migrated_users = 0
+    migrated_bytes = 0
+    with checkpoint_file, ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while True:
+            # 同时在跑的批次不超过线程数的两倍，内存中只有这些批次的数据
+            while len(running) < workers * 2 and (batch := next(batches, None)):
+                running[pool.submit(migrate_batch, source_stores, target_stores, batch)] = batch
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                batch = running.pop(future)
+                migrated_bytes += future.result()
+                migrated_users += len(batch)
+                append_checkpoint(checkpoint_file, batch)
+                spend_time = max(time.perf_counter() - start_time, 1e-9)
+                print(f"{migrated_users}/{len(pending)} users, "
+                      f"{migrated_users / spend_time:.1f} users/s, {migrated_bytes / 1024 / 1024 / spend_time:.2f} MB/s")
+
+    spend_time = time.perf_counter() - start_time
+    print(f"finish migrating {migrated_users} users, {migrated_bytes / 1024 / 1024:.2f} MB in {spend_time:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="migrate stored messages between storage backends")
+    parser.add_argument('--config', default='./config.yaml', help='Config File Path')
+    parser.add_argument('--source', default='file', choices=STORE_BACKENDS)
+    parser.add_argument('--target', default='mongo', choices=STORE_BACKENDS)
+    parser.add_argument('--batch', type=int, default=100, help='users per batch')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--checkpoint', default='migrate_checkpoint.jsonl', help='progress file, used to resume')
+    args = parser.parse_args()
+
+    if args.source == args.target:
+        parser.error("source and target are the same")
+    migrate(Config(args.config), args.source, args.target, args.batch, args.workers, args.checkpoint)
@@ -0,0 +1,77 @@
+"""
+图片一进入队列就在后台获取下载地址并下载到缓存，等到 /image 时，多数图片已经就绪，只剩合成这一步
+"""
+import asyncio
+from collections import defaultdict
+
+
+class PhotoPrefetcher:
+    """
+    每张图片一个后台任务，同时下载的数量有上限。/image 时取用已经开始的任务，没有的才现场下载
+    清空队列时取消这个用户还没完成的任务
+    后台任务只把图片放入缓存，不持有图片字节，排队很多图片不 /image 也不会在缓存的字节数上限之外占用内存
+    """
+    def __init__(self, fetch, concurrency: int=4):
+        self.fetch = fetch   # 协程函数，传入 (file_unique_id, file_id)，返回图片字节，并放入缓存，缓存里有的直接返回
+        self.concurrency = concurrency
+        self._semaphore = None
+        self._tasks = defaultdict(dict)   # 用户 id: {file_unique_id: 任务}
+        self.counter = defaultdict(int)
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def request(self, userid_str: str, file_unique_id: str, file_id: str):
+        """登记一张进入队列的图片，立即返回"""
+        if file_unique_id in self._tasks[userid_str]:
+            return
+        self.counter["requested"] += 1
+        self._tasks[userid_str][file_unique_id] = asyncio.create_task(self._prefetch(file_unique_id, file_id))
+
+    def has(self, userid_str: str, file_unique_id: str) -> bool:
+        """这张图片是否已登记，正在或已经下载"""
+        return file_unique_id in self._tasks.get(userid_str, {})
+
+    async def _prefetch(self, file_unique_id: str, file_id: str) -> bool:
+        """下载到缓存，返回是否成功，失败的 /image 时会再现场下载"""
+        async with self.semaphore:
+            try:
+                await self.fetch(file_unique_id, file_id)
+            except Exception as e:
+                print(f"prefetch {file_unique_id} failed: {e}")
+                return False
+            return True
+
+    async def get(self, userid_str: str, file_unique_id: str, file_id: str) -> bytes:
+        """
+        取出图片字节，后台任务还在进行的就等它，完成后从缓存中读取。
+        失败、没有登记或者已经被挤出缓存的，fetch 会现场下载
+        """
+        tasks = self._tasks.get(userid_str, {})
+        task = tasks.pop(file_unique_id, None)
+        if not tasks:
+            self._tasks.pop(userid_str, None)
+        prefetched = False
+        if task:
+            try:
+                prefetched = await task
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():   # 是 /image 本身被取消，不是后台任务
+                    raise
+        self.counter["prefetched" if prefetched else "fetched_on_demand"] += 1
+        return await self.fetch(file_unique_id, file_id)
+
+    def cancel(self, userid_str: str):
+        """清空队列时调用，取消这个用户的后台下载"""
+        for task in self._tasks.pop(userid_str, {}).values():
+            if not task.done():
+                task.cancel()
+                self.counter["cancelled"] += 1
+
+    def stats(self) -> dict:
+        stats = dict(self.counter)
+        stats["running"] = sum(not task.done() for tasks in self._tasks.values() for task in tasks.values())
+        return stats
@@ -1,11 +1,13 @@
 # config.py
 import os
-from urllib.parse import urlparse
 import logging
 import argparse
 
 from configHandle import Config
-from Transmit import LocalReadWrite, WebnoteReadWrite, MongoDBReadWrite
+from http_pool import pool
+from image_pool import pool as image_pool
+from async_transmit import AsyncReadWrite, AsyncWebnoteReadWrite, WriteBehindBuffer
+from Transmit import LocalReadWrite, build_stores, configured_backend
 
 # 创建一个解析器
 parser = argparse.ArgumentParser(description="Your script description")
@@ -20,18 +22,25 @@ configfile = args.config
 # 定义所有变量
 config = Config(configfile)
 
-if config.mongo_uri:
-    io4message = MongoDBReadWrite(uri=config.mongo_uri, db_name=config.mongo_db, collection_name=config.mongo_collection, field="forward")
-    io4urlmsg = MongoDBReadWrite(uri=config.mongo_uri, db_name=config.mongo_db, collection_name=config.mongo_collection, field="forward_url")
-    print("Use MongoDB to store")
-else:
-    io4message = LocalReadWrite(rootpath_of_store=config.store_dir, suffix=".txt")
-    io4urlmsg = LocalReadWrite(rootpath_of_store=config.store_dir, suffix="_url.txt")
-
-if os.path.exists(config.push_dir):   # 若是本地目录
-    io4push = LocalReadWrite(rootpath_of_store=config.push_dir)
-elif urlparse(config.push_dir).scheme in ('http', 'https'):   # 若是网址路径
-    io4push = WebnoteReadWrite()
+pool.configure(max_connections=config.http_max_connections, per_host=config.http_per_host,
+               timeout=config.http_timeout, retries=config.http_retries, http2=config.http2)
+
+image_pool.configure(workers=config.image_workers, queue_size=config.image_queue)
+
+io4message, io4urlmsg = build_stores(config)
+print(f"Use {configured_backend(config)} to store")
+
+if config.push_dir and os.path.exists(config.push_dir):   # 若是本地目录
+    aio4push = AsyncReadWrite(LocalReadWrite(rootpath_of_store=config.push_dir))
+else:   # 若是网址路径，或没有设置，默认推送到作者的网络记事本
+    aio4push = AsyncWebnoteReadWrite()
+
+# 处理函数中使用异步的版本，阻塞的读写在线程池里执行，不卡住事件循环
+aio4message = AsyncReadWrite(io4message)
+aio4urlmsg = AsyncReadWrite(io4urlmsg)
+if config.write_behind_lag > 0:   # 追加先缓冲，合并写入
+    aio4message = WriteBehindBuffer(aio4message, max_lag=config.write_behind_lag, max_records=config.write_behind_records)
+    aio4urlmsg = WriteBehindBuffer(aio4urlmsg, max_lag=config.write_behind_lag, max_records=config.write_behind_records)
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
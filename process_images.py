@@ -1,12 +1,15 @@
-import io, os
-from collections import OrderedDict
+import io, os, math
+import itertools
+from functools import lru_cache
 import asyncio
 
 from urllib.parse import urlparse
-import httpx
 
 from PIL import Image, ImageDraw, ImageFont
-import numpy as np
+
+from http_pool import pool
+from animation import encode_gif, encode_webp, encode_mp4
+from image_encode import encode_image
 
 """
 返回的都是字节流 gif_io = io.BytesIO()
@@ -22,50 +25,97 @@ async def open_image_async(image_file):
     print(f"finish to open file {image_file}")
     return image
 
-async def download_image(url):
+async def download_image(url) -> bytes:
+    """下载图片，返回未解码的字节，解码留给处理图片的进程。状态码不是 2xx 的抛出 httpx.HTTPStatusError"""
     print(f"start to download file {url}")
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        image_data = Image.open(io.BytesIO(response.content))
-        print(f"{url} has been downloaded")
-        return image_data
+    response = await pool.get(url)
+    response.raise_for_status()   # 不然错误网页会被当作图片
+    print(f"{url} has been downloaded")
+    return response.content
+
+
+def verify_image(source: bytes):
+    """检查字节是不是完好的图片，不是则抛出异常，如 PIL.UnidentifiedImageError。只检查，不解码"""
+    with Image.open(io.BytesIO(source)) as image:
+        image.verify()
+
+
+async def read_image_async(image_file) -> bytes:
+    """用异步读取单个本地图片的字节"""
+    loop = asyncio.get_event_loop()
+    with open(image_file, 'rb') as f:
+        return await loop.run_in_executor(None, f.read)
 
-async def open_image_from_various(image_dir_list: list, cache=None) -> list:
+
+async def load_image_sources(image_dir_list: list) -> list:
     """
-    根据传入图片路径的不同，如本地路径，网络路径，使用不同方式打开图片，并返回 Image 列表
-    由于这个函数现在是异步的，所以需要使用await关键字来调用它。
+    根据传入图片路径的不同，如本地路径，网络路径，使用不同方式读取图片，返回未解码的字节列表
+    JPEG 之类压缩过的字节比解码后的位图小得多，缓存和交给处理进程都用它。缓存由调用者按 file_unique_id 管理
     :param image_dir_list:
-    :param cache:   缓存，数据结构要是 OrderedDict()
     :return:
     """
     path = image_dir_list[0]
-    if cache is None:   # 若未指定缓存，则生成局部变量，等函数执行完也就清除了
-        cache = OrderedDict()
-
     if os.path.exists(path):
-        # 使用 asyncio.gather 来并发打开多个图片
-        return await asyncio.gather(*(open_image_async(image_file) for image_file in image_dir_list))
+        # 使用 asyncio.gather 来并发读取多个图片
+        return await asyncio.gather(*(read_image_async(image_file) for image_file in image_dir_list))
     elif urlparse(path).scheme in ('http', 'https'):
-        # 获取文件名
-        base_names = [urlparse(url).path.split("/")[-1] for url in image_dir_list]
-        # 将缓存中没有的图片地址分离出
-        need_downloads = [(base_name, url) for base_name, url in zip(base_names, image_dir_list) if base_name not in cache]
         # 并发下载所有图片
-        new_downloads = await asyncio.gather(*(download_image(url) for _, url in need_downloads))
-        # 添加图片数据到缓存
-        for (base_name, _), image_data in zip(need_downloads, new_downloads):
-            cache[base_name] = image_data
-        # 组合本次需要的图片
-        img_list = [cache[base_name] for base_name in base_names]
-        # 删除最旧的键值对，如果缓存超过了50条
-        while(len(cache) > 50):
-            cache.popitem(last=False)
-        return img_list
+        return await asyncio.gather(*(download_image(url) for url in image_dir_list))
     else:
         print("Unknown image_dir")
         return []
 
 
+async def open_image_from_various(image_dir_list: list) -> list:
+    """
+    根据传入图片路径的不同，如本地路径，网络路径，使用不同方式打开图片，并返回 Image 列表
+    由于这个函数现在是异步的，所以需要使用await关键字来调用它。
+    """
+    sources = await load_image_sources(image_dir_list)
+    return [Image.open(io.BytesIO(source)) for source in sources]
+
+
+def choose_photo_size(sizes: list, target: int, is_ready=None) -> tuple:
+    """
+    sizes 是一张图片的全部尺寸 [(宽, 高, file_unique_id, file_id)]，从小到大，
+    返回长边达到 target 的最小的一个，没有够大的或 target 为 0 就用最大的。
+    is_ready(file_unique_id) 为真的，即更大的但已下载好的，直接用，不再下载小的
+    """
+    enough = [size for size in sizes if max(size[0], size[1]) >= target] if target else []
+    if not enough:
+        return sizes[-1]
+    if is_ready:
+        for size in enough:
+            if is_ready(size[2]):
+                return size
+    return enough[0]
+
+
+def reduce_images(image_list, max_pixels=0, per_image=False) -> list:
+    """
+    按像素预算解码图片，返回解码好的 Image 列表。per_image 为真则每张都不超过 max_pixels，如 GIF 的每一帧；
+    否则全部图片的像素合计不超过，如拼接的画布。JPEG 用 draft 直接以 1/2、1/4、1/8 的分辨率解码，
+    再缩小到目标尺寸，不必先解码出全尺寸的位图。传入的须是刚 open、还没解码的图片，0 则不缩小
+    """
+    total_pixels = sum(image.width * image.height for image in image_list)
+    reduced_list = []
+    for image in image_list:
+        pixels = image.width * image.height if per_image else total_pixels
+        scale = math.sqrt(max_pixels / pixels) if max_pixels and pixels else 1
+        if scale >= 1:
+            image.load()
+            reduced_list.append(image)
+            continue
+        target = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+        if image.format == "JPEG":
+            image.draft(image.mode, target)   # 解码出的尺寸不小于 target
+        image.load()
+        if image.size != target:
+            image = image.resize(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        reduced_list.append(image)
+    return reduced_list
+
+
 def split_text(text, font_size, max_width):
     """如果太长，拆分多行"""
     # 中文处理逻辑
@@ -87,19 +137,38 @@ def split_text(text, font_size, max_width):
     # return lines
 
 
-def add_text(image_list, text="文字示例", font_type='simsun.ttc', font_size=26):
+def encode_output(new_image, output=None):
+    """
+    合成结果统一在这里编码。output 是传给 image_encode.encode_image 的参数字典，
+    如 {"image_format": "jpeg", "quality": 85, "preset": "balanced", "max_bytes": 0}，不传则是 PNG
+    """
+    output = {"image_format": "png", **(output or {})}
+    stats = {}
+    image_io = encode_image(new_image, **output, stats=stats)
+    print(f"encode: {stats}")
+    return image_io
+
+
+@lru_cache(maxsize=8)
+def load_font(font_type='simsun.ttc', font_size=26):
+    """加载字体并缓存，常驻的处理进程启动时会预先加载"""
+    return ImageFont.truetype(font_type, font_size)
+
+
+def add_text(image_list, text="文字示例", font_type='simsun.ttc', font_size=26, output=None):
     """
     说明文字放下面。若说明文字太长，就拆分多行。
     :param image_list:
     :param text:
     :param font_type:
     :param font_size:
+    :param output: 编码参数，见 encode_output
     :return:
     """
     text_interval = 27  # 文字的上下间隔空白高度
     text_lr_interval = 27  # 文字的左右间隔空白宽度
     text_intervene_interval = font_size // 4 + 4  # 行间距
-    font = ImageFont.truetype(font_type, font_size)  # Load font with size to display chinese, adjust size as required
+    font = load_font(font_type, font_size)  # Load font with size to display chinese, adjust size as required
     # 加载原始图片
     image = image_list[0]
 
@@ -137,54 +206,37 @@ def add_text(image_list, text="文字示例", font_type='simsun.ttc', font_size=
             y = image.height + text_interval + font_size + (i - 1) * (text_intervene_interval + font_size)
             draw.text((x, y), line, font=font, fill=(0, 0, 0))  # Black color
 
-    # 创建 BytesIO 对象以保存 GIF
-    gif_io = io.BytesIO()
-
-    # 保存到字节流
-    new_image.save(gif_io, 'PNG')
-
-    # 重置文件指针到开头
-    gif_io.seek(0)
-    # 返回 Image 对象（需要重新打开，因为我们目前只有字节流）
-    return gif_io
+    return encode_output(new_image, output)
 
 
-def generate_gif(image_list, duration_time = 3000):
+def generate_gif(image_list, duration_time = 3000, max_bytes = 0, time_budget = 0):
     """按照 图片顺序，生成 GIF。 每张图像放入一个新的、空白的、大小相等的画布中，使其位于中心位置。
     image_list 是 Image 对象列表，而不是目录列表
+    逐帧生成、共用一个调色板、重复的帧合并、只写变化的部分，见 animation.encode_gif
+    max_bytes 是体积上限，time_budget 是秒数，0 则不限制
     """
-    # 找到最大的宽度和高度
-    max_width = max(img.width for img in image_list)
-    max_height = max(img.height for img in image_list)
-
-    # 创建新的图像列表
-    new_img_list = []
-    for img in image_list:
-        new_img = Image.new('RGBA', (max_width, max_height))
-
-        # 计算左上角坐标以将图像放在中心
-        left = (max_width - img.width) // 2
-        top = (max_height - img.height) // 2
-
-        # 将原始图像粘贴到新的画布的中心位置
-        new_img.paste(img, (left, top))
-        new_img_list.append(new_img)
-
-    # 创建 BytesIO 对象以保存 GIF
-    gif_io = io.BytesIO()
-
-    # 创建 GIF
-    new_img_list[0].save(gif_io, 'GIF',
-        append_images=new_img_list[1:],
-        save_all=True,
-        duration=duration_time, loop=0)
-
-    # 重置文件指针到开头
-    gif_io.seek(0)
-    # 返回 Image 对象（需要重新打开，因为我们目前只有字节流）
+    stats = {}
+    gif_io = encode_gif(image_list, duration_time, max_bytes, time_budget, stats)
+    print(f"gif: {stats}")
     return gif_io
 
 
+def generate_webp(image_list, duration_time = 3000):
+    """和 generate_gif 一样的排列，生成动态 WebP"""
+    stats = {}
+    webp_io = encode_webp(image_list, duration_time, stats=stats)
+    print(f"webp: {stats}")
+    return webp_io
+
+
+def generate_mp4(image_list, duration_time = 3000):
+    """和 generate_gif 一样的排列，生成 MP4，需要安装 ffmpeg"""
+    stats = {}
+    mp4_io = encode_mp4(image_list, duration_time, stats=stats)
+    print(f"mp4: {stats}")
+    return mp4_io
+
+
 def resize_images(image_list, difference_radio, height_or_width):
     """
     修改原始列表
@@ -231,57 +283,37 @@ def resize_images(image_list, difference_radio, height_or_width):
     return widths, heights
 
 
-def transpose_images(image_list):
+def line_layout(sizes, middle_interval, vertical=False) -> tuple:
     """
-    将图像列表，挨个转置。如果是单个图像，就先转化为列表
-    :param image_list:
-    :return:
+    把图片排成一行（横向依次向右）或一列（竖向依次向下），返回 (放置表 [(x, y, 宽, 高)], 画布尺寸)
+    偏移量用累加得到，不必对每张图片重新求和
     """
-    not_list = False
-    # "image_list 必须是 list 类型"
-    if not isinstance(image_list, list):
-        not_list = True
-        image_list = [image_list]
+    offsets = itertools.accumulate((h if vertical else w) + middle_interval for w, h in sizes[:-1])
+    placements = [(0, 0, *sizes[0])]
+    for (w, h), offset in zip(sizes[1:], offsets):
+        placements.append((0, offset, w, h) if vertical else (offset, 0, w, h))
+    return placements, canvas_size_of(placements)
 
-    transposed_image_list = []
-    for image_file in image_list:
-        array = np.array(image_file)   # 转为矩阵
-        transposed_array = array.transpose((1, 0, 2))   # 转置，但是不管颜色通道，如果 array.transpose()，还会将 RGB 转换为 BGR
-        transposed_image = Image.fromarray(transposed_array)   # 换回 Image 对象
-        transposed_image_list.append(transposed_image)
-    if not_list:
-        return transposed_image_list[0]
-    else:
-        return transposed_image_list
 
+def canvas_size_of(placements) -> tuple:
+    """能容纳全部放置的最小画布"""
+    return max(x + w for x, y, w, h in placements), max(y + h for x, y, w, h in placements)
 
-def merge_images_horizontally(image_list, middle_interval):
-    """
-    把列表里的图像，横着合并
-    :param image_list:
-    :param middle_interval:
-    :return:
-    """
-    image_amount = len(image_list)
-    # 初始化宽度和高度列表
-    widths = []
-    heights = []
-    # 获取尺寸
-    for image_file in image_list:
-        width, height = image_file.size
-        widths.append(width)
-        heights.append(height)
-    # 创建一个新的空白图像，宽取和，高取最大
-    new_image_width = sum(widths) + middle_interval * (image_amount - 1)
-    new_image_height = max(heights)
-    new_image = Image.new('RGB', (new_image_width, new_image_height))
-    # 将图像粘贴到新的图像上
-    for i in range(image_amount):
-        new_image.paste(image_list[i], (sum(widths[0:i]) + i * middle_interval, 0))
-    return new_image
 
+def render_placements(image_list, placements, canvas_size, background=(0, 0, 0)) -> Image.Image:
+    """合成引擎：只创建一张画布，每张图片按放置表粘贴一次，放置表的宽高和图片不一致的先缩放"""
+    canvas = Image.new('RGB', canvas_size, background)
+    for image, placement in zip(image_list, placements):
+        if placement is None:   # 排列里没有这张图片
+            continue
+        x, y, w, h = placement
+        if image.size != (w, h):
+            image = image.resize((w, h), Image.Resampling.LANCZOS)
+        canvas.paste(image, (x, y))
+    return canvas
 
-def merge_multi_images(image_list, middle_interval=10):
+
+def merge_multi_images(image_list, middle_interval=10, output=None):
     """
     合并多个图片为一张。之间会有间隔，图片中间的间隔，如果是 4 个图片形成一个十字
     如果有 2 或 3 个，根据长宽比，横排或竖排
@@ -300,154 +332,89 @@ def merge_multi_images(image_list, middle_interval=10):
         heights.append(height)
 
     if image_amount in {2, 3}:
-
         # 根据图片宽高，判断横排或竖排
         if sum(heights) > sum(widths):
-            # 瘦长型，竖排 ||| 。   height 应该一致，先拉伸，并返回拉伸后的高和宽的列表
-            resize_images(image_list, 0.9, "height")
-            new_image = merge_images_horizontally(image_list, middle_interval)
+            # 瘦长型，竖排 ||| ，左右并列。height 应该一致，先拉伸，并返回拉伸后的高和宽的列表
+            widths, heights = resize_images(image_list, 0.9, "height")
+            placements, canvas_size = line_layout(list(zip(widths, heights)), middle_interval)
         else:
-            # 矮胖型，横排 三。 将图像列表每个都转置，处理后，再转回来，处理函数与瘦长型一致
-            image_list = transpose_images(image_list)
-            resize_images(image_list, 0.9, "height")
-            new_transpose_image = merge_images_horizontally(image_list, middle_interval)
-            new_image = transpose_images(new_transpose_image)
+            # 矮胖型，横排 三 ，上下叠放。width 应该一致，直接按列排，不必转置
+            widths, heights = resize_images(image_list, 0.9, "width")
+            placements, canvas_size = line_layout(list(zip(widths, heights)), middle_interval, vertical=True)
     elif image_amount == 4:
-        # 拉伸图片，并返回高和宽的列表
-        # widths, heights = resize_images(image_list, 0, )
-
-        # 创建一个新的空白图像，大小为两张图像的最大尺寸之和
-        new_image_height = max( (heights[0]+heights[2]), (heights[1]+heights[3]) ) + middle_interval
-        new_image_width = max( (widths[0]+widths[1]), (widths[2]+widths[3]) ) + middle_interval
-        new_image = Image.new('RGB', (new_image_width, new_image_height))
-
-        # 将四张图像粘贴到新的图像上
-        new_image.paste(image_list[0], (0, 0))
-        new_image.paste(image_list[1], (widths[0]+middle_interval, 0))
-        new_image.paste(image_list[2], (0, heights[0]+middle_interval))
-        new_image.paste(image_list[3], (widths[2]+middle_interval, heights[1]+middle_interval))
-
+        # 每行的横向位置按本行左边的图片，纵向位置按本列上边的图片
+        placements = [(0, 0, widths[0], heights[0]),
+                      (widths[0] + middle_interval, 0, widths[1], heights[1]),
+                      (0, heights[0] + middle_interval, widths[2], heights[2]),
+                      (widths[2] + middle_interval, heights[1] + middle_interval, widths[3], heights[3])]
+        canvas_size = canvas_size_of(placements)
     else:
         print("not support")
-        new_image = Image.new('RGB', (100, 100))
-
-    # 创建 BytesIO 对象以保存 GIF
-    gif_io = io.BytesIO()
-
-    # 保存到字节流
-    new_image.save(gif_io, 'PNG')
+        placements, canvas_size = [], (100, 100)
 
-    # 重置文件指针到开头
-    gif_io.seek(0)
-    # 返回 Image 对象（需要重新打开，因为我们目前只有字节流）
-    return gif_io
-
-
-def merge_images_according_array(image_list, middle_interval=10, array=(1,2)):
-    image_amount = len(image_list)
-
-
-    # 初始化宽度和高度列表
-    widths = []
-    heights = []
-    # 获取尺寸
-    for image_file in image_list:
-        width, height = image_file.size
-        widths.append(width)
-        heights.append(height)
-
-    def list_rotate(lst):
-        for value in lst:
-            yield value
-    # 创建一个生成器
-    length = list_rotate([heights, widths])
-
-    # 无用了，保留一下
-    # array = (1, 2), (0, 3)
-    # n = len(array)
-    # transposed_array = [[0 for _ in range(n)] for _ in range(n)]  # 实际是列表
-    # for i, row in enumerate(array):
-    #     for j, element in enumerate(row):
-    #         transposed_array[j][i] = element
-    # print(transposed_array)
-
-    np_array = np.array(array)  # 使用numpy 转化 array 为二维数组，numpy的T属性得到其转置矩阵 array.T
-    # row_amount, column_amount = np_array.shape   # shape会返回一个元组，包含了每个维度的长度。
-    # 在二维数组中，第一个值代表行数，第二个值代表列数。行数就是每列的元素个数。  列是 column
-
-    max_row_list = []
-    rotate_array = np.copy(np_array)
-    # 得到图像阵列，每个维度最大的尺寸
-    for abstract_amount in np_array.shape:
-        # 若是二维，循环取行列；若是三维，也是循环取行列厚，这种
-        row_list = []
-        # abstract_amount 第一次是代表的行，这时计算不同列最大的高合适
-        rotate_array = rotate_array.T   # 这样相当取列
-        the_length = next(length)   # 第一次取全部的高 的值
-        for abstract_row in rotate_array:   # 得到每行最大的宽 组成的列表
-            # 取出每行元素的值，它是图片列表的下标，得到相应图片的某边的长度，再求和，就是每行某方向总长
-            row_sum = sum([the_length[i-1] for i in abstract_row if i])
-            row_list.append(row_sum)
-        # 得到某方向最终画幅的长度
-        new_image_length = max(row_list) + middle_interval*(abstract_amount-1)
-        max_row_list.append(new_image_length)   # 第一个元素是最终画幅的高，第二个是最终画幅的宽
-
-    # 创建一个新的空白图像，大小为两张图像的最大尺寸之和
-    new_image_height = max_row_list[0]
-    new_image_width = max_row_list[1]
-    new_image = Image.new('RGB', (new_image_width, new_image_height))
-
-    # 获取数组形状
-    shape = np_array.shape
-    # 创建新的数组，每个元素，包含原本的值和位置坐标
-    new_arr = [((i, j), np_array[i][j]) for j in range(shape[1]) for i in range(shape[0])]   # 改成一维列表
-    # new_arr = [[((i, j), np_array[i][j]) for j in range(shape[1])] for i in range(shape[0])]
-    # 对于 [(1, 2), (0, 3)]， 结果是 [ [((0, 0), 1), ((0, 1), 2)],   [((1, 0), 0), ((1, 1), 3)] ]
-    # 丢弃原本值是 0 的
-    # new_arr = [(position, index) for position, index in new_arr if index]
-
-    # 将图像粘贴到画幅 new_image 上
-    for position, index in new_arr:   # np_array 存的是图像下标和相对位置
-        i, j = position
-
-        x_length = 0
-        x_anend = 0
-        front_index = [(p, k) for p, k in enumerate(np_array[i]) if p < j]  # 得到前面（位置要比自身小）图片下标 k，
-        for m in front_index:
-            if m[1] == 0:   # 对于 0 ，也就是没图片的，要修正宽度，把那一列最宽的作为修正值
-                a_widths_list = [widths[width_index-1] for width_index in np_array.T[m[0]] if width_index]
-                x_anend += max(a_widths_list)
-        y_length = 0
-        y_anend = 0
-        up_index = [(p, k) for p, k in enumerate(np_array.T[j]) if p < i]
-        for m in up_index:
-            if m[1] == 0:   # 对于 0 ，也就是没图片的，要修正宽度，把那一列最宽的作为修正值
-                a_heights_list = [heights[height_index-1] for height_index in np_array[m[0]] if height_index]
-                y_anend += max(a_heights_list)
-
-        for _, front in front_index:   # 找到同一行的图片下标，图片的宽都加上
-            if front:   # 不能是 0，否则会把自己的宽也加上
-                x_length += widths[front-1]
-        for _, front in up_index:   # 找到同一行的图片下标，图片的宽都加上
-            if front:
-                y_length += heights[front-1]
-
-        x_length += middle_interval*j + x_anend
-        y_length += middle_interval*i + y_anend
-        new_image.paste(image_list[index-1], (x_length, y_length))
-
-    # 创建 BytesIO 对象以保存 GIF
-    gif_io = io.BytesIO()
-
-    # 保存到字节流
-    new_image.save(gif_io, 'PNG')
-
-    # 重置文件指针到开头
-    gif_io.seek(0)
-    # 返回 Image 对象（需要重新打开，因为我们目前只有字节流）
-    return gif_io
+    new_image = render_placements(image_list, placements, canvas_size)
 
+    return encode_output(new_image, output)
 
 
+def normalize_array(array) -> list:
+    """
+    把排列数组整理成规整的二维列表。单个数字作为单行，如 (1,2,3)；单列要写成 (1,),(2,),(3,)
+    各行长短不一的，短的行在末尾补 0
+    """
+    if isinstance(array, int):
+        array = (array,)
+    rows = [list(row) if isinstance(row, (tuple, list)) else [row] for row in array]
+    if all(not isinstance(row, (tuple, list)) for row in array):   # 全是数字，是单行
+        rows = [list(array)]
+    column_amount = max(len(row) for row in rows)
+    return [row + [0] * (column_amount - len(row)) for row in rows]
 
 
+def grid_layout(array, sizes, middle_interval=10) -> tuple:
+    """
+    网格排列的布局求解，array 里的数字是图片的序号（从 1 开始），0 是空格
+    每行的高取该行图片最高的，每列的宽取该列图片最宽的，前缀和得到每行每列的起点，图片放在所在格子的左上角
+    全是空格的行或列不占位置。返回 (放置表 [(x, y, 宽, 高)]，按图片顺序, 画布尺寸)，只遍历一次数组
+    """
+    rows = normalize_array(array)
+    row_heights = [0] * len(rows)
+    column_widths = [0] * len(rows[0])
+    cells = []
+    for i, row in enumerate(rows):
+        for j, index in enumerate(row):
+            if not index:
+                continue
+            if not 0 < index <= len(sizes):
+                raise ValueError(f"image {index} in array, but only {len(sizes)} images")
+            w, h = sizes[index-1]
+            row_heights[i] = max(row_heights[i], h)
+            column_widths[j] = max(column_widths[j], w)
+            cells.append((i, j, index))
+
+    def starts(lengths):
+        """前缀和，空的行或列不加间隔"""
+        offsets, offset = [], 0
+        for length in lengths:
+            offsets.append(offset)
+            if length:
+                offset += length + middle_interval
+        return offsets, max(offset - middle_interval, 1)
+
+    ys, canvas_height = starts(row_heights)
+    xs, canvas_width = starts(column_widths)
+    placements = [None] * len(sizes)
+    for i, j, index in cells:
+        if placements[index-1] is not None:
+            raise ValueError(f"image {index} appears more than once in array")
+        placements[index-1] = (xs[j], ys[i], *sizes[index-1])
+    return placements, (canvas_width, canvas_height)
+
+
+def merge_images_according_array(image_list, middle_interval=10, array=(1,2), output=None):
+    """按指定的排列合并图片，array 如 ((1,2),(0,3))，数字是图片的序号，0 是空格"""
+    sizes = [image_file.size for image_file in image_list]
+    placements, canvas_size = grid_layout(array, sizes, middle_interval)
+    new_image = render_placements(image_list, placements, canvas_size)
+
+    return encode_output(new_image, output)
@@ -7,18 +7,19 @@ import aiofiles
 from concurrent.futures import ProcessPoolExecutor
 
 from urllib.parse import urlparse
-import httpx
+
+from http_pool import pool
 
 
 async def download_video(url: list, temp_file: str) -> None:
     """用异步下载单个视频到指定目录"""
     print(f"start to download file {url}")
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        print(f"video {url} has been downloaded")
-        async with aiofiles.open(temp_file, 'wb') as video_f:
-            await video_f.write(response.content)
-            print(f"video {url} has been saved")
+    response = await pool.get(url)
+    response.raise_for_status()   # 不然错误网页会被当作视频保存
+    print(f"video {url} has been downloaded")
+    async with aiofiles.open(temp_file, 'wb') as video_f:
+        await video_f.write(response.content)
+        print(f"video {url} has been saved")
 
 async def save_video_from_various(video_path: list | str, temp_store: str) -> list:
     """
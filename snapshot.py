@@ -0,0 +1,148 @@
+"""
+清空前的备份快照。内容按行切块，块的边界由内容决定，以哈希命名、压缩后保存，同一用户已有的块不再保存，
+快照本身只是一份块的清单，因此每次快照只写入新增的数据。保留最近几份，可以恢复
+"""
+import os
+import json
+import time
+import shutil
+import tempfile
+import hashlib
+import zlib
+import codecs
+
+
+class SnapshotStore:
+    """
+    目录结构：
+        rootpath/<用户>/chunks/<哈希>.z   压缩后的内容块
+        rootpath/<用户>/<快照id>.json     {"time": 时间戳, "fields": {字段: {"chunks": [哈希], "size": 字节数}}}
+    """
+    def __init__(self, rootpath: str, chunk_size: int=64*1024, keep: int=5, level: int=6):
+        self.rootpath = rootpath
+        self.chunk_size = chunk_size   # 块的平均大小，最小是它的 1/4，最大是 4 倍
+        # 每行有这么大的概率成为块的边界，按一行 64 字节估计
+        self._cut_threshold = (2 ** 32) * 64 // chunk_size
+        self.keep = keep   # 每个用户保留最近的快照份数
+        self.level = level   # zlib 压缩级别
+
+    def _user_dir(self, address: str) -> str:
+        return os.path.join(self.rootpath, address)
+
+    def _chunk_path(self, address: str, chunk_hash: str) -> str:
+        return os.path.join(self._user_dir(address), "chunks", f"{chunk_hash}.z")
+
+    def _iter_chunks(self, contents):
+        """
+        把逐条的文本切成字节块。边界在行尾，由这一行的 crc32 决定，和它在全文中的位置无关，
+        所以开头插入内容（write_in_front）或末尾追加后，只有改动处的块不同，其余的块照样复用
+        块不小于 chunk_size 的 1/4；超过 4 倍还没遇到边界的强制切开，之后的行又会回到同样的边界
+        """
+        min_size, max_size = self.chunk_size // 4, self.chunk_size * 4
+        buffer = bytearray()
+        for content in contents:
+            for line in content.encode('utf-8').splitlines(keepends=True):
+                buffer += line
+                if len(buffer) >= max_size:
+                    while len(buffer) >= max_size:
+                        yield bytes(buffer[:max_size])
+                        del buffer[:max_size]
+                elif len(buffer) >= min_size and zlib.crc32(line) < self._cut_threshold:
+                    yield bytes(buffer)
+                    buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+
+    def _save_field(self, address: str, contents) -> tuple:
+        """保存一个字段的内容，返回 (清单, 新写入的压缩后字节数)"""
+        chunk_hashes = []
+        size = 0
+        new_bytes = 0
+        for chunk in self._iter_chunks(contents):
+            chunk_hash = hashlib.sha256(chunk).hexdigest()
+            chunk_path = self._chunk_path(address, chunk_hash)
+            if not os.path.exists(chunk_path):
+                compressed = zlib.compress(chunk, self.level)
+                with open(chunk_path + ".tmp", 'wb') as f:
+                    f.write(compressed)
+                os.replace(chunk_path + ".tmp", chunk_path)
+                new_bytes += len(compressed)
+            chunk_hashes.append(chunk_hash)
+            size += len(chunk)
+        return {"chunks": chunk_hashes, "size": size}, new_bytes
+
+    def take(self, address: str, fields: dict) -> tuple:
+        """
+        保存一份快照，fields 是 {字段: 逐条文本的可迭代对象}，全部为空则不保存
+        返回 (快照id, 新写入的字节数)，然后按保留份数清理旧的
+        """
+        os.makedirs(os.path.join(self._user_dir(address), "chunks"), exist_ok=True)
+        manifest = {"time": time.time(), "fields": {}}
+        new_bytes = 0
+        for field, contents in fields.items():
+            manifest["fields"][field], field_new_bytes = self._save_field(address, contents)
+            new_bytes += field_new_bytes
+        if not any(field["size"] for field in manifest["fields"].values()):
+            return None, 0
+
+        # 清单先完整写入临时文件，再以硬链接占用快照 id：链接是原子的，已有同名的会失败，
+        # 因此不会覆盖别的快照，也不会留下写了一半的清单。快照 id 是毫秒时间戳，同一毫秒已有的，往后顺延
+        fd, tmp_path = tempfile.mkstemp(dir=self._user_dir(address), suffix=".json.tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(manifest, f)
+            snapshot_number = int(manifest["time"] * 1000)
+            while True:
+                snapshot_id = str(snapshot_number)
+                try:
+                    os.link(tmp_path, os.path.join(self._user_dir(address), f"{snapshot_id}.json"))
+                    break
+                except FileExistsError:
+                    snapshot_number += 1
+        finally:
+            os.remove(tmp_path)
+        self.prune(address)
+        return snapshot_id, new_bytes
+
+    def list(self, address: str) -> list:
+        """该用户的快照，从新到旧，[(快照id, 清单)]"""
+        user_dir = self._user_dir(address)
+        if not os.path.isdir(user_dir):
+            return []
+        snapshot_ids = sorted((name[:-5] for name in os.listdir(user_dir) if name.endswith(".json")), key=int, reverse=True)
+        snapshots = []
+        for snapshot_id in snapshot_ids:
+            try:
+                with open(os.path.join(user_dir, f"{snapshot_id}.json"), 'r') as f:
+                    snapshots.append((snapshot_id, json.load(f)))
+            except ValueError:   # 读不出的清单跳过，它的块也不再算作引用
+                print(f"skip broken snapshot {snapshot_id} of {address}")
+        return snapshots
+
+    def read(self, address: str, snapshot_id: str, field: str):
+        """逐块解压读出某个快照中某个字段的文本"""
+        with open(os.path.join(self._user_dir(address), f"{snapshot_id}.json"), 'r') as f:
+            manifest = json.load(f)
+        decoder = codecs.getincrementaldecoder('utf-8')()   # 块的边界可能在多字节字符中间
+        for chunk_hash in manifest["fields"].get(field, {}).get("chunks", []):
+            with open(self._chunk_path(address, chunk_hash), 'rb') as f:
+                yield decoder.decode(zlib.decompress(f.read()))
+        yield decoder.decode(b"", final=True)
+
+    def prune(self, address: str):
+        """只保留最近 keep 份快照，删除不再被引用的块"""
+        snapshots = self.list(address)
+        if len(snapshots) <= self.keep:
+            return
+        for snapshot_id, _ in snapshots[self.keep:]:
+            os.remove(os.path.join(self._user_dir(address), f"{snapshot_id}.json"))
+        referenced = {chunk_hash for _, manifest in snapshots[:self.keep]
+                      for field in manifest["fields"].values() for chunk_hash in field["chunks"]}
+        chunks_dir = os.path.join(self._user_dir(address), "chunks")
+        for name in os.listdir(chunks_dir):
+            if name[:-2] not in referenced:
+                os.remove(os.path.join(chunks_dir, name))
+
+    def del_data(self, address: str):
+        """彻底删除该用户的快照"""
+        shutil.rmtree(self._user_dir(address), ignore_errors=True)
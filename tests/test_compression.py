@@ -0,0 +1,49 @@
+import pytest
+
+from compression import MAGIC, PLAIN, Codec
+
+
+def test_zlib_frame_round_trip():
+    codec = Codec("zlib")
+    text = "转存的消息，重复很多 repeated text\n" * 200
+    frame = codec.compress(text)
+    assert isinstance(frame, bytes) and frame[:2] == MAGIC + b"z"
+    assert codec.decompress(frame) == text
+    assert codec.stats()["compressed"] == 1 and codec.stats()["ratio"] < 0.2
+
+
+def test_short_text_stays_plain():
+    # 太短的不压缩，原样以 str 保存
+    codec = Codec("zlib", min_size=128)
+    assert codec.compress("short") == "short"
+    assert codec.compress_bytes("short") == b"short"
+    assert codec.stats()["plain"] == 2
+
+
+def test_text_starting_with_magic_is_framed():
+    # 原文恰好以标记开头的，包成不压缩的帧，读出时不会误认为压缩帧
+    text = "\x00z not compressed"
+    frame = PLAIN.compress(text)
+    assert frame == MAGIC + b"n" + text.encode('utf-8')
+    assert PLAIN.decompress(frame) == text
+
+
+def test_reads_content_saved_before_compression():
+    # 开启压缩前保存的，str 和没有标记的 bytes 都按原文读出
+    codec = Codec("zlib")
+    assert codec.decompress("旧的内容") == "旧的内容"
+    assert codec.decompress("旧的内容".encode('utf-8')) == "旧的内容"
+
+
+def test_iter_decompress_in_chunks():
+    # 小块流式解压，块的边界落在多字节字符中间也能正确拼回
+    codec = Codec("zlib", chunk_size=7)
+    text = "中文内容和 English 混在一起\n" * 100
+    chunks = list(codec.iter_decompress(codec.compress(text)))
+    assert len(chunks) > 10
+    assert "".join(chunks) == text
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        Codec("lz4")
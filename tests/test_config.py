@@ -0,0 +1,21 @@
+from configHandle import Config, choose
+from image_encode import PRESETS
+
+
+def test_choose_normalizes():
+    assert choose("JPEG", tuple(PRESETS), "jpeg", "image_format") == "jpeg"
+    assert choose(" jpg ", tuple(PRESETS), "jpeg", "image_format") == "jpeg"
+    assert choose("WebP", tuple(PRESETS), "jpeg", "image_format") == "webp"
+
+
+def test_choose_falls_back(capsys):
+    assert choose("bmp", tuple(PRESETS), "jpeg", "image_format") == "jpeg"
+    assert "image_format: bmp" in capsys.readouterr().out
+
+
+def test_config_validates_image_options(tmp_path):
+    path = tmp_path / "config.yaml"
+    path.write_text("is_production: false\nchat_id: 1\nbot_token: x\n"
+                    "process_file:\n  image_format: JPG\n  image_preset: Tiny\n  animation_format: MP4\n")
+    config = Config(str(path))
+    assert (config.image_format, config.image_preset, config.animation_format) == ("jpeg", "balanced", "mp4")
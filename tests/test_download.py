@@ -0,0 +1,26 @@
+import asyncio
+
+import httpx
+import pytest
+
+import process_images
+from http_pool import HttpPool
+
+
+def make_pool(handler) -> HttpPool:
+    pool = HttpPool(retries=1, backoff=0)
+    pool._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return pool
+
+
+def test_download_image_returns_bytes(monkeypatch):
+    monkeypatch.setattr(process_images, "pool", make_pool(lambda request: httpx.Response(200, content=b"\xff\xd8jpeg")))
+    assert asyncio.run(process_images.download_image("https://example.com/a.jpg")) == b"\xff\xd8jpeg"
+
+
+@pytest.mark.parametrize("status", [404, 503])
+def test_download_image_raises_on_error_page(monkeypatch, status):
+    pool = make_pool(lambda request: httpx.Response(status, content=b"<html>error</html>"))
+    monkeypatch.setattr(process_images, "pool", pool)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(process_images.download_image("https://example.com/a.jpg"))
@@ -0,0 +1,48 @@
+import os
+import stat
+import sys
+
+import pytest
+from PIL import Image
+
+from animation import encode_mp4
+
+FAKE_FFMPEG = """#!{python}
+import os
+import sys
+args = sys.argv[1:]
+data = sys.stdin.buffer.read()
+framerate = args[args.index("-framerate") + 1]
+if framerate.endswith("/0") or os.environ.get("FAKE_FFMPEG_FAIL"):
+    sys.stderr.write("invalid framerate")
+    sys.exit(1)
+with open(args[-1], "wb") as f:
+    f.write(" ".join(args).encode() + b"\\n" + str(len(data)).encode())
+"""
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    path = tmp_path / "ffmpeg"
+    path.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+
+def test_frames_are_piped_on_an_even_canvas(fake_ffmpeg):
+    images = [Image.new("RGB", (5, 3)), Image.new("RGB", (3, 4))]
+    args, size = encode_mp4(images, 500).getvalue().decode().split("\n")
+    assert "-s 6x4" in args
+    assert "-framerate 1000/500" in args
+    assert int(size) == 2 * 6 * 4 * 3
+
+
+def test_zero_duration_is_clamped(fake_ffmpeg):
+    args = encode_mp4([Image.new("RGB", (2, 2))], 0).getvalue().decode()
+    assert "-framerate 1000/1" in args
+
+
+def test_ffmpeg_failure_raises_runtime_error(fake_ffmpeg, monkeypatch):
+    monkeypatch.setenv("FAKE_FFMPEG_FAIL", "1")
+    with pytest.raises(RuntimeError, match="invalid framerate"):
+        encode_mp4([Image.new("RGB", (2, 2))], 500)
@@ -0,0 +1,61 @@
+from PIL import Image, ImageSequence
+
+from animation import TRANSPARENT_INDEX, build_palette, encode_gif
+
+
+def solid(color, size=(20, 20)):
+    return Image.new("RGB", size, color)
+
+
+def with_square(color, box, size=(20, 20)):
+    image = solid((0, 0, 255), size)
+    image.paste(color, box)
+    return image
+
+
+def decode(gif_io):
+    gif = Image.open(gif_io)
+    return [(frame.convert("RGB"), frame.info.get("duration")) for frame in ImageSequence.Iterator(gif)]
+
+
+def test_shared_palette_leaves_transparent_index_free():
+    palette = build_palette([solid((255, 0, 0)), solid((0, 255, 0))])
+    assert len(palette.getpalette()) // 3 <= TRANSPARENT_INDEX
+
+
+def test_duplicate_frames_are_merged():
+    # 和上一帧一样的不写，时长加到上一帧
+    stats = {}
+    red, blue = solid((255, 0, 0)), solid((0, 0, 255))
+    frames = decode(encode_gif([red, red.copy(), blue], duration_time=1000, stats=stats))
+    assert stats["frames"] == 3 and stats["written"] == 2 and stats["duplicates"] == 1
+    assert [duration for _, duration in frames] == [2000, 1000]
+    assert frames[1][0].getpixel((0, 0)) == (0, 0, 255)
+
+
+def test_delta_frames_decode_to_full_frames():
+    # 只写变化的矩形，没变的像素透明，解码出来和原图一样
+    images = [solid((0, 0, 255)), with_square((255, 0, 0), (5, 5, 10, 10)), with_square((255, 0, 0), (5, 5, 10, 15))]
+    stats = {}
+    frames = decode(encode_gif(images, duration_time=500, stats=stats))
+    assert len(frames) == 3
+    assert stats["delta_pixels"] == 5 * 5 + 5 * 5   # 两个变化矩形各 5x5
+    for (frame, _), image in zip(frames, images):
+        assert frame.size == image.size
+        assert frame.tobytes() == image.tobytes()
+
+
+def test_different_sizes_are_centered():
+    images = [solid((255, 0, 0), (20, 10)), solid((0, 255, 0), (10, 20))]
+    frames = decode(encode_gif(images))
+    assert frames[0][0].size == (20, 20)
+    assert frames[1][0].getpixel((10, 10)) == (0, 255, 0)
+    assert frames[1][0].getpixel((0, 10)) == (0, 0, 0)
+
+
+def test_max_bytes_truncates():
+    images = [Image.effect_noise((64, 64), 100 + i).convert("RGB") for i in range(10)]
+    stats = {}
+    gif_io = encode_gif(images, max_bytes=1, stats=stats)
+    assert stats["truncated"] and stats["written"] == 1
+    assert len(decode(gif_io)) == 1
@@ -0,0 +1,49 @@
+import pytest
+from PIL import Image
+
+from process_images import grid_layout, merge_images_according_array, normalize_array
+
+
+def test_normalize_array():
+    assert normalize_array(1) == [[1]]
+    assert normalize_array((1, 2, 3)) == [[1, 2, 3]]
+    assert normalize_array(((1,), (2,), (3,))) == [[1], [2], [3]]
+    assert normalize_array(((1, 2, 3), (4,))) == [[1, 2, 3], [4, 0, 0]]   # 短的行补 0
+
+
+def test_rows_and_columns_take_the_largest():
+    # 每行高取最高的，每列宽取最宽的，图片在格子左上角
+    sizes = [(10, 20), (30, 5), (4, 8), (6, 6)]
+    placements, canvas_size = grid_layout(((1, 2), (3, 4)), sizes, middle_interval=2)
+    assert placements == [(0, 0, 10, 20), (12, 0, 30, 5), (0, 22, 4, 8), (12, 22, 6, 6)]
+    assert canvas_size == (42, 30)
+
+
+def test_empty_cells_rows_and_columns():
+    sizes = [(10, 10), (20, 20)]
+    placements, canvas_size = grid_layout(((1, 0, 0), (0, 0, 2)), sizes, middle_interval=5)
+    # 全空的中间一列不占位置，也不多加间隔
+    assert placements == [(0, 0, 10, 10), (15, 15, 20, 20)]
+    assert canvas_size == (35, 35)
+
+
+def test_images_not_in_array_are_skipped():
+    placements, canvas_size = grid_layout((2,), [(10, 10), (20, 30)])
+    assert placements == [None, (0, 0, 20, 30)]
+    assert canvas_size == (20, 30)
+
+
+def test_invalid_arrays():
+    with pytest.raises(ValueError, match="only 2 images"):
+        grid_layout((1, 3), [(10, 10), (10, 10)])
+    with pytest.raises(ValueError, match="more than once"):
+        grid_layout(((1, 2), (2, 0)), [(10, 10), (10, 10)])
+
+
+def test_merge_according_array():
+    images = [Image.new("RGB", (10, 10), (255, 0, 0)), Image.new("RGB", (10, 10), (0, 255, 0))]
+    merged = Image.open(merge_images_according_array(images, middle_interval=0, array=((0, 1), (2, 0))))
+    assert merged.size == (20, 20)
+    assert merged.getpixel((15, 5)) == (255, 0, 0)
+    assert merged.getpixel((5, 15)) == (0, 255, 0)
+    assert merged.getpixel((5, 5)) == (0, 0, 0)
@@ -0,0 +1,44 @@
+import io
+
+import pytest
+from PIL import Image, UnidentifiedImageError
+
+from image_cache import ImageCache
+from process_images import verify_image
+
+
+def test_memory_tier_spills_to_disk(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=10, max_disk_bytes=100)
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    cache.put("c", b"12345")   # 挤出 a
+    assert cache.stats()["memory_entries"] == 2
+    assert (tmp_path / "a").read_bytes() == b"12345"
+    assert cache.get("a") == b"12345"   # 磁盘命中，放回内存
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_disk_tier_evicts_least_recent(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=4, max_disk_bytes=8)
+    for key in "abcd":
+        cache.put(key, b"1234")
+    # 内存只放得下 d，磁盘放得下两个，最早的 a 被删除
+    assert "a" not in cache
+    assert not (tmp_path / "a").exists()
+    assert all(key in cache for key in "bcd")
+    assert cache.get("a") is None
+
+
+def test_disk_index_survives_restart(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=4, max_disk_bytes=100)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert ImageCache(str(tmp_path), max_bytes=4, max_disk_bytes=100).get("a") == b"1234"
+
+
+def test_verify_image():
+    image_io = io.BytesIO()
+    Image.new("RGB", (4, 4)).save(image_io, "JPEG")
+    verify_image(image_io.getvalue())
+    with pytest.raises(UnidentifiedImageError):
+        verify_image(b"<html>404 Not Found</html>")
@@ -0,0 +1,45 @@
+import pytest
+from PIL import Image
+
+from image_encode import MIN_QUALITY, encode_image
+
+
+def noisy(size=(256, 256)):
+    return Image.effect_noise(size, 80).convert("RGB")
+
+
+def test_formats_round_trip():
+    image = noisy((32, 32))
+    for image_format, pil_format in (("jpeg", "JPEG"), ("webp", "WEBP"), ("png", "PNG")):
+        assert Image.open(encode_image(image, image_format)).format == pil_format
+
+
+def test_jpeg_converts_alpha():
+    image = Image.new("RGBA", (16, 16), (255, 0, 0, 128))
+    assert Image.open(encode_image(image, "jpeg")).mode == "RGB"
+
+
+def test_fit_by_quality_first():
+    # 降低质量能放下的，不缩小图片
+    image = noisy()
+    full = encode_image(image, "jpeg", quality=95).getbuffer().nbytes
+    stats = {}
+    encoded = encode_image(image, "jpeg", quality=95, max_bytes=int(full * 0.7), stats=stats)
+    assert encoded.getbuffer().nbytes <= full * 0.7
+    assert stats["shrunk"] == 0 and MIN_QUALITY <= stats["quality"] < 95
+    assert Image.open(encoded).size == image.size
+
+
+def test_shrink_when_quality_is_not_enough():
+    stats = {}
+    encoded = encode_image(noisy(), "png", max_bytes=20 * 1024, stats=stats)
+    assert encoded.getbuffer().nbytes <= 20 * 1024
+    assert stats["shrunk"] >= 1
+    assert Image.open(encoded).width < 256
+
+
+def test_unknown_format_or_preset():
+    with pytest.raises(ValueError, match="formats: jpeg, webp, png"):
+        encode_image(noisy((8, 8)), "jpg")
+    with pytest.raises(ValueError):
+        encode_image(noisy((8, 8)), "jpeg", preset="tiny")
@@ -0,0 +1,43 @@
+import asyncio
+import io
+
+from PIL import Image
+
+from image_pool import ImagePool
+from process_images import merge_multi_images
+
+
+def encoded(color) -> bytes:
+    image_io = io.BytesIO()
+    Image.new("RGB", (40, 30), color).save(image_io, "PNG")
+    return image_io.getvalue()
+
+
+def test_every_worker_is_initialized(capsys):
+    async def main():
+        pool = ImagePool(workers=3, queue_size=1, fonts=())
+        try:
+            await pool.start()
+            return pool._executor._processes.keys()
+        finally:
+            pool.shutdown()
+
+    processes = asyncio.run(main())
+    output = capsys.readouterr().out
+    assert "3 of 3 workers ready" in output
+    for pid in processes:
+        assert str(pid) in output
+
+
+def test_compose_through_shared_memory():
+    async def main():
+        pool = ImagePool(workers=1, queue_size=1, fonts=())
+        try:
+            result = await pool.compose(merge_multi_images, [encoded((255, 0, 0)), encoded((0, 0, 255))], 10)
+        finally:
+            pool.shutdown()
+        return Image.open(result), pool.stats()
+
+    image, stats = asyncio.run(main())
+    assert image.size == (40, 70)   # 矮胖型，上下叠放
+    assert stats["completed"] == 1
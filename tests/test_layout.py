@@ -0,0 +1,52 @@
+from PIL import Image
+
+from process_images import line_layout, merge_multi_images, render_placements
+
+
+def solid(size, color):
+    return Image.new("RGB", size, color)
+
+
+def test_line_layout_horizontal():
+    placements, canvas_size = line_layout([(10, 20), (30, 5), (4, 4)], middle_interval=2)
+    assert placements == [(0, 0, 10, 20), (12, 0, 30, 5), (44, 0, 4, 4)]
+    assert canvas_size == (48, 20)
+
+
+def test_line_layout_vertical():
+    placements, canvas_size = line_layout([(10, 20), (30, 5)], middle_interval=2, vertical=True)
+    assert placements == [(0, 0, 10, 20), (0, 22, 30, 5)]
+    assert canvas_size == (30, 27)
+
+
+def test_render_placements_pastes_and_resizes():
+    images = [solid((4, 4), (255, 0, 0)), solid((2, 2), (0, 0, 255))]
+    canvas = render_placements(images, [(0, 0, 4, 4), (6, 0, 4, 4)], (10, 4))   # 第二张放大到 4x4
+    assert canvas.size == (10, 4)
+    assert canvas.getpixel((0, 0)) == (255, 0, 0)
+    assert canvas.getpixel((5, 0)) == (0, 0, 0)   # 间隔是背景色
+    assert canvas.getpixel((9, 3)) == (0, 0, 255)
+
+
+def test_merge_two_tall_images_side_by_side():
+    # 瘦长的左右并列，矮的拉伸到一样高
+    images = [solid((10, 40), (255, 0, 0)), solid((5, 20), (0, 255, 0))]
+    merged = Image.open(merge_multi_images(images, middle_interval=10))
+    assert merged.size == (10 + 10 + 10, 40)
+    assert merged.getpixel((25, 39)) == (0, 255, 0)
+
+
+def test_merge_three_wide_images_stacked():
+    images = [solid((40, 10), (255, 0, 0)), solid((40, 10), (0, 255, 0)), solid((40, 10), (0, 0, 255))]
+    merged = Image.open(merge_multi_images(images, middle_interval=5))
+    assert merged.size == (40, 40)
+    assert merged.getpixel((0, 30)) == (0, 0, 255)
+
+
+def test_merge_four_images_cross():
+    images = [solid((10, 10), (255, 0, 0)), solid((20, 10), (0, 255, 0)),
+              solid((10, 30), (0, 0, 255)), solid((5, 5), (255, 255, 0))]
+    merged = Image.open(merge_multi_images(images, middle_interval=2))
+    # 第四张：横向按左边的第三张，纵向按上边的第二张
+    assert merged.size == (max(12 + 20, 12 + 5), max(12 + 30, 12 + 5))
+    assert merged.getpixel((12, 12)) == (255, 255, 0)
@@ -0,0 +1,64 @@
+import os
+import json
+from types import SimpleNamespace
+
+import migrate
+from Transmit import LocalReadWrite, SQLiteReadWrite
+
+
+def make_config(tmp_path):
+    return SimpleNamespace(store_dir=str(tmp_path / "store"), sqlite_path=str(tmp_path / "store.db"),
+                           compression="none", compression_level=None)
+
+
+def fill_store(config, users):
+    os.makedirs(config.store_dir, exist_ok=True)
+    store = LocalReadWrite(rootpath_of_store=config.store_dir, suffix=".txt")
+    for user in users:
+        store.append(user, f"message of {user}\n")
+
+
+def test_list_addresses_without_store_dir(tmp_path):
+    # 目录还不存在时，当作没有用户
+    assert LocalReadWrite(rootpath_of_store=str(tmp_path / "missing"), suffix=".txt").list_addresses() == []
+
+
+def test_checkpoint_appends_batches(tmp_path):
+    config = make_config(tmp_path)
+    users = [str(i) for i in range(1, 6)]
+    fill_store(config, users)
+    checkpoint = str(tmp_path / "checkpoint.jsonl")
+    migrate.migrate(config, "file", "sqlite", batch_size=2, workers=1, checkpoint=checkpoint)
+
+    with open(checkpoint) as f:
+        lines = [json.loads(line) for line in f]
+    assert lines[0] == {"source": "file", "target": "sqlite"}
+    # 每批一行，只有这一批的用户
+    assert sorted(len(batch) for batch in lines[1:]) == [1, 2, 2]
+    assert migrate.load_checkpoint(checkpoint, "file", "sqlite") == set(users)
+    assert SQLiteReadWrite(db_path=config.sqlite_path, field="forward").read("3") == "message of 3\n"
+
+
+def test_resume_skips_done_and_truncated_line(tmp_path, monkeypatch):
+    config = make_config(tmp_path)
+    fill_store(config, ["1", "2", "3"])
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    # 上次迁移完了 1，中断在写 2 的那一行中间
+    checkpoint.write_text(json.dumps({"source": "file", "target": "sqlite"}) + '\n["1"]\n["2"')
+    migrated = []
+    original = migrate.migrate_batch
+    monkeypatch.setattr(migrate, "migrate_batch", lambda s, t, batch: migrated.extend(batch) or original(s, t, batch))
+    migrate.migrate(config, "file", "sqlite", batch_size=10, workers=1, checkpoint=str(checkpoint))
+
+    assert migrated == ["2", "3"]
+    assert migrate.load_checkpoint(str(checkpoint), "file", "sqlite") == {"1", "2", "3"}
+
+
+def test_other_checkpoint_starts_over(tmp_path):
+    config = make_config(tmp_path)
+    fill_store(config, ["1"])
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    checkpoint.write_text(json.dumps({"source": "file", "target": "mongo"}) + '\n["1"]\n')
+    assert migrate.load_checkpoint(str(checkpoint), "file", "sqlite") is None
+    migrate.migrate(config, "file", "sqlite", batch_size=10, workers=1, checkpoint=str(checkpoint))
+    assert checkpoint.read_text().splitlines()[0] == json.dumps({"source": "file", "target": "sqlite"})
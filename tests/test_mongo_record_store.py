@@ -0,0 +1,80 @@
+import mongomock
+import pytest
+
+import Transmit
+from Transmit import MongoDBRecordReadWrite
+
+
+@pytest.fixture
+def make_store(monkeypatch):
+    monkeypatch.setattr(Transmit, "MongoClient", mongomock.MongoClient)
+    monkeypatch.setattr(Transmit, "_mongo_clients", {})
+    monkeypatch.setattr(Transmit, "_ensured_indexes", set())
+
+    def make(field="forward"):
+        return MongoDBRecordReadWrite("mongodb://test", "db", "records", field=field)
+    return make
+
+
+def test_record_order(make_store):
+    store = make_store()
+    store.append("1", "b")
+    store.append_many("1", ["c", "d"])
+    store.write_in_front("1", "a")
+    store.write_in_front("1", "0")
+    assert list(store.iter_read("1")) == ["0", "a", "b", "c", "d"]
+    assert store.count("1") == 5
+    assert store.earliest("1")[1] == "0"
+    assert store.pop_last("1") == "d"
+    store.append("1", "e")
+    assert store.read("1") == "0abce"
+
+
+def test_interleaved_writers_get_unique_increasing_seqs(make_store):
+    # 两个实例交替写入，seq 都从同一个计数器取得：追加的严格递增，插到开头的严格递减，互不重复
+    first, second = make_store(), make_store()
+    appended = []
+    for i in range(5):
+        writer = (first, second)[i % 2]
+        writer.append("1", f"a{i}")
+        appended.append(f"a{i}")
+        writer.append_many("1", [f"m{i}", f"n{i}"])
+        appended += [f"m{i}", f"n{i}"]
+        (second, first)[i % 2].write_in_front("1", f"f{i}")
+    rows = list(first.collection.find(first._filter("1")).sort("seq", 1))
+    seqs = {row["content"]: row["seq"] for row in rows}
+    assert len(set(seqs.values())) == len(rows) == 20
+    assert [seqs[content] for content in appended] == sorted(seqs[content] for content in appended)
+    assert [seqs[f"f{i}"] for i in range(5)] == sorted((seqs[f"f{i}"] for i in range(5)), reverse=True)
+    assert first.read("1") == "".join(f"f{i}" for i in reversed(range(5))) + "".join(appended)
+
+
+def test_two_writers_share_the_counter(make_store):
+    first, second = make_store(), make_store()
+    first.append("1", "a")
+    second.append("1", "b")
+    first.append_many("1", ["c", "d"])
+    assert second.read("1") == "abcd"
+
+
+def test_counter_continues_after_existing_records(make_store):
+    store = make_store()
+    # 以前用纳秒时间戳作 seq 的数据
+    store.collection.insert_many([store._filter("1") | {"seq": seq, "content": content, "time": 0}
+                                  for seq, content in ((-5, "a"), (1700000000000000000, "b"))])
+    store.append("1", "c")
+    store.write_in_front("1", "0")
+    assert store.read("1") == "0abc"
+
+
+def test_bulk_load_then_append(make_store):
+    store = make_store()
+    store.bulk_load([("1", ["a", "b"]), ("2", ["x"])])
+    store.append("1", "c")
+    store.write_in_front("2", "w")
+    assert store.read("1") == "abc"
+    assert store.read("2") == "wx"
+    store.del_data("1")
+    assert store.read("1") == ""
+    store.append("1", "new")
+    assert store.read("1") == "new"
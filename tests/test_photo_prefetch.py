@@ -0,0 +1,55 @@
+import asyncio
+
+from photo_prefetch import PhotoPrefetcher
+
+
+class FakeSource:
+    """模仿 fetch_photo：缓存里有的直接返回，没有的下载并放入缓存"""
+    def __init__(self, fail=()):
+        self.cache = {}
+        self.downloads = []
+        self.fail = set(fail)
+
+    async def fetch(self, file_unique_id, file_id):
+        if file_unique_id in self.cache:
+            return self.cache[file_unique_id]
+        self.downloads.append(file_unique_id)
+        if file_unique_id in self.fail:
+            self.fail.discard(file_unique_id)
+            raise OSError("network")
+        self.cache[file_unique_id] = file_id.encode()
+        return self.cache[file_unique_id]
+
+
+def test_prefetched_photo_is_read_from_cache():
+    source = FakeSource()
+
+    async def main():
+        prefetcher = PhotoPrefetcher(source.fetch, concurrency=2)
+        prefetcher.request("1", "a", "A")
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        task = prefetcher._tasks["1"]["a"]
+        await task
+        assert task.result() is True   # 任务不持有图片字节
+        assert await prefetcher.get("1", "a", "A") == b"A"
+        return prefetcher.stats()
+
+    stats = asyncio.run(main())
+    assert source.downloads == ["a"]
+    assert stats["prefetched"] == 1
+
+
+def test_failed_prefetch_falls_back_to_fetch():
+    source = FakeSource(fail={"a"})
+
+    async def main():
+        prefetcher = PhotoPrefetcher(source.fetch)
+        prefetcher.request("1", "a", "A")
+        result = await prefetcher.get("1", "a", "A")
+        return result, prefetcher.stats()
+
+    result, stats = asyncio.run(main())
+    assert result == b"A"
+    assert source.downloads == ["a", "a"]
+    assert stats["fetched_on_demand"] == 1
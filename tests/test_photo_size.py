@@ -0,0 +1,26 @@
+from process_images import choose_photo_size
+
+# Telegram 给的一张图片的各个尺寸，从小到大
+SIZES = [(90, 60, "s", "fs"), (320, 213, "m", "fm"), (800, 533, "x", "fx"), (1280, 853, "y", "fy")]
+
+
+def test_smallest_size_whose_long_side_meets_the_target():
+    assert choose_photo_size(SIZES, 800)[2] == "x"
+    assert choose_photo_size(SIZES, 801)[2] == "y"
+    assert choose_photo_size(SIZES, 300)[2] == "m"
+
+
+def test_long_side_of_portrait_photos():
+    portrait = [(60, 90, "s", "fs"), (213, 320, "m", "fm"), (533, 800, "x", "fx")]
+    assert choose_photo_size(portrait, 320)[2] == "m"
+
+
+def test_falls_back_to_the_largest():
+    assert choose_photo_size(SIZES, 4000)[2] == "y"
+    assert choose_photo_size(SIZES, 0)[2] == "y"   # 0 不限制，用最大的
+
+
+def test_prefers_a_larger_size_already_downloaded():
+    assert choose_photo_size(SIZES, 300, lambda file_unique_id: file_unique_id == "y")[2] == "y"
+    # 不够大的，即使已下载也不用
+    assert choose_photo_size(SIZES, 300, lambda file_unique_id: file_unique_id == "s")[2] == "m"
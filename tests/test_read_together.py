@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+import mongomock
+import pytest
+
+import Transmit
+from Transmit import STORE_BACKENDS, build_stores, read_together
+
+
+@pytest.fixture(params=STORE_BACKENDS)
+def stores(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(Transmit, "MongoClient", mongomock.MongoClient)
+    monkeypatch.setattr(Transmit, "_mongo_clients", {})
+    monkeypatch.setattr(Transmit, "_ensured_indexes", set())
+    (tmp_path / "store").mkdir()
+    config = SimpleNamespace(store_dir=str(tmp_path / "store"), segment_size=4, sqlite_path=str(tmp_path / "store.db"),
+                             mongo_uri="mongodb://test", mongo_db="db", mongo_collection="forward",
+                             compression="zlib", compression_level=None)
+    return build_stores(config, request.param)
+
+
+def fill(stores, address, messages, urls):
+    io4message, io4urlmsg = stores
+    for message in messages:
+        io4message.append(address, message)
+    for url in urls:
+        io4urlmsg.append(address, url)
+
+
+@pytest.mark.parametrize("messages, urls", [
+    (["转存的消息\n" * 40, "第二条\n"], ["https://example.com/1\n", "https://example.com/2\n"]),
+    (["只有消息\n"], []),
+    ([], ["https://example.com/only-url\n"]),
+    ([], []),
+])
+def test_same_as_reading_each_store(stores, messages, urls):
+    fill(stores, "1", messages, urls)
+    fill(stores, "2", ["别的用户\n"], ["https://other\n"])
+    io4message, io4urlmsg = stores
+    assert read_together(io4message, io4urlmsg, "1") == (io4message.read("1"), io4urlmsg.read("1"))
+    assert read_together(io4message, io4urlmsg, "1") == ("".join(messages), "".join(urls))
+
+
+def test_mongo_document_reads_both_fields_in_one_query(tmp_path, monkeypatch):
+    monkeypatch.setattr(Transmit, "MongoClient", mongomock.MongoClient)
+    monkeypatch.setattr(Transmit, "_mongo_clients", {})
+    monkeypatch.setattr(Transmit, "_ensured_indexes", set())
+    config = SimpleNamespace(mongo_uri="mongodb://test", mongo_db="db", mongo_collection="forward",
+                             compression="none", compression_level=None)
+    io4message, io4urlmsg = build_stores(config, "mongo")
+    fill((io4message, io4urlmsg), "1", ["message\n"], ["https://example.com\n"])
+    queries = []
+    find_one = io4message.collection.find_one
+    monkeypatch.setattr(io4message.collection, "find_one", lambda *args, **kwargs: queries.append(args) or find_one(*args, **kwargs))
+    assert read_together(io4message, io4urlmsg, "1") == ("message\n", "https://example.com\n")
+    assert len(queries) == 1
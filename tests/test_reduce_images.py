@@ -0,0 +1,47 @@
+import io
+
+from PIL import Image
+
+from process_images import reduce_images
+
+
+def opened(size, image_format="JPEG"):
+    """刚 open、还没解码的图片，和处理进程收到的一样"""
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 100, 50)).save(buffer, image_format)
+    buffer.seek(0)
+    return Image.open(buffer)
+
+
+def assert_same_ratio(image, size):
+    # 取整最多差 1 像素
+    assert abs(image.width / image.height - size[0] / size[1]) <= max(1 / image.height, image.width / image.height ** 2)
+
+
+def test_total_pixel_budget():
+    sizes = [(4000, 3000), (1200, 1600), (800, 800)]
+    reduced = reduce_images([opened(size) for size in sizes], max_pixels=2_000_000)
+    assert sum(image.width * image.height for image in reduced) <= 2_000_000
+    for image, size in zip(reduced, sizes):
+        assert_same_ratio(image, size)
+    # 按同一比例缩小，相对大小不变
+    assert abs(reduced[0].width / reduced[2].width - 4000 / 800) < 0.05
+
+
+def test_per_image_budget():
+    sizes = [(4000, 3000), (300, 200)]
+    reduced = reduce_images([opened(size, "PNG") for size in sizes], max_pixels=1_000_000, per_image=True)
+    assert reduced[0].width * reduced[0].height <= 1_000_000
+    assert_same_ratio(reduced[0], sizes[0])
+    assert reduced[1].size == (300, 200)   # 已在预算内的不缩小
+
+
+def test_within_budget_or_unlimited_is_unchanged():
+    assert reduce_images([opened((640, 480))], max_pixels=1_000_000)[0].size == (640, 480)
+    assert reduce_images([opened((4000, 3000))], max_pixels=0)[0].size == (4000, 3000)
+
+
+def test_extreme_aspect_ratio_keeps_at_least_one_pixel():
+    # 短边缩到不足 1 像素时保留 1 像素，长边仍按比例
+    reduced = reduce_images([opened((6000, 10), "PNG")], max_pixels=100, per_image=True)
+    assert reduced[0].size == (int(6000 * (100 / 60000) ** 0.5), 1)
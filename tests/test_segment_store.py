@@ -0,0 +1,84 @@
+import os
+
+from Transmit import SegmentReadWrite
+from compression import Codec
+
+
+def make_store(tmp_path, **kwargs):
+    return SegmentReadWrite(rootpath_of_store=str(tmp_path), **kwargs)
+
+
+def test_record_order(tmp_path):
+    store = make_store(tmp_path)
+    store.append("1", "b")
+    store.append_many("1", ["c", "d"])
+    store.write_in_front("1", "a")
+    assert list(store.iter_read("1")) == ["a", "b", "c", "d"]
+    assert store.count("1") == 4
+    assert store.earliest("1")[1] == "a"
+    assert store.pop_last("1") == "d"
+    assert store.read("1") == "abc"
+
+
+def test_segment_rollover(tmp_path):
+    # 段文件写满了开新的一段，每条 9 字节，一段放两条，读出的顺序不变
+    store = make_store(tmp_path, segment_size=10)
+    records = [f"record {i}\n" for i in range(5)]
+    for record in records:
+        store.append("1", record)
+    assert sorted(name for name in os.listdir(store.get_path("1")) if name.endswith(".log")) == ["000001.log", "000002.log", "000003.log"]
+    assert store.read("1") == "".join(records)
+
+
+def test_prepends_share_the_active_segment(tmp_path):
+    # 插到开头的和追加的一样写进正在追加的段，写满了才开新段
+    store = make_store(tmp_path, segment_size=1024)
+    store.append("1", "last\n")
+    for i in range(50):
+        store.write_in_front("1", f"{i}\n")
+    assert [name for name in os.listdir(store.get_path("1")) if name.endswith(".log")] == ["000001.log"]
+    assert store.read("1") == "".join(f"{i}\n" for i in reversed(range(50))) + "last\n"
+    assert store.pop_last("1") == "last\n"
+    assert store.earliest("1")[1] == "49\n"
+
+
+def test_pop_last_truncates_index_and_segment(tmp_path):
+    store = make_store(tmp_path)
+    store.append_many("1", ["first", "second"])
+    segment = store._segment_path("1", 1)
+    assert store.pop_last("1") == "second"
+    assert os.path.getsize(store._index_path("1")) == store.ENTRY.size
+    assert os.path.getsize(segment) == len("first")
+    assert store.pop_last("1") == "first"
+    assert store.count("1") == 0
+    assert store.pop_last("1") == ""
+
+
+def test_torn_index_entry_is_ignored(tmp_path):
+    # 写索引时崩溃，末尾只有半项：读取跳过它，删除最后一条时按整项截断
+    store = make_store(tmp_path)
+    store.append_many("1", ["a", "b", "c"])
+    with open(store._index_path("1"), 'ab') as f:
+        f.write(b"\x01" * (store.ENTRY.size // 2))
+    assert store.count("1") == 3
+    assert list(store.iter_read("1")) == ["a", "b", "c"]
+    assert store.pop_last("1") == "c"
+    assert os.path.getsize(store._index_path("1")) == 2 * store.ENTRY.size
+    assert store.read("1") == "ab"
+
+
+def test_compressed_records(tmp_path):
+    store = make_store(tmp_path, codec=Codec("zlib", min_size=0))
+    records = ["转存的消息\n" * 50, "short"]
+    store.append_many("1", records)
+    assert list(store.iter_read("1")) == records
+    assert os.path.getsize(store._segment_path("1", 1)) < len("".join(records).encode('utf-8'))
+
+
+def test_list_addresses(tmp_path):
+    assert make_store(tmp_path / "missing").list_addresses() == []
+    store = make_store(tmp_path)
+    store.append("1", "a")
+    store.append("-100", "b")
+    store.backup("1")
+    assert sorted(store.list_addresses()) == ["-100", "1"]
@@ -0,0 +1,114 @@
+import asyncio
+import random
+
+import snapshot
+from async_transmit import AsyncReadWrite, WriteBehindBuffer
+from snapshot import SnapshotStore
+from Transmit import SegmentReadWrite
+
+
+def make_history(amount: int, seed: int=0) -> list:
+    rng = random.Random(seed)
+    return [f"{'-' * 27}第 {i} 条 from channel_{rng.randrange(50)}\n正文 {rng.random()} {'文字' * rng.randrange(1, 40)}\n\n"
+            for i in range(amount)]
+
+
+def restore(store, address, snapshot_id, field):
+    return "".join(store.read(address, snapshot_id, field))
+
+
+def test_round_trip(tmp_path):
+    store = SnapshotStore(str(tmp_path), chunk_size=4096)
+    messages, urls = make_history(300), ["https://example.com/1\n", "https://example.com/2\n"]
+    snapshot_id, new_bytes = store.take("1", {"forward": iter(messages), "forward_url": iter(urls)})
+    assert new_bytes > 0
+    assert restore(store, "1", snapshot_id, "forward") == "".join(messages)
+    assert restore(store, "1", snapshot_id, "forward_url") == "".join(urls)
+
+
+def test_empty_is_not_saved(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    assert store.take("1", {"forward": iter([]), "forward_url": iter([""])}) == (None, 0)
+    assert store.list("1") == []
+
+
+def test_prepend_and_append_reuse_chunks(tmp_path):
+    store = SnapshotStore(str(tmp_path), chunk_size=4096)
+    history = make_history(2000)
+    _, first_bytes = store.take("1", {"forward": iter(history)})
+    changed = ["刚插入到开头的一条\n"] + history + ["最后追加的一条\n"]
+    snapshot_id, second_bytes = store.take("1", {"forward": iter(changed)})
+    assert second_bytes < first_bytes / 10
+    assert restore(store, "1", snapshot_id, "forward") == "".join(changed)
+
+
+def test_long_lines_are_split(tmp_path):
+    store = SnapshotStore(str(tmp_path), chunk_size=1024)
+    content = "长" * 10000 + "\n"
+    chunks = list(store._iter_chunks([content]))
+    assert max(len(chunk) for chunk in chunks) <= 4096
+    assert b"".join(chunks) == content.encode('utf-8')
+
+
+def test_same_millisecond_snapshots_do_not_collide(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot.time, "time", lambda: 1700000000.0)
+    store = SnapshotStore(str(tmp_path))
+    first, _ = store.take("1", {"forward": iter(["a\n"])})
+    second, _ = store.take("1", {"forward": iter(["b\n"])})
+    assert first != second
+    assert [snapshot_id for snapshot_id, _ in store.list("1")] == [second, first]
+    assert restore(store, "1", first, "forward") == "a\n"
+
+
+def test_prune_keeps_latest(tmp_path):
+    store = SnapshotStore(str(tmp_path), keep=2)
+    ids = [store.take("1", {"forward": iter([f"{i}\n"])})[0] for i in range(4)]
+    assert [snapshot_id for snapshot_id, _ in store.list("1")] == ids[:1:-1]
+    assert len(list((tmp_path / "1" / "chunks").iterdir())) == 2
+
+
+def test_manifest_is_written_before_it_appears(tmp_path, monkeypatch):
+    # 写清单中途出错，不留下快照，也不留下临时文件
+    store = SnapshotStore(str(tmp_path))
+    store.take("1", {"forward": iter(["a\n"])})
+
+    def broken_dump(manifest, f):
+        f.write('{"time": ')
+        raise OSError("No space left on device")
+    monkeypatch.setattr(snapshot.json, "dump", broken_dump)
+    try:
+        store.take("1", {"forward": iter(["b\n"])})
+    except OSError:
+        pass
+    assert len(store.list("1")) == 1
+    assert [path.name for path in (tmp_path / "1").iterdir() if path.name.endswith(".tmp")] == []
+
+
+def test_broken_manifest_is_skipped(tmp_path):
+    store = SnapshotStore(str(tmp_path), keep=1)
+    first, _ = store.take("1", {"forward": iter(["a\n"])})
+    (tmp_path / "1" / "1.json").write_text('{"time": 1, "fiel')   # 以前的版本中断时留下的
+    assert [snapshot_id for snapshot_id, _ in store.list("1")] == [first]
+    second, _ = store.take("1", {"forward": iter(["b\n"])})
+    assert [snapshot_id for snapshot_id, _ in store.list("1")] == [second]
+    assert restore(store, "1", second, "forward") == "b\n"
+
+
+def test_store_lock_holds_back_writes(tmp_path):
+    """持有锁做快照和清空时，新来的追加不会被清空"""
+    sync_store = SegmentReadWrite(str(tmp_path / "store"))
+    buffer = WriteBehindBuffer(AsyncReadWrite(sync_store), max_lag=0.01)
+    snapshots = SnapshotStore(str(tmp_path / "snapshots"))
+
+    async def main():
+        await buffer.append("1", "old\n")
+        await buffer.flush("1")
+        async with buffer.lock("1"):
+            await buffer.append("1", "new\n")
+            await asyncio.sleep(0.05)   # 定时写入在等锁
+            snapshots.take("1", {"forward": sync_store.iter_read("1")})
+            sync_store.clear("1")
+        await asyncio.sleep(0.05)
+        return await buffer.read("1")
+
+    assert asyncio.run(main()) == "new\n"
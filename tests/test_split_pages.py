@@ -0,0 +1,55 @@
+import asyncio
+
+from Transmit import split_pages
+
+
+def pages_of(records, page_size):
+    async def source():
+        for record in records:
+            yield record
+
+    async def collect():
+        return [page async for page in split_pages(source(), page_size)]
+    return asyncio.run(collect())
+
+
+def test_pages_break_between_records():
+    pages = pages_of(["aaaa", "bbb", "cc", "d"], page_size=8)
+    assert pages == ["aaaabbb", "ccd"]
+
+
+def test_record_of_exactly_a_page():
+    assert pages_of(["aaaa", "bbbb", "c"], page_size=4) == ["aaaa", "bbbb", "c"]
+
+
+def test_oversize_record_is_split_by_bytes():
+    pages = pages_of(["x", "a" * 25, "y"], page_size=10)
+    assert pages == ["x", "a" * 10, "a" * 10, "a" * 5 + "y"]
+    assert all(len(page.encode('utf-8')) <= 10 for page in pages)
+
+
+def test_multibyte_characters_are_not_cut():
+    # 每个汉字 3 字节，10 字节的一页只能放 3 个，不会在字符中间切开
+    record = "中文分页测试" * 3
+    pages = pages_of([record], page_size=10)
+    assert "".join(pages) == record
+    assert all(len(page.encode('utf-8')) <= 10 for page in pages)
+    assert pages[0] == "中文分"
+
+
+def test_mixed_multibyte_boundaries():
+    record = "a😀b中c" * 20   # 1、4、1、3、1 字节混合
+    for page_size in range(4, 17):
+        pages = pages_of(["head\n", record, "tail\n"], page_size)
+        assert "".join(pages) == "head\n" + record + "tail\n"
+        assert all(len(page.encode('utf-8')) <= page_size for page in pages)
+
+
+def test_page_smaller_than_a_character():
+    # 一页放不下一个字符的，这个字符单独一页，不会死循环
+    assert pages_of(["😀😀"], page_size=2) == ["😀", "😀"]
+
+
+def test_empty():
+    assert pages_of([], page_size=10) == []
+    assert pages_of([""], page_size=10) == []
@@ -0,0 +1,65 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from Transmit import SQLiteReadWrite
+from async_transmit import AsyncReadWrite
+
+
+def make_store(tmp_path, field="forward"):
+    return SQLiteReadWrite(db_path=str(tmp_path / "store.db"), field=field)
+
+
+def test_record_order(tmp_path):
+    store = make_store(tmp_path)
+    store.append("1", "b")
+    store.append_many("1", ["c", "d"])
+    store.write_in_front("1", "a")
+    assert list(store.iter_read("1")) == ["a", "b", "c", "d"]
+    assert store.read("1") == "abcd"
+    assert store.count("1") == 4
+    assert store.earliest("1")[1] == "a"
+    assert store.pop_last("1") == "d"
+    assert store.read("1") == "abc"
+
+
+def test_fields_and_users_are_separate(tmp_path):
+    messages, urls = make_store(tmp_path), make_store(tmp_path, "forward_url")
+    messages.append("1", "message")
+    urls.append("1", "url")
+    messages.append("2", "other")
+    assert messages.read("1") == "message"
+    assert urls.read("1") == "url"
+    assert sorted(messages.list_addresses()) == ["1", "2"]
+
+
+def test_iter_read_across_threads(tmp_path, monkeypatch):
+    """每次 next 换一个线程，跨过多个批次"""
+    monkeypatch.setattr(SQLiteReadWrite, "READ_BATCH", 2)
+    store = make_store(tmp_path)
+    store.append_many("1", [str(i) for i in range(7)])
+    records = store.iter_read("1")
+    result = []
+
+    def step():
+        result.append(next(records, None))
+
+    for _ in range(8):
+        thread = threading.Thread(target=step)
+        thread.start()
+        thread.join()
+    assert result == [str(i) for i in range(7)] + [None]
+
+
+def test_aiter_read_on_warm_executor(tmp_path, monkeypatch):
+    monkeypatch.setattr(SQLiteReadWrite, "READ_BATCH", 3)
+    store = make_store(tmp_path)
+    store.append_many("1", [str(i) for i in range(20)])
+
+    async def main():
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            async_store = AsyncReadWrite(store, executor)
+            await asyncio.gather(*(async_store.count("1") for _ in range(8)))   # 让每个线程都建立连接
+            return [record async for record in async_store.aiter_read("1")]
+
+    assert asyncio.run(main()) == [str(i) for i in range(20)]
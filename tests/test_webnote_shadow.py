@@ -0,0 +1,79 @@
+import asyncio
+import html
+from urllib.parse import parse_qs
+
+import httpx
+
+from async_transmit import AsyncWebnoteReadWrite
+from http_pool import HttpPool
+
+
+class FakeWebnote:
+    """GET 返回带 textarea 的网页和 ETag，POST 覆盖保存"""
+    def __init__(self):
+        self.text = ""
+        self.version = 0
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        etag = f'"{self.version}"'
+        if request.method == "POST":
+            self.text = parse_qs(request.content.decode(), keep_blank_values=True)["text"][0]
+            self.version += 1
+            return httpx.Response(200)
+        if request.headers.get("If-None-Match") == etag:
+            return httpx.Response(304)
+        page = f'<textarea id="content">{html.escape(self.text)}</textarea>'
+        return httpx.Response(200, text=page, headers={"ETag": etag})
+
+    def edit_in_browser(self, text):
+        self.text = text
+        self.version += 1
+
+
+def make_store(server) -> AsyncWebnoteReadWrite:
+    http = HttpPool(retries=0)
+    http._client = httpx.AsyncClient(transport=httpx.MockTransport(server.handler))
+    return AsyncWebnoteReadWrite(http)
+
+
+def test_web_edit_between_appends_is_kept():
+    server = FakeWebnote()
+    store = make_store(server)
+
+    async def main():
+        await store.append("https://note/1", "a")
+        server.edit_in_browser(server.text + " edited")
+        await store.append("https://note/1", "b")
+
+    asyncio.run(main())
+    assert server.text == "a editedb"
+
+
+def test_unchanged_page_is_validated_not_parsed():
+    server = FakeWebnote()
+    server.edit_in_browser("old")
+    store = make_store(server)
+
+    async def main():
+        assert await store.read("https://note/1") == "old"
+        assert await store.read("https://note/1") == "old"
+
+    asyncio.run(main())
+    assert store.counter["page_parsed"] == 1
+    assert store.counter["shadow_validated"] == 1
+
+
+def test_appends_after_own_write_are_not_parsed():
+    # 自己提交后，网页和按模板算出的一样，连续追加只需 GET 和 POST，不再解析
+    server = FakeWebnote()
+    server.edit_in_browser('old & "quoted" <b>\n')
+    store = make_store(server)
+
+    async def main():
+        for i in range(5):
+            await store.append("https://note/1", f"line {i} <&>\n")
+
+    asyncio.run(main())
+    assert server.text == 'old & "quoted" <b>\n' + "".join(f"line {i} <&>\n" for i in range(5))
+    assert store.counter["page_parsed"] == 1
+    assert store.counter["shadow_validated"] == 4
@@ -0,0 +1,83 @@
+import asyncio
+
+from webnote_sync import PersistentSyncer
+
+
+class SlowPush:
+    """提交要一段时间，记下完成的提交"""
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.written = []
+
+    async def _write(self, url, content):
+        self.started.set()
+        await asyncio.sleep(0.1)
+        self.written.append((url, content))
+
+
+def test_flush_all_waits_for_running_sync():
+    async def main():
+        contents = {"1": "old"}
+
+        async def read_all(userid_str):
+            return contents[userid_str]
+
+        push = SlowPush()
+        syncer = PersistentSyncer(read_all, push, debounce=0, max_wait=0)
+        syncer.request("1", "note")
+        await push.started.wait()   # 正在提交旧内容
+        contents["1"] = "new"
+        syncer.request("1", "note")   # 又登记了一次，还在等待
+        await syncer.flush_all()
+        return push.written
+
+    # 提交到一半的没有丢，之后登记的在它后面提交
+    assert asyncio.run(main()) == [("note", "old"), ("note", "new")]
+
+
+def test_flush_all_syncs_waiting_requests_once():
+    async def main():
+        async def read_all(userid_str):
+            return "content"
+
+        push = SlowPush()
+        syncer = PersistentSyncer(read_all, push, debounce=60, max_wait=600)
+        syncer.request("1", "note")
+        syncer.request("1", "note")
+        await syncer.flush_all()
+        await syncer.flush_all()   # 内容没变，不再提交
+        return push.written
+
+    assert asyncio.run(main()) == [("note", "content")]
+
+
+def test_syncs_of_one_user_are_serialized():
+    async def main():
+        contents = {"1": "v1"}
+
+        async def read_all(userid_str):
+            return contents[userid_str]
+
+        class CheckedPush(SlowPush):
+            writing = 0
+
+            async def _write(self, url, content):
+                self.writing += 1
+                assert self.writing == 1, "two syncs of one user at the same time"
+                await super()._write(url, content)
+                self.writing -= 1
+
+        push = CheckedPush()
+        syncer = PersistentSyncer(read_all, push, debounce=0, max_wait=0)
+        syncer.request("1", "note")
+        await push.started.wait()   # 第一次正在提交
+        contents["1"] = "v2"
+        syncer.request("1", "note")   # 提交中又来一次，要等前一次完成
+        await asyncio.sleep(0.05)
+        contents["1"] = "v3"
+        await asyncio.sleep(0.3)
+        return push.written, syncer._running
+
+    written, running = asyncio.run(main())
+    assert written == [("note", "v1"), ("note", "v3")]   # 后一次在前一次之后才读取和提交
+    assert running == {}
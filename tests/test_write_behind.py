@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from async_transmit import AsyncReadWrite, WriteBehindBuffer
+from Transmit import SegmentReadWrite
+
+
+class FlakyStore(SegmentReadWrite):
+    """前 failures 次 append_many 失败"""
+    failures = 0
+
+    def append_many(self, address, contents):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        super().append_many(address, contents)
+
+
+def make_buffer(tmp_path, failures=0, max_lag=0.01):
+    store = FlakyStore(str(tmp_path))
+    store.failures = failures
+    return store, WriteBehindBuffer(AsyncReadWrite(store), max_lag=max_lag, max_records=50)
+
+
+def test_appends_are_coalesced(tmp_path):
+    store, buffer = make_buffer(tmp_path)
+
+    async def main():
+        for i in range(3):
+            await buffer.append("1", f"{i}\n")
+        assert store.read("1") == ""   # 还在队列里
+        return await buffer.read("1")
+
+    assert asyncio.run(main()) == "0\n1\n2\n"
+    assert store.count("1") == 3
+
+
+def test_failed_flush_requeues_in_order(tmp_path):
+    store, buffer = make_buffer(tmp_path, failures=1)
+
+    async def main():
+        await buffer.append("1", "a")
+        with pytest.raises(OSError):
+            await buffer.flush("1")
+        await buffer.append("1", "b")
+        await buffer.flush_all()
+
+    asyncio.run(main())
+    assert store.read("1") == "ab"
+
+
+def test_delayed_flush_retries(tmp_path):
+    store, buffer = make_buffer(tmp_path, failures=2)
+
+    async def main():
+        await buffer.append("1", "a")
+        await asyncio.sleep(0.2)
+
+    asyncio.run(main())
+    assert store.read("1") == "a"
+
+
+def test_flush_all_raises_after_other_users(tmp_path):
+    store, buffer = make_buffer(tmp_path, failures=1, max_lag=60)
+
+    async def main():
+        await buffer.append("1", "a")
+        await buffer.append("2", "b")
+        with pytest.raises(OSError):
+            await buffer.flush_all()
+        assert store.read("2") == "b"
+        await buffer.flush_all()
+
+    asyncio.run(main())
+    assert store.read("1") == "a"
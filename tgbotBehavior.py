@@ -2,6 +2,7 @@
 tg机器人的所有命令行为
 """
 import datetime
+import time
 from urllib.parse import urlparse
 import re
 import os, io, sys
@@ -11,17 +12,27 @@ import json
 import subprocess
 import ast
 import zipfile
+import itertools
 import asyncio
-from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 from telegram import Update, Bot
 from telegram.ext import ContextTypes
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram import error
 
-from process_images import add_text, merge_multi_images, generate_gif, open_image_from_various, merge_images_according_array
+from process_images import add_text, merge_multi_images, generate_gif, generate_webp, generate_mp4, load_image_sources, merge_images_according_array, normalize_array, verify_image, choose_photo_size
 from process_video import save_video_from_various, video2gif
-from preprocess import config, io4message, io4urlmsg, io4push
+from async_transmit import WriteBehindBuffer
+from webnote_sync import PersistentSyncer
+from snapshot import SnapshotStore
+from Transmit import split_records, split_pages, read_together
+from http_pool import pool as http_pool
+from image_pool import pool as image_pool
+from image_cache import ImageCache
+from photo_prefetch import PhotoPrefetcher
+from image_encode import EXTENSIONS
+from preprocess import config, io4message, io4urlmsg, aio4message, aio4urlmsg, aio4push
 
 
 # 回复固定内容
@@ -36,7 +47,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 
-def general_logic(update: Update, userid_str: str, line_center_content: str, media_group_id_cache = ["0"]) -> str:
+async def general_logic(update: Update, userid_str: str, line_center_content: str, media_group_id_cache = ["0"]) -> str:
     """通用规则：先提取文本，再把内联网址按顺序列在后面"""
     link = ['']
     
@@ -61,24 +72,44 @@ def general_logic(update: Update, userid_str: str, line_center_content: str, med
 
     # 仅一行且 http 开头的内容，放在 _url 中
     if content and content[0:4] == "http" and '\n' not in content:
-        io4urlmsg.append(userid_str, content + '\n')
+        await aio4urlmsg.append(userid_str, content + '\n')
         reply = "url saved. 保存网址"
     else:
         element = '\n'
         saved_content = '-' * 27 + line_center_content.center(80, '-') + '\n' + content + '\n' + element.join(filter(None, link)) + '\n\n'
         # 保存到文件中
-        io4message.append(userid_str, saved_content)
+        await aio4message.append(userid_str, saved_content)
         reply =  "transfer done. 转存完成"
     
-    # 同步
+    # 同步，只登记，由后台合并后再提交，不等待
     if persistent_webnote_url := config.path_dict.get(userid_str + "_psw"):
-        all_stored = io4message.read(userid_str) + "\n\n" + io4urlmsg.read(userid_str)
         push2somewhere = config.push_dir + persistent_webnote_url
-        io4push._write(push2somewhere, all_stored)
+        persistent_syncer.request(userid_str, push2somewhere)
 
     return reply
 
 
+async def read_both(userid_str: str) -> tuple:
+    """读取消息和网址，返回 (消息, 网址)，存在同一 MongoDB 文档中的，一次查询读出"""
+    await flush_stores(userid_str)
+    return await asyncio.get_running_loop().run_in_executor(None, read_together, io4message, io4urlmsg, userid_str)
+
+
+async def read_all_stored(userid_str: str) -> str:
+    """读取保存的全部内容，消息在前，网址在后"""
+    stored, stored_url = await read_both(userid_str)
+    return stored + "\n\n" + stored_url
+
+
+# 清空前的备份快照
+image_cache = ImageCache(config.image_cache_dir, max_bytes=int(config.image_cache_size * 1024 * 1024),
+                         max_disk_bytes=int(config.image_disk_cache_size * 1024 * 1024))
+snapshots = SnapshotStore(config.backupdir, keep=config.snapshot_keep)
+
+# 同步路径的后台同步
+persistent_syncer = PersistentSyncer(read_all_stored, aio4push, debounce=config.sync_debounce, max_wait=config.sync_max_wait)
+
+
 def extract_urls(update: Update):
     # 有时候 AHHH 那个也会发纯文本，如果只有 ~。caption，就不能处理纯文本了，还会报错
     string = ''   # 不然异常终止后会销毁string
@@ -93,16 +124,39 @@ def extract_urls(update: Update):
     return url
 
 
+def composition_mode(image_amount: int, array=None) -> str:
+    """/image 时的合成方式：text 是单张加说明文字，merge 是 2 到 4 张拼接，array 是按指定排列，gif 是更多张的动图"""
+    if array:
+        return "array"
+    if image_amount == 1:
+        return "text"
+    if image_amount < 5:
+        return "merge"
+    return "gif"
+
+
+ANIMATION_FORMATS = ("gif", "webp", "mp4")   # 5 张以上合成动图的格式，/image format 选择
+
+
+def pick_photo_size(userid_str: str, sizes: list, mode: str) -> tuple:
+    """按该合成方式的目标选择尺寸，已在缓存或预取中的优先"""
+    return choose_photo_size(sizes, config.photo_target.get(mode, 0),
+                             lambda file_unique_id: file_unique_id in image_cache or photo_prefetcher.has(userid_str, file_unique_id))
+
+
 def save_data_of_photos(message, userid_str):
-    """自己发送图片或从指定频道转发，将图片的 file_id 和 file_unique_id 存入由 user_ID 区分的队列中"""
-    file_id = message.photo[-1].file_id
-    file_unique_id = message.photo[-1].file_unique_id
-    file_data = (file_unique_id, file_id)
+    """自己发送图片或从指定频道转发，将图片的全部尺寸 [(宽, 高, file_unique_id, file_id)] 存入由 user_ID 区分的队列中"""
+    file_data = [(size.width, size.height, size.file_unique_id, size.file_id)
+                 for size in sorted(message.photo, key=lambda size: size.width * size.height)]
     if config.image_list.get(userid_str):
         config.image_list.get(userid_str).append(file_data)
     else:   # 若没有对应列表，先创建，再添加
         config.image_list[userid_str] = []
         config.image_list[userid_str].append(file_data)
+    # 按目前队列的图片数，预计合成方式，后台开始下载合适的尺寸
+    mode = composition_mode(len(config.image_list[userid_str]), config.image_option.get(userid_str + "_array"))
+    _, _, file_unique_id, file_id = pick_photo_size(userid_str, file_data, mode)
+    photo_prefetcher.request(userid_str, file_unique_id, file_id)
 
     # 获得说明文字
     userid_text_str = userid_str + "_text"
@@ -142,6 +196,26 @@ async def send_gif_file(fileIO: io.BytesIO, file_name: str, user_id: int, contex
             os.remove(del_file)   # 不出意外才删除。发送失败后，下次发送直接使用
 
 
+async def send_animation_file(fileIO: io.BytesIO, file_name: str, animation_format: str, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    发送合成的动图。gif 会被 Telegram 转成 mp4，仍用 send_gif_file 另发压缩包；
+    mp4 本来就是 Telegram 动画的格式，webp 以文件发送不会被转换，都只发一次
+    """
+    if animation_format == "gif":
+        await send_gif_file(fileIO, file_name, user_id, context)
+        return
+    try:
+        if animation_format == "mp4":
+            await context.bot.send_animation(chat_id=user_id, animation=fileIO, filename=file_name)
+        else:
+            await context.bot.send_document(chat_id=user_id, document=fileIO, filename=file_name)
+    except error.TimedOut:
+        await context.bot.send_message(chat_id=user_id, text="网络超时，未能成功发送，请重新 /image")
+    except Exception as e:   # 由于网络不畅会引发一系列异常，光有上面那个，还不够
+        print(e)
+        await context.bot.send_message(chat_id=user_id, text="可能网络原因，未能成功发送，请重新 /image")
+
+
 def check_file_in_size(file_size_in_bytes, max_in_size):
     """检查文件，防止过大"""
     file_size_in_mb = file_size_in_bytes / (1024 * 1024)
@@ -187,7 +261,7 @@ async def transfer(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
         else:
             # 通用规则
-            respond = general_logic(update, userid_str, line_center_content)
+            respond = await general_logic(update, userid_str, line_center_content)
             if respond:
                 await context.bot.send_message(chat_id=update.effective_chat.id, text=respond)
     # 不是自己发的，先根据频道分类，再在频道里细分，调用函数处理。（还可能原生发送人选择隐藏）
@@ -224,20 +298,61 @@ async def transfer(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     await context.bot.send_message(chat_id=update.effective_chat.id, text="文件太大")
                     return
             else:
-                respond = general_logic(update, userid_str, line_center_content)
+                respond = await general_logic(update, userid_str, line_center_content)
                 if respond:
                     await context.bot.send_message(chat_id=update.effective_chat.id, text=respond)
         elif channel_name in config.only_url_channel:
             # 只提取网址
             url = extract_urls(update=update)
-            io4urlmsg.append(userid_str, '\n'.join(filter(None, url)) + '\n')
+            await aio4urlmsg.append(userid_str, '\n'.join(filter(None, url)) + '\n')
             await context.bot.send_message(chat_id=update.effective_chat.id, text='url saved.')
         else:
-            respond = general_logic(update, userid_str, line_center_content)
+            respond = await general_logic(update, userid_str, line_center_content)
             if respond:
                 await context.bot.send_message(chat_id=update.effective_chat.id, text=respond)
 
 
+async def fetch_photo(file_unique_id: str, file_id: str) -> bytes:
+    """按 file_unique_id 取出图片的字节，缓存里没有的，才获取下载地址并下载，然后放入缓存"""
+    loop = asyncio.get_running_loop()
+    if (source := await loop.run_in_executor(None, image_cache.get, file_unique_id)) is not None:
+        return source
+
+    urls_cache = config.urls_cache_dict
+    # 检查缓存中是否存在图片下载地址
+    if file_unique_id in urls_cache.keys():
+        url = urls_cache[file_unique_id]
+        print(f"{file_unique_id} is in urls_cache")
+    else:
+        # 用于得到图片 URL
+        bot = Bot(token=config.bot_token)
+        the_file = await bot.get_file(file_id)
+        url = the_file.file_path
+        # 添加图片下载地址到缓存
+        urls_cache[file_unique_id] = url
+        # 删除最旧的键值对，如果缓存超过了20条
+        if len(urls_cache) > 20:
+            urls_cache.popitem(last=False)
+    try:
+        source = (await load_image_sources([url]))[0]
+        await loop.run_in_executor(None, verify_image, source)   # 不是图片的不能放入缓存，不然以后每次都失败
+    except Exception:
+        urls_cache.pop(file_unique_id, None)   # 下载地址可能过期了，下次重新获取
+        raise
+    await loop.run_in_executor(None, image_cache.put, file_unique_id, source)
+    return source
+
+
+photo_prefetcher = PhotoPrefetcher(fetch_photo, concurrency=config.prefetch_concurrency)
+
+
+async def fetch_photos(userid_str: str, image_id_list: list, mode: str) -> list:
+    """按合成方式选择尺寸，取出队列里全部图片的字节，多数已经在进入队列时由后台下载好了"""
+    chosen = [pick_photo_size(userid_str, sizes, mode) for sizes in image_id_list]
+    return await asyncio.gather(*(photo_prefetcher.get(userid_str, file_unique_id, file_id)
+                                  for _, _, file_unique_id, file_id in chosen))
+
+
 async def image_get(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     指令 /image 调用此函数，这个函数根据用户id，取出其列表里图片id列表和说明文字，合成，然后发给用户
@@ -245,12 +360,12 @@ async def image_get(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     user_id = update.effective_chat.id
     userid_str = str(user_id)
-    loop = asyncio.get_event_loop()
 
     # 都是 作为 key，合成图片的参数
     userid_time_str = userid_str + "_time"
     userid_array_str = userid_str + "_array"
     userid_text_str = userid_str + "_text"
+    userid_format_str = userid_str + "_format"
     args = context.args   # 字符串列表
     if args:   # 若存在参数，则不执行 if 代码块下面的内容
         if args[0] == "array":
@@ -277,13 +392,24 @@ async def image_get(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 if not isinstance(actual_duration, (float, int)):
                     await context.bot.send_message(chat_id=update.effective_chat.id, text=f"not float or int, 输入整数或带小数点的")
+                elif actual_duration <= 0:
+                    await context.bot.send_message(chat_id=update.effective_chat.id, text="time should be positive, 要大于 0")
                 else:
                     config.image_option[userid_time_str] = actual_duration
                     await context.bot.send_message(chat_id=update.effective_chat.id,
                                                 text=f"have change time to {actual_duration}")
+        elif args[0] == "format":
+            # 第一个参数若是 format，代表第二个参数是 5 张以上合成动图的格式
+            if len(args) < 2 or args[1] not in ANIMATION_FORMATS:
+                await context.bot.send_message(chat_id=update.effective_chat.id,
+                                               text=f"format 只能是 {', '.join(ANIMATION_FORMATS)} 之一")
+            else:
+                config.image_option[userid_format_str] = args[1]
+                await context.bot.send_message(chat_id=update.effective_chat.id, text=f"have change format to {args[1]}")
         elif args[0] == "clear":
             # 第一个参数若是 clear ，就清空队列里的图片
             config.image_list[userid_str].clear()   # 清空列表
+            photo_prefetcher.cancel(userid_str)   # 不必再下载了
             await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Have cleared pictures in the queue, 已清空队列里的图片")
         else:
             # 其他任何情况，都只是作为修改说明文字
@@ -298,61 +424,74 @@ async def image_get(update: Update, context: ContextTypes.DEFAULT_TYPE):
     random_str = ''.join(random.sample(string.ascii_letters + string.digits, 6))
     text = config.image_list.get(userid_text_str, "processed_image" + random_str)
     image_name = text[0:24]   # 以免说明文字太长
-    urls_cache = config.urls_cache_dict
 
     image_id_list = config.image_list.get(userid_str)
     if image_id_list:   # 有且不为空 []
         image_amount = len(image_id_list)   # 图片数量
-        # 用于得到图片 URL
-        bot = Bot(token=config.bot_token)
-        image_url_list = []   # 存有图片网址的列表
-        for file_unique_id, file_id in image_id_list:
-            # 检查缓存中是否存在图片下载地址
-            if file_unique_id in urls_cache.keys():
-                url = urls_cache[file_unique_id]
-                print(f"{file_unique_id} is in urls_cache")
-            else:
-                the_file = await bot.get_file(file_id)
-                url = the_file.file_path
-                # 添加图片下载地址到缓存
-                urls_cache[file_unique_id] = url
-                # 删除最旧的键值对，如果缓存超过了20条
-                if len(urls_cache) > 20:
-                    urls_cache.popitem(last=False)
-            image_url_list.append(url)
+        array = config.image_option.get(userid_array_str)
+        mode = composition_mode(image_amount, array)
         try:   # 国内开发，有时候网不稳定，下载失败
-            img_list = await open_image_from_various(image_url_list, config.images_cache_dict)
+            sources = await fetch_photos(userid_str, image_id_list, mode)
         except:
             await context.bot.send_message(chat_id=update.effective_chat.id, text="网络原因，未能下载图片，请重新 /image")
             return
+        photo_prefetcher.cancel(userid_str)   # 预计的合成方式变了的，之前下载的其他尺寸用不到了
 
         is_gif = False
-        array = config.image_option.get(userid_array_str)
-        with ProcessPoolExecutor() as pool:
-            if array:   # 如果指定了排列，就按指定的
-                array_image_amount = len([i for j in array for i in j if i > 0])
-                # 还需要检查是不是从 1 递增的
-                if not image_amount == array_image_amount:
+        animation_format = config.image_option.get(userid_format_str, config.animation_format)
+        # 画布超过 Telegram 会压缩的尺寸没有意义，解码时就缩小到预算内
+        canvas_max_pixels = int(config.canvas_max_mp * 1000000)
+        output = {"image_format": config.image_format, "quality": config.image_quality,
+                  "preset": config.image_preset, "max_bytes": int(config.image_max_mb * 1024 * 1024)}
+        # 交给常驻的图片处理进程池
+        try:
+            if mode == "array":   # 如果指定了排列，就按指定的
+                array_indexes = sorted(i for row in normalize_array(array) for i in row if i > 0)
+                # 要正好是从 1 到图片数，每个一次
+                if array_indexes != list(range(1, image_amount + 1)):
                     await context.bot.send_message(chat_id=update.effective_chat.id,
-                                                text=f"排列数组里的图片数 {array_image_amount} 与实际图片数 {image_amount} 不一致，请检查")
+                                                text=f"排列数组里的图片 {array_indexes} 与实际图片数 {image_amount} 不一致，请检查")
+                    return
                 # 若数量一致，可调用函数处理
-                gif_io = await loop.run_in_executor(pool, merge_images_according_array, img_list, middle_interval, array)
+                gif_io = await image_pool.compose(partial(merge_images_according_array, output=output), sources, middle_interval, array, max_pixels=canvas_max_pixels)
                 config.image_option[userid_array_str] = None
             else:   # 根据图片数量，默认的行为
-                if image_amount == 1:
-                    gif_io = await loop.run_in_executor(pool, add_text, img_list, text)
-                elif 1 < image_amount < 5:
-                    gif_io = await loop.run_in_executor(pool, merge_multi_images, img_list, middle_interval)
-                else:   # 超过 4 个，GIF
+                if mode == "text":
+                    gif_io = await image_pool.compose(partial(add_text, output=output), sources, text, max_pixels=canvas_max_pixels)
+                elif mode == "merge":
+                    gif_io = await image_pool.compose(partial(merge_multi_images, output=output), sources, middle_interval, max_pixels=canvas_max_pixels)
+                else:   # 超过 4 个，动图
                     is_gif = True
-                    gif_io = await loop.run_in_executor(pool, generate_gif, img_list, duration_time)
+                    frame_max_pixels = int(config.gif_frame_max_mp * 1000000)
+                    if animation_format == "mp4":
+                        try:
+                            gif_io = await image_pool.compose(generate_mp4, sources, duration_time,
+                                                              max_pixels=frame_max_pixels, per_image=True)
+                        except FileNotFoundError:
+                            await context.bot.send_message(chat_id=update.effective_chat.id, text="没有安装 ffmpeg，改为生成 gif")
+                            animation_format = "gif"
+                        except RuntimeError as e:   # ffmpeg 编码失败
+                            print(e)
+                            await context.bot.send_message(chat_id=update.effective_chat.id, text="生成 mp4 失败，改为生成 gif")
+                            animation_format = "gif"
+                    elif animation_format == "webp":
+                        gif_io = await image_pool.compose(generate_webp, sources, duration_time,
+                                                          max_pixels=frame_max_pixels, per_image=True)
+                    if animation_format == "gif":
+                        gif_io = await image_pool.compose(generate_gif, sources, duration_time,
+                                                          int(config.gif_max_mb * 1024 * 1024), config.gif_time_budget,
+                                                          max_pixels=frame_max_pixels, per_image=True)
+        except Exception as e:   # 图片无法解码等，队列保留，可以重新 /image
+            print(f"fail to compose images: {e!r}")
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=f"合成图片失败：{e}")
+            return
 
         config.image_list[userid_str].clear()   # 清空列表
         if is_gif:
-            image_name += ".gif"
-            await send_gif_file(gif_io, image_name, user_id, context)
+            image_name += "." + animation_format
+            await send_animation_file(gif_io, image_name, animation_format, user_id, context)
         else:
-            image_name += ".png"
+            image_name += "." + EXTENSIONS[config.image_format]
             try:
                 await context.bot.send_photo(chat_id=update.effective_chat.id, photo=gif_io, filename=image_name)
             except error.TimedOut:
@@ -373,6 +512,51 @@ def exec_command(command2exec, datafile):
     subprocess.call(actual_command, shell=True)
 
 
+async def iter_stored(userid_str: str):
+    """逐条读出保存的全部内容，消息在前，网址在后，和 read_all_stored 拼出的一致"""
+    async for record in aio4message.aiter_read(userid_str):
+        yield record
+    yield "\n\n"
+    async for record in aio4urlmsg.aiter_read(userid_str):
+        yield record
+
+
+async def push_in_pages(userid_str: str, push_base: str, see_base: str, page_size: int, concurrency: int):
+    """
+    边读边分页，并发推送到 push_base-1、push_base-2 …，同时推送的页数不超过 concurrency，内存中最多也只有这么多页
+    多于一页时，在 push_base 写入目录页。返回 (页数, 只有一页时的内容, 总字节数)，只有一页时不推送，交给调用者
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = []
+    page_amount = 0
+    total_bytes = 0
+    first_page = None
+
+    async def upload(i, page):
+        try:
+            await aio4push._write(f"{push_base}-{i}", page)
+        finally:
+            semaphore.release()
+
+    async for page in split_pages(iter_stored(userid_str), page_size):
+        page_amount += 1
+        total_bytes += len(page.encode('utf-8'))
+        if page_amount == 1:   # 等知道有没有第二页，再决定是否分页
+            first_page = page
+            continue
+        if page_amount == 2:
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(upload(1, first_page)))
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(upload(page_amount, page)))
+    await asyncio.gather(*tasks)
+
+    if page_amount > 1:
+        index_page = f"{page_amount} pages, {total_bytes} bytes\n共 {page_amount} 页\n\n" + "\n".join(f"{see_base}-{i}" for i in range(1, page_amount + 1))
+        await aio4push._write(push_base, index_page)
+    return page_amount, first_page, total_bytes
+
+
 # 推送到
 async def push(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_chat.id   # 存有信息的文件
@@ -382,8 +566,52 @@ async def push(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 配置文件或通过命令，有设置路径则取用，没有就随机
     netstr = config.netstr if config.netstr else config.path_dict.get(str(user_id), random_str)
 
+    if config.push_page_size:
+        # 分页推送，内容分块推送到 netstr-1、netstr-2 …，netstr 是目录页
+        if config.push_dir and os.path.exists(config.push_dir):
+            push_base, see_base = netstr, config.domain + netstr
+        else:
+            push_base = (config.push_dir if config.push_dir else config.author_webnote) + netstr
+            see_base = push_base
+        start_time = time.perf_counter()
+        page_amount, single_page, total_bytes = await push_in_pages(userid_str, push_base, see_base, config.push_page_size * 1024, config.push_concurrency)
+        if page_amount > 1:
+            spend_time = time.perf_counter() - start_time
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=f"push done. {page_amount} pages, {total_bytes / 1024:.1f} KB in {spend_time:.2f}s\n"
+                                                                                f"please visit {see_base}\n"
+                                                                                f"推送完成，共 {page_amount} 页，访问上面网址查看目录")
+            await ask_whether_clear(update, context)
+            return
+        if not single_page.strip():
+            await context.bot.send_message(chat_id=update.effective_chat.id, text="nothing to push")
+            return
+        # 只有一页，和不分页一样推送
+        await aio4push.append(push_base, single_page)
+        spend_time = time.perf_counter() - start_time
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"push done. {total_bytes / 1024:.1f} KB in {spend_time:.2f}s\n"
+                                                                            f"please visit {see_base}\n"
+                                                                            f"推送完成，访问上面网址查看")
+        await ask_whether_clear(update, context)
+        return
+
+    if aio4message.record_based and config.push_dir and os.path.exists(config.push_dir):
+        # 按记录存储，且推送到本地目录，则逐段流式写入，不在内存中拼出全部内容
+        # 下面直接读同步的存储，先把写缓冲里的写入
+        await flush_stores(userid_str)
+        if not (await aio4message.count(userid_str) or await aio4urlmsg.count(userid_str)):
+            await context.bot.send_message(chat_id=update.effective_chat.id, text="nothing to push")
+            return
+        stored_chunks = itertools.chain(io4message.iter_read(userid_str), ("\n\n",), io4urlmsg.iter_read(userid_str))
+        await aio4push.append_chunks(netstr, stored_chunks)
+        where2see = config.domain + netstr
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"push done. "
+                                                                            f"please visit {where2see}\n"
+                                                                            f"推送完成，访问上面网址查看")
+        await ask_whether_clear(update, context)
+        return
+
     # 读取保存的
-    all_stored = io4message.read(userid_str) + "\n\n" + io4urlmsg.read(userid_str)
+    all_stored = await read_all_stored(userid_str)
     
     if not all_stored.strip():
         # 内容为空
@@ -394,10 +622,10 @@ async def push(update: Update, context: ContextTypes.DEFAULT_TYPE):
 	    # 推送
         push2somewhere = config.push_dir + netstr   # 为用户分配路径
         if os.path.exists(config.push_dir):   # 若是本地目录
-            io4push.append(netstr, all_stored)
+            await aio4push.append(netstr, all_stored)
             where2see = config.domain + netstr
         elif urlparse(config.push_dir).scheme in ('http', 'https'):   # 若是网址路径
-            io4push.append(push2somewhere, all_stored)
+            await aio4push.append(push2somewhere, all_stored)
             where2see = push2somewhere
         else:
             await context.bot.send_message(chat_id=config.chat_id, text="配置文件中，push_dir 填写有误")
@@ -408,11 +636,16 @@ async def push(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         # 都没的话，就默认发到作者的网络记事本上
         push2somewhere = config.author_webnote + netstr
-        io4push.append(push2somewhere, all_stored)
+        await aio4push.append(push2somewhere, all_stored)
         await context.bot.send_message(chat_id=update.effective_chat.id, text=f"push done. "
                                                                     f"please visit {push2somewhere}\n"
                                                                     f"推送完成，访问上面网址查看")
 
+    await ask_whether_clear(update, context)
+
+
+async def ask_whether_clear(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """推送后，询问是否清空已转存的"""
     # 制作对话内的键盘，第一个是专门的结构，第二个函数是将这个结构转成
     inline_kb = [
         [
@@ -425,6 +658,68 @@ async def push(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_message(chat_id=update.effective_chat.id, text="and then ...", reply_markup=kb_markup)
 
 
+def iter_records(store, userid_str: str):
+    """逐条读出同步存储的内容，整体存储的作为一条"""
+    if getattr(store, "record_based", False):
+        yield from store.iter_read(userid_str)
+    else:
+        yield store.read(userid_str)
+
+
+async def take_snapshot(userid_str: str, then=None) -> tuple:
+    """
+    保存消息和网址的快照，在线程池中执行，返回 (快照id, 新写入的字节数)
+    then 是快照之后紧接着执行的同步函数，如清空。两者都在持有这个用户的存储锁时进行，
+    中间不会插入别的写入；这期间转发的消息留在写缓冲里，之后才写入，不会被清空
+    """
+    await flush_stores(userid_str)
+
+    def snapshot_then():
+        fields = {"forward": iter_records(io4message, userid_str), "forward_url": iter_records(io4urlmsg, userid_str)}
+        result = snapshots.take(userid_str, fields)
+        if then:
+            then()
+        return result
+
+    async with aio4message.lock(userid_str), aio4urlmsg.lock(userid_str):
+        return await asyncio.get_running_loop().run_in_executor(None, snapshot_then)
+
+
+# 列出快照，或恢复某个快照
+async def restore(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    userid_str = str(update.effective_chat.id)
+    loop = asyncio.get_running_loop()
+    snapshot_list = await loop.run_in_executor(None, snapshots.list, userid_str)
+    if not snapshot_list:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="You don't have any snapshot. 没有快照。")
+        return
+
+    args = context.args
+    if not args:
+        lines = []
+        for i, (_, manifest) in enumerate(snapshot_list, start=1):
+            saved_time = datetime.datetime.fromtimestamp(manifest["time"]).strftime("%Y-%m-%d %H:%M:%S")
+            sizes = [manifest["fields"].get(field, {}).get("size", 0) / 1024 for field in ("forward", "forward_url")]
+            lines.append(f"{i}. {saved_time}  messages {sizes[0]:.1f} KB, urls {sizes[1]:.1f} KB")
+        await context.bot.send_message(chat_id=update.effective_chat.id,
+                                       text="Snapshots, newest first. 快照，从新到旧：\n" + "\n".join(lines) +
+                                            "\n\n/restore 1 恢复第一个，当前保存的会先存为快照")
+        return
+
+    if not (args[0].isdigit() and 0 < int(args[0]) <= len(snapshot_list)):
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"格式为： /restore n ，n 在 1 到 {len(snapshot_list)} 之间")
+        return
+    snapshot_id = snapshot_list[int(args[0]) - 1][0]
+    # 先读出要恢复的，再把当前的存为快照，以免要恢复的那份正好被清理掉
+    message = "".join(await loop.run_in_executor(None, lambda: list(snapshots.read(userid_str, snapshot_id, "forward"))))
+    url_message = "".join(await loop.run_in_executor(None, lambda: list(snapshots.read(userid_str, snapshot_id, "forward_url"))))
+    def overwrite():
+        io4message.bulk_load([(userid_str, split_records(message, False))])
+        io4urlmsg.bulk_load([(userid_str, split_records(url_message, True))])
+    await take_snapshot(userid_str, then=overwrite)
+    await context.bot.send_message(chat_id=update.effective_chat.id, text="restore done. 已恢复。")
+
+
 # 只是询问，确认删除转存内容
 async def sure_clear(update: Update, context: ContextTypes.DEFAULT_TYPE):
     inline_kb = [
@@ -461,17 +756,19 @@ async def clear_or_delete_all_my_data(update: Update, context: ContextTypes.DEFA
     await query.answer()
 
     if query.data == 'clearall':
-        io4message.backup(userid_str)
-        io4urlmsg.backup(userid_str)
-        io4message.clear(userid_str)
-        io4urlmsg.clear(userid_str)
-        await query.edit_message_text(text=f"Selected option: {query.data}, clear done. 已清空。")
+        # 清空前保存快照，可用 /restore 恢复
+        def clear_both():
+            io4message.clear(userid_str)
+            io4urlmsg.clear(userid_str)
+        await take_snapshot(userid_str, then=clear_both)
+        await query.edit_message_text(text=f"Selected option: {query.data}, clear done. 已清空，可用 /restore 恢复。")
     elif query.data == 'notclear':
         await query.edit_message_text(text="OK, I haven't clear yet. 放心，还没清除。")
     # 删除数据相关的
     elif query.data == 'confirm_delete':
-        io4message.del_data(userid_str)
-        io4urlmsg.del_data(userid_str)
+        await aio4message.del_data(userid_str)
+        await aio4urlmsg.del_data(userid_str)
+        await asyncio.get_running_loop().run_in_executor(None, snapshots.del_data, userid_str)
         await query.edit_message_text(text=f"All Your Data Has been Deleted.")
     elif query.data == 'cancel_delete':
         await query.edit_message_text(text="Cancel Deleting")
@@ -483,19 +780,29 @@ async def earliest_msg(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_chat.id
     userid_str = str(user_id)
 
-    stored = io4message.read(userid_str)
-    stored_url = io4urlmsg.read(userid_str)
+    if aio4message.record_based:
+        # 按记录存储的，消息只需读索引，不必读取全部
+        msg_count = await aio4message.count(userid_str)
+        # 一条网址记录可能有多行网址，和整体存储的一样按行数统计
+        url_count = 0
+        async for record in aio4urlmsg.aiter_read(userid_str):
+            url_count += record.count('\n')
+        earliest = await aio4message.earliest(userid_str)
+        stored = earliest[1] if earliest else ""
+        is_empty = not (msg_count or url_count)
+    else:
+        stored, stored_url = await read_both(userid_str)
+        is_empty = not (stored or stored_url)
+        # 统计消息数量
+        msg_count = sum(line[0:27] == '-' * 27 for line in stored.split('\n'))
+        url_count = len(stored_url.split('\n')) - 1
 
     # 如果两个都为空
-    if not (stored or stored_url):
+    if is_empty:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="You don't have any message. "
                                                                                 "你没有任何数据。")
         return
 
-    # 统计消息数量
-    msg_count = sum(line[0:27] == '-' * 27 for line in stored.split('\n'))
-    url_count = len(stored_url.split('\n')) - 1
-    
     first_msg = stored.split('\n', maxsplit=1)[0].strip('-')
 
     await context.bot.send_message(chat_id=update.effective_chat.id,
@@ -505,18 +812,12 @@ async def earliest_msg(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                         f'最早的消息是：')
 
 
-# 删除最新添加的一条会返回文本，可以实现外显链接，
-async def delete_last_msg(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_chat.id
-    userid_str = str(user_id)
-
-    stored = io4message.read(userid_str)
+async def pop_last_msg_from_text(userid_str: str) -> str:
+    """整体存储的，读出全部，从后往前找到最后一条的分割线，删除并返回这一条"""
+    stored = await aio4message.read(userid_str)
     if not stored:
-        await context.bot.send_message(chat_id=update.effective_chat.id, text="You don't have any message "
-                                                                                "except for url."
-                                                                                "你没有任何数据，可能有网址。")
-        return
-    
+        return ""
+
     stored_list = stored.split('\n')
     i = 0
     for line in reversed(stored_list):
@@ -526,7 +827,25 @@ async def delete_last_msg(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     last_message = '\n'.join(stored_list[i:])
     new_stored = '\n'.join(stored_list[:i])
-    io4message._write(userid_str, new_stored)
+    await aio4message._write(userid_str, new_stored)
+    return last_message
+
+
+# 删除最新添加的一条会返回文本，可以实现外显链接，
+async def delete_last_msg(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_chat.id
+    userid_str = str(user_id)
+
+    if aio4message.record_based:
+        # 按记录存储的，直接截断最后一条
+        last_message = await aio4message.pop_last(userid_str)
+    else:
+        last_message = await pop_last_msg_from_text(userid_str)
+    if not last_message:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="You don't have any message "
+                                                                                "except for url."
+                                                                                "你没有任何数据，可能有网址。")
+        return
 
     # 发送到tg
     await context.bot.send_message(chat_id=update.effective_chat.id, text=f'Here is the last message you saved\n'
@@ -534,11 +853,40 @@ async def delete_last_msg(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_message(chat_id=update.effective_chat.id, text=last_message)
 
 
+async def flush_stores(userid_str: str=None):
+    """把写缓冲里的追加写入存储，不传用户则写入全部用户的"""
+    for store in (aio4message, aio4urlmsg):
+        if isinstance(store, WriteBehindBuffer):
+            if userid_str is None:
+                await store.flush_all()
+            else:
+                await store.flush(userid_str)
+
+
+async def start_on_startup(application):
+    """机器人启动时调用，预先启动图片处理进程"""
+    await image_pool.start()
+
+
+async def flush_on_shutdown(application):
+    """机器人停止时调用，不丢失缓冲中的数据。写入失败的异常会抛出，但连接池和进程池照样关闭"""
+    try:
+        await flush_stores()
+        await persistent_syncer.flush_all()
+    finally:
+        print(f"http pool: {http_pool.stats()}")
+        await http_pool.aclose()
+        print(f"image pool: {image_pool.stats()}")
+        image_pool.shutdown()
+
+
 # 关闭机器人
 async def shutdown(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_chat.id
     if user_id in config.manage_id:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="robot will shutdown immediately")
+        await flush_stores()
+        await persistent_syncer.flush_all()
         # 在程序停止运行时将字典保存回文件
         with open(config.json_file, 'w') as file:
             json.dump(config.path_dict, file)
@@ -549,6 +897,22 @@ async def shutdown(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                        text="You are not authorized to execute this command")
 
 
+# 运行状态，管理员命令
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_chat.id
+    if user_id in config.manage_id:
+        lines = [f"http pool: {http_pool.stats()}", f"image pool: {image_pool.stats()}", f"image cache: {image_cache.stats()}",
+                 f"photo prefetch: {photo_prefetcher.stats()}"]
+        if counter := getattr(aio4push, "counter", None):
+            lines.append(f"webnote shadow: {dict(counter)}")
+        if codec := getattr(io4message, "codec", None):
+            lines.append(f"compression: {codec.stats()}")
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="\n".join(lines))
+    else:
+        await context.bot.send_message(chat_id=update.effective_chat.id,
+                                       text="You are not authorized to execute this command")
+
+
 # 重载配置文件
 async def reload_config(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_chat.id
@@ -0,0 +1,82 @@
+"""
+同步路径（/set persistent）的后台同步，转存时只登记一下，不等待网络记事本
+"""
+import asyncio
+import hashlib
+import time
+
+
+class PersistentSyncer:
+    """
+    按用户合并同步请求，连续转发时，等到安静 debounce 秒后才同步一次，最长不超过 max_wait 秒
+    同步前计算内容的哈希，和上次提交的一样就不再提交
+    """
+    def __init__(self, read_all, push_store, debounce: float=10, max_wait: float=60):
+        self.read_all = read_all   # 协程函数，传入用户 id，返回要同步的全部内容
+        self.push_store = push_store   # 异步的推送存储，使用其 _write 覆盖提交
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self._requests = {}   # 用户 id: [同步网址, 第一次请求时间, 最后一次请求时间]
+        self._tasks = {}   # 还在等待的
+        self._running = {}   # 用户 id: 正在提交的任务
+        self._hashes = {}   # 同步网址: 上次提交内容的哈希
+
+    def request(self, userid_str: str, url: str):
+        """登记一次同步请求，立即返回"""
+        now = time.monotonic()
+        if userid_str in self._requests:
+            self._requests[userid_str][0] = url
+            self._requests[userid_str][2] = now
+        else:
+            self._requests[userid_str] = [url, now, now]
+            self._tasks[userid_str] = asyncio.create_task(self._wait_and_sync(userid_str))
+
+    async def _wait_and_sync(self, userid_str: str):
+        while True:
+            _, first, last = self._requests[userid_str]
+            now = time.monotonic()
+            wait = min(last + self.debounce, first + self.max_wait) - now
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        url = self._requests.pop(userid_str)[0]
+        self._tasks.pop(userid_str, None)
+        # 同一用户上一次的还在提交的，等它完成再读取、提交，保证按顺序，最后提交的是最新的
+        previous = self._running.get(userid_str)
+        self._running[userid_str] = asyncio.current_task()
+        try:
+            if previous:
+                await asyncio.gather(previous, return_exceptions=True)
+            await self.sync(userid_str, url)
+        except Exception as e:
+            print(f"persistent sync failed for {userid_str}: {e}")
+        finally:
+            if self._running.get(userid_str) is asyncio.current_task():
+                self._running.pop(userid_str)
+
+    async def sync(self, userid_str: str, url: str) -> bool:
+        """读取并提交，内容没变就跳过，返回是否提交了"""
+        content = await self.read_all(userid_str)
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        if self._hashes.get(url) == content_hash:
+            return False
+        await self.push_store._write(url, content)
+        self._hashes[url] = content_hash
+        return True
+
+    async def flush_all(self):
+        """
+        不再等待，立即同步全部登记的，关闭机器人时调用
+        还在等待的直接取消；正在提交的不能取消，不然提交到一半就退出了，等它完成，之后登记的再同步，不会被旧内容覆盖
+        """
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        if self._running:
+            await asyncio.gather(*self._running.values(), return_exceptions=True)
+        for userid_str in list(self._requests):
+            url = self._requests.pop(userid_str)[0]
+            try:
+                await self.sync(userid_str, url)
+            except Exception as e:
+                print(f"persistent sync failed for {userid_str}: {e}")